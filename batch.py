@@ -0,0 +1,369 @@
+""" Vectorized analysis of many positions at once with NumPy bitboards.
+
+A batch is an (N, 2, 6) uint64 array of bitboards, indexed by position,
+color (0 white, 1 black) and piece type in piece_letters order (pawn,
+knight, bishop, rook, queen, king), plus an (N,) uint8 array with the side
+to move. Bit i stands for square i, so bit 0 is a8 and bit 63 is h1, as in
+rules.py. Every function works on whole arrays with shifts and masks; there
+is no Python loop over positions.
+
+Castling rights and the en passant square come as two more (N,) uint8
+arrays, in the rules' bitmask and with NO_SQUARE for none, as in fen's
+binary records. """
+import numpy as np
+
+from fen import NO_SQUARE, RECORD_SIZE, piece_codes
+from rules import castling_colors, castling_paths, castling_squares, piece_letters
+
+WHITE = 0
+BLACK = 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+type_index = {piece_type: index for index, piece_type in enumerate(piece_letters)}
+
+ALL = np.uint64(0xFFFFFFFFFFFFFFFF)
+FILE_A = np.uint64(sum(1 << (row * 8) for row in range(8)))
+FILE_B = FILE_A << np.uint64(1)
+FILE_G = FILE_A << np.uint64(6)
+FILE_H = FILE_A << np.uint64(7)
+NOT_A = ~FILE_A
+NOT_H = ~FILE_H
+NOT_AB = ~(FILE_A | FILE_B)
+NOT_GH = ~(FILE_G | FILE_H)
+# Rows just in front of each side's pawns, where a double push passes
+WHITE_PUSH_ROW = np.uint64(0xFF << 40)
+BLACK_PUSH_ROW = np.uint64(0xFF << 16)
+# Pawn moves onto these rows promote, four ways each
+PROMOTION_ROWS = np.uint64(0xFF | 0xFF << 56)
+
+# Sliding directions as (square step, mask of squares a step may land on)
+ORTHOGONAL = ((1, NOT_A), (-1, NOT_H), (-8, ALL), (8, ALL))
+DIAGONAL = ((-7, NOT_A), (-9, NOT_H), (9, NOT_A), (7, NOT_H))
+KNIGHT_STEPS = (
+    (-17, NOT_H), (-15, NOT_A), (17, NOT_A), (15, NOT_H),
+    (-10, NOT_GH), (6, NOT_GH), (-6, NOT_AB), (10, NOT_AB),
+)
+KING_STEPS = ORTHOGONAL + DIAGONAL
+
+
+def square_mask(squares):
+    mask = 0
+    for square in squares:
+        mask |= 1 << square
+    return np.uint64(mask)
+
+
+# Per castling right: (right, side to move as 0 / 1, king square, rook
+# square, squares that must be empty, squares that must not be attacked)
+CASTLING = tuple(
+    (
+        right,
+        castling_colors[right] == "black",
+        square_mask([king_square]),
+        square_mask([rook_square]),
+        square_mask(castling_paths[right][1]),
+        square_mask(castling_paths[right][2]),
+    )
+    for right, (king_square, rook_square) in castling_squares.items()
+)
+
+if hasattr(np, "bitwise_count"):
+    def popcount(bitboards):
+        return np.bitwise_count(bitboards).astype(np.int64)
+else:
+    def popcount(bitboards):
+        bitboards = bitboards - ((bitboards >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        bitboards = (bitboards & np.uint64(0x3333333333333333)) + (
+            (bitboards >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        bitboards = (bitboards + (bitboards >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return ((bitboards * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def shift(bitboards, step):
+    """ Move every bit step squares; bits leaving the board are dropped """
+    if step > 0:
+        return bitboards << np.uint64(step)
+    return bitboards >> np.uint64(-step)
+
+
+def step_targets(bitboards, step, mask):
+    return shift(bitboards, step) & mask
+
+
+def ray_attacks(sliders, empty, step, mask):
+    """ Squares attacked by sliders in one direction, up to and including
+    the first occupied square (Kogge-Stone fill) """
+    propagate = empty & mask
+    sliders = sliders | (propagate & shift(sliders, step))
+    propagate = propagate & shift(propagate, step)
+    sliders = sliders | (propagate & shift(sliders, 2 * step))
+    propagate = propagate & shift(propagate, 2 * step)
+    sliders = sliders | (propagate & shift(sliders, 4 * step))
+    return shift(sliders, step) & mask
+
+
+def pawn_captures(pawns, color):
+    """ (toward the a-file, toward the h-file) capture targets of pawns,
+    where color is an (N,) array of 0 / 1 """
+    white = color == WHITE
+    left = np.where(white, shift(pawns & NOT_A, -9), shift(pawns & NOT_A, 7))
+    right = np.where(white, shift(pawns & NOT_H, -7), shift(pawns & NOT_H, 9))
+    return left, right
+
+
+def pawn_pushes(pawns, color, empty):
+    """ (single, double) push targets """
+    white = color == WHITE
+    single = np.where(white, shift(pawns, -8), shift(pawns, 8)) & empty
+    push_row = np.where(white, WHITE_PUSH_ROW, BLACK_PUSH_ROW)
+    double = np.where(white, shift(single & push_row, -8), shift(single & push_row, 8)) & empty
+    return single, double
+
+
+def side_attacks(pieces, color, occupied):
+    """ Union of the squares attacked by one side's pieces, an (N, 6)
+    array, with occupied as the blockers """
+    empty = ~occupied
+    left, right = pawn_captures(pieces[:, PAWN], color)
+    attacks = left | right
+    for step, mask in KNIGHT_STEPS:
+        attacks |= step_targets(pieces[:, KNIGHT], step, mask)
+    for step, mask in KING_STEPS:
+        attacks |= step_targets(pieces[:, KING], step, mask)
+    rooks = pieces[:, ROOK] | pieces[:, QUEEN]
+    bishops = pieces[:, BISHOP] | pieces[:, QUEEN]
+    for step, mask in ORTHOGONAL:
+        attacks |= ray_attacks(rooks, empty, step, mask)
+    for step, mask in DIAGONAL:
+        attacks |= ray_attacks(bishops, empty, step, mask)
+    return attacks
+
+
+def attack_maps(bitboards):
+    """ (N, 2) uint64 of the squares each color attacks or defends """
+    occupied = np.bitwise_or.reduce(bitboards.reshape(len(bitboards), 12), axis=1)
+    count = len(bitboards)
+    return np.stack([
+        side_attacks(bitboards[:, WHITE], np.zeros(count, np.uint8), occupied),
+        side_attacks(bitboards[:, BLACK], np.ones(count, np.uint8), occupied),
+    ], axis=1)
+
+
+def split_sides(bitboards, side_to_move):
+    index = np.arange(len(bitboards))
+    side_to_move = side_to_move.astype(np.intp)
+    return bitboards[index, side_to_move], bitboards[index, 1 - side_to_move]
+
+
+def checkers(own, enemy, side_to_move, occupied):
+    """ Enemy pieces giving check to the side to move """
+    king = own[:, KING]
+    empty = ~occupied
+    # A piece of ours on the king's square would attack what attacks it
+    left, right = pawn_captures(king, side_to_move)
+    found = (left | right) & enemy[:, PAWN]
+    for step, mask in KNIGHT_STEPS:
+        found |= step_targets(king, step, mask) & enemy[:, KNIGHT]
+    rooks = enemy[:, ROOK] | enemy[:, QUEEN]
+    bishops = enemy[:, BISHOP] | enemy[:, QUEEN]
+    for step, mask in ORTHOGONAL:
+        found |= ray_attacks(king, empty, step, mask) & rooks
+    for step, mask in DIAGONAL:
+        found |= ray_attacks(king, empty, step, mask) & bishops
+    return found
+
+
+def check_flags(bitboards, side_to_move):
+    """ (N,) bool, whether the side to move is in check """
+    own, enemy = split_sides(bitboards, side_to_move)
+    occupied = np.bitwise_or.reduce(own, axis=1) | np.bitwise_or.reduce(enemy, axis=1)
+    return checkers(own, enemy, side_to_move, occupied) != 0
+
+
+def piece_targets(pieces, side_to_move, empty, enemy_all, allowed):
+    """ Per-position count of moves by pieces (an (N, 6) array of our
+    pieces, kings excluded) to squares in allowed. Moves in one direction
+    from different pieces never share a target, so summing the popcount of
+    each direction counts every move once. """
+    total = np.zeros(len(pieces), np.int64)
+    left, right = pawn_captures(pieces[:, PAWN], side_to_move)
+    single, double = pawn_pushes(pieces[:, PAWN], side_to_move, empty)
+    for targets in (left & enemy_all, right & enemy_all, single):
+        targets = targets & allowed
+        total += popcount(targets) + 3 * popcount(targets & PROMOTION_ROWS)
+    total += popcount(double & allowed)
+    not_own = empty | enemy_all
+    for step, mask in KNIGHT_STEPS:
+        total += popcount(step_targets(pieces[:, KNIGHT], step, mask) & not_own & allowed)
+    rooks = pieces[:, ROOK] | pieces[:, QUEEN]
+    bishops = pieces[:, BISHOP] | pieces[:, QUEEN]
+    for step, mask in ORTHOGONAL:
+        total += popcount(ray_attacks(rooks, empty, step, mask) & not_own & allowed)
+    for step, mask in DIAGONAL:
+        total += popcount(ray_attacks(bishops, empty, step, mask) & not_own & allowed)
+    return total
+
+
+def legal_move_counts(bitboards, side_to_move, castling=None, en_passant=None):
+    """ (N,) number of legal moves for the side to move, and (N,) bool
+    check flags. Without castling or en_passant arrays there are no
+    castling moves or en passant captures.
+
+    King moves avoid every square the enemy attacks with our king lifted
+    off the board. Other pieces must block or capture a single checker and
+    cannot move at all against two. A pinned piece moves only along the
+    line between our king and the pinner. Promotions count once per piece
+    they may become. En passant captures, which take a pawn off a line of
+    their own, are tried on the bitboards one direction at a time. """
+    count = len(bitboards)
+    own, enemy = split_sides(bitboards, side_to_move)
+    own_all = np.bitwise_or.reduce(own, axis=1)
+    enemy_all = np.bitwise_or.reduce(enemy, axis=1)
+    occupied = own_all | enemy_all
+    empty = ~occupied
+    king = own[:, KING]
+
+    found = checkers(own, enemy, side_to_move, occupied)
+    in_check = found != 0
+    double_check = popcount(found) > 1
+
+    # Squares that resolve a single check: the checker, or between it and
+    # our king for a slider
+    check_mask = np.where(in_check, found, ALL)
+    between = np.zeros(count, np.uint64)
+    for directions, slider_types in ((ORTHOGONAL, (ROOK, QUEEN)), (DIAGONAL, (BISHOP, QUEEN))):
+        sliders = enemy[:, slider_types[0]] | enemy[:, slider_types[1]]
+        for step, mask in directions:
+            ray = ray_attacks(king, empty, step, mask)
+            between |= np.where((ray & found & sliders) != 0, ray & ~found, np.uint64(0))
+    check_mask |= np.where(in_check, between, np.uint64(0))
+    check_mask = np.where(double_check, np.uint64(0), check_mask)
+
+    # Pins: our first piece along a ray from the king, with an enemy slider
+    # of the right kind right behind it
+    pinned_all = np.zeros(count, np.uint64)
+    pinned_moves = np.zeros(count, np.int64)
+    for directions, slider_types in ((ORTHOGONAL, (ROOK, QUEEN)), (DIAGONAL, (BISHOP, QUEEN))):
+        sliders = enemy[:, slider_types[0]] | enemy[:, slider_types[1]]
+        for step, mask in directions:
+            first_ray = ray_attacks(king, empty, step, mask)
+            blocker = first_ray & own_all
+            second_ray = ray_attacks(blocker, empty, step, mask)
+            pinned = np.where((second_ray & sliders) != 0, blocker, np.uint64(0))
+            if not pinned.any():
+                continue
+            line = (first_ray | second_ray) & ~pinned
+            pinned_pieces = own & pinned[:, None]
+            pinned_pieces[:, KING] = 0
+            pinned_moves += piece_targets(
+                pinned_pieces, side_to_move, empty, enemy_all, line & check_mask)
+            pinned_all |= pinned
+
+    free = own & ~pinned_all[:, None]
+    free[:, KING] = 0
+    moves = piece_targets(free, side_to_move, empty, enemy_all, check_mask) + pinned_moves
+
+    # The king may not stay on a line it currently blocks, so attacks are
+    # worked out with it lifted off the board
+    danger = side_attacks(enemy, 1 - side_to_move, occupied & ~king)
+    king_moves = np.zeros(count, np.uint64)
+    for step, mask in KING_STEPS:
+        king_moves |= step_targets(king, step, mask)
+    moves += popcount(king_moves & ~own_all & ~danger)
+
+    if castling is not None:
+        for right, color, king_square, rook_square, empty_squares, path in CASTLING:
+            moves += (
+                (side_to_move == color) & ((castling & right) != 0)
+                & ((king & king_square) != 0) & ((own[:, ROOK] & rook_square) != 0)
+                & ((occupied & empty_squares) == 0) & ((danger & path) == 0)
+            )
+
+    if en_passant is not None and (en_passant != NO_SQUARE).any():
+        moves += en_passant_counts(own, enemy, side_to_move, occupied, en_passant)
+    return moves, in_check
+
+
+def en_passant_counts(own, enemy, side_to_move, occupied, en_passant):
+    """ (N,) number of legal en passant captures """
+    present = en_passant != NO_SQUARE
+    target = np.where(
+        present, np.left_shift(np.uint64(1), np.where(present, en_passant, 0).astype(np.uint64)),
+        np.uint64(0))
+    white = side_to_move == WHITE
+    taken = np.where(white, shift(target, 8), shift(target, -8)) & enemy[:, PAWN]
+    target = np.where(taken != 0, target, np.uint64(0))
+    counts = np.zeros(len(own), np.int64)
+    # Our pawns that attack the target stand where an enemy pawn on it
+    # would capture
+    for sources in pawn_captures(target, 1 - side_to_move):
+        mover = sources & own[:, PAWN]
+        if not mover.any():
+            continue
+        after_own = own.copy()
+        after_own[:, PAWN] ^= mover | np.where(mover != 0, target, np.uint64(0))
+        after_enemy = enemy.copy()
+        after_enemy[:, PAWN] &= ~np.where(mover != 0, taken, np.uint64(0))
+        after = np.bitwise_or.reduce(after_own, axis=1) | np.bitwise_or.reduce(after_enemy, axis=1)
+        safe = checkers(after_own, after_enemy, side_to_move, after) == 0
+        counts += (mover != 0) & safe
+    return counts
+
+
+def analyse(bitboards, side_to_move, castling=None, en_passant=None):
+    """ Attack maps, legal move counts and check flags for a batch """
+    counts, in_check = legal_move_counts(bitboards, side_to_move, castling, en_passant)
+    return {"attacks": attack_maps(bitboards), "move_counts": counts, "in_check": in_check}
+
+
+def from_sets(piece_sets):
+    """ Batch arrays (bitboards, side to move, castling, en passant) for a
+    sequence of sets to move """
+    bitboards = np.zeros((len(piece_sets), 2, 6), np.uint64)
+    side_to_move = np.zeros(len(piece_sets), np.uint8)
+    castling = np.zeros(len(piece_sets), np.uint8)
+    en_passant = np.full(len(piece_sets), NO_SQUARE, np.uint8)
+    for index, piece_set in enumerate(piece_sets):
+        position = bitboards[index]
+        masks = [[0] * 6, [0] * 6]
+        for piece in piece_set.board.squares:
+            if piece is not None:
+                masks[piece.color == "black"][type_index[piece.piece_type]] |= 1 << piece.location
+        position[:] = masks
+        side_to_move[index] = piece_set.color == "black"
+        board = piece_set.board
+        castling[index] = board.castling
+        if board.en_passant is not None:
+            en_passant[index] = board.en_passant
+    return bitboards, side_to_move, castling, en_passant
+
+
+def from_records(data):
+    """ Batch arrays, as from_sets gives them, straight from
+    fen.encode_positions records without building any sets """
+    records = np.frombuffer(data, np.uint8).reshape(-1, RECORD_SIZE)
+    count = len(records)
+    occupancy = records[:, 0:8].copy().view("<u8")[:, 0].astype(np.uint64)
+    packed = records[:, 8:24]
+    codes = np.empty((count, 32), np.uint8)
+    codes[:, 0::2] = packed & 15
+    codes[:, 1::2] = packed >> 4
+    # piece code -> flat (color, type) index into the 12 bitboards
+    code_to_board = np.zeros(16, np.intp)
+    for (color, piece_type), code in piece_codes.items():
+        code_to_board[code] = (color == "black") * 6 + type_index[piece_type]
+
+    bitboards = np.zeros((count, 12), np.uint64)
+    index = np.arange(count)
+    seen = np.zeros(count, np.intp)
+    for square in range(64):
+        bit = np.uint64(1 << square)
+        present = (occupancy & bit) != 0
+        if not present.any():
+            continue
+        rows = index[present]
+        boards = code_to_board[codes[rows, seen[rows]]]
+        bitboards[rows, boards] |= bit
+        seen[rows] += 1
+    side_to_move = records[:, 24] & 1
+    castling = records[:, 24] >> 1 & 15
+    return bitboards.reshape(count, 2, 6), side_to_move, castling, records[:, 25].copy()
@@ -0,0 +1,572 @@
+""" Benchmarks for the headless rules core """
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import evaluate
+import fen
+import rules
+from parallel import analyse_batch
+from perft import REFERENCE_POSITIONS
+from transposition import TranspositionTable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Cold import of the rules core, on top of bare interpreter startup
+IMPORT_BUDGET_MS = 25.0
+
+
+def time_command(code, runs):
+    # Let the interpreter use and write bytecode caches, as an installed
+    # copy would, and warm them up before timing
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    command = [sys.executable, "-S", "-c", code]
+    subprocess.run(command, cwd=HERE, env=env, check=True)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=HERE, env=env, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def bench_import(runs=20, budget_ms=IMPORT_BUDGET_MS):
+    """ Measure the cold import cost of rules.py and compare it to the budget """
+    baseline = time_command("pass", runs)
+    with_rules = time_command("import rules", runs)
+    cost = with_rules - baseline
+    leaked = subprocess.run(
+        [sys.executable, "-c", "import sys, rules; print('pygame' in sys.modules)"],
+        cwd=HERE, check=True, capture_output=True, text=True,
+    ).stdout.strip()
+
+    print(f"interpreter startup: {baseline:.1f} ms")
+    print(f"import rules:        {cost:.1f} ms (budget {budget_ms:.1f} ms)")
+    if leaked == "True":
+        print("FAIL: importing rules pulled in pygame")
+        return False
+    if cost > budget_ms:
+        print("FAIL: import over budget")
+        return False
+    return True
+
+
+def copy_is_legal(piece, location):
+    """ Legality test the way it was done before make/unmake: copy both
+    sets onto a new board, play the move there and look for a check. """
+    copy_pieces = rules.copy_set(piece.set)
+    copy_pieces.board.make_move(copy_pieces.pieces[piece.piece_name], location)
+    return not rules.is_there_a_check(copy_pieces, copy_pieces.opponent)
+
+
+def make_unmake_is_legal(piece, location):
+    board = piece.set.board
+    board.make_move(piece, location)
+    check = rules.is_there_a_check(piece.set, piece.opponent_set)
+    board.unmake_move()
+    return not check
+
+
+def legal_move_count(positions, is_legal):
+    count = 0
+    for side in positions:
+        for name, piece in list(side.pieces.items()):
+            mvs, captures = piece.possible_moves(piece.location, False, side.opponent)
+            for target in mvs + captures:
+                if is_legal(piece, target):
+                    count += 1
+    return count
+
+
+def scan_is_there_a_check(threatened_set, threatening_set):
+    """ Check detection the way it was done before attack maps: generate
+    every enemy piece's captures and look for the king among them. """
+    king_location = threatened_set.pieces["king"].location
+    for name, attacking_piece in threatening_set.pieces.items():
+        mvs, capture_mvs = attacking_piece.possible_moves(
+            attacking_piece.location, False, threatened_set)
+        if king_location in capture_mvs:
+            return True
+    return False
+
+
+def ray_is_there_a_check(threatened_set, threatening_set):
+    return rules.is_square_attacked(
+        threatened_set.board, threatened_set.pieces["king"].location,
+        threatening_set.color)
+
+
+def bench_checks(count=200, seed=0, repeat=20):
+    """ Check queries: move generation scan, ray casting and attack maps """
+    positions = random_positions(count, seed)
+    queries = [(side, side.opponent) for side in positions]
+    queries += [(side.opponent, side) for side in positions]
+    answers = None
+    print(f"{len(queries)} check queries")
+    for label, is_check in (
+        ("generation", scan_is_there_a_check),
+        ("ray cast", ray_is_there_a_check),
+        ("attack map", rules.is_there_a_check),
+    ):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = [is_check(threatened, threatening) for threatened, threatening in queries]
+        elapsed = (time.perf_counter() - start) / repeat
+        if answers is None:
+            answers = result
+        elif result != answers:
+            print(f"FAIL: {label} disagrees with move generation")
+            return False
+        print(f"{label:10} {elapsed / len(queries) * 1e6:8.2f} us/query")
+    return True
+
+
+def mask_legal_move_count(positions):
+    """ Legal moves through the pin and check masks, counted per target """
+    count = 0
+    for side in positions:
+        check_mask, pins = rules.pins_and_checks(side)
+        for piece in list(side.pieces.values()):
+            mvs, captures = rules.legal_targets(piece, check_mask, pins)
+            count += len(mvs) + len(captures)
+    return count
+
+
+def trial_legal_move_count(positions):
+    return legal_move_count(positions, make_unmake_is_legal)
+
+
+def bench_legality(count=200, seed=0):
+    """ Legal-move queries through copy_set, make/unmake and the pin and
+    check masks, then the cost per legal move by enemy pieces left """
+    positions = random_positions(count, seed)
+    print(f"{count} positions")
+    results = {}
+    for label, is_legal in (("copy_set", copy_is_legal), ("make/unmake", make_unmake_is_legal)):
+        constructed = [0]
+        original_init = rules.Piece.__init__
+
+        def counting_init(self, *args, **kwargs):
+            constructed[0] += 1
+            original_init(self, *args, **kwargs)
+
+        start = time.perf_counter()
+        legal = legal_move_count(positions, is_legal)
+        elapsed = time.perf_counter() - start
+
+        rules.Piece.__init__ = counting_init
+        tracemalloc.start()
+        try:
+            legal_move_count(positions, is_legal)
+            traced, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            rules.Piece.__init__ = original_init
+        results[label] = legal
+        print(
+            f"{label:12} {legal} legal moves, "
+            f"{elapsed / count * 1e6:9.1f} us/position, "
+            f"{constructed[0] / count:7.1f} pieces allocated/position, "
+            f"peak {peak / 1024:8.1f} KiB"
+        )
+    start = time.perf_counter()
+    results["masks"] = mask_legal_move_count(positions)
+    elapsed = time.perf_counter() - start
+    print(f"{'masks':12} {results['masks']} legal moves, {elapsed / count * 1e6:9.1f} us/position")
+    if len(set(results.values())) != 1:
+        print("FAIL: the paths disagree on legal moves")
+        return False
+
+    buckets = {}
+    for side in positions:
+        buckets.setdefault((len(side.opponent.pieces) - 1) // 4, []).append(side)
+    print("enemy pieces   make/unmake us/move    masks us/move")
+    for bucket, sides in sorted(buckets.items()):
+        timings = []
+        for count_moves in (trial_legal_move_count, mask_legal_move_count):
+            start = time.perf_counter()
+            legal = count_moves(sides)
+            timings.append((time.perf_counter() - start) / max(legal, 1) * 1e6)
+        print(f"{bucket * 4 + 1:5}-{bucket * 4 + 4:<8} {timings[0]:19.2f} {timings[1]:16.2f}")
+    return True
+
+
+def random_positions(count, seed=0, max_plies=80):
+    """ Collect positions from seeded random games, as (side to move) sets """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        white_pieces, black_pieces = rules.new_game()
+        side = white_pieces
+        for ply in range(rng.randrange(max_plies)):
+            moves = rules.legal_moves(side)
+            if not moves:
+                break
+            rules.move_piece(*rng.choice(moves))
+            side = side.opponent
+        positions.append(rules.copy_set(side))
+    return positions
+
+
+class ScanSquares:
+
+    """ Stand-in for Board.squares that finds occupants by scanning every
+    piece, the way pixel-tuple locations were looked up before the mailbox. """
+
+    def __init__(self, piece_sets):
+        self.piece_sets = piece_sets
+
+    def __getitem__(self, location):
+        for piece_set in self.piece_sets:
+            for name, piece in piece_set.pieces.items():
+                if piece.location == location:
+                    return piece
+        return None
+
+
+def generate_all(positions):
+    count = 0
+    for side in positions:
+        for piece_set in (side, side.opponent):
+            for name, piece in piece_set.pieces.items():
+                mvs, captures = piece.possible_moves(
+                    piece.location, False, piece_set.opponent)
+                count += len(mvs) + len(captures)
+    return count
+
+
+def bench_movegen(count=200, seed=0, repeat=5):
+    """ Pseudo-legal generation over a position corpus, mailbox vs scan """
+    positions = random_positions(count, seed)
+    mailbox = min(timed(generate_all, positions) for _ in range(repeat))
+
+    scanned = [rules.copy_set(side) for side in positions]
+    for side in scanned:
+        side.board.squares = ScanSquares((side, side.opponent))
+    scan = min(timed(generate_all, scanned) for _ in range(repeat))
+
+    moves = generate_all(positions)
+    if moves != generate_all(scanned):
+        print("FAIL: mailbox and scan generate different moves")
+        return False
+    print(f"{count} positions, {moves} pseudo-legal moves")
+    print(f"mailbox: {mailbox * 1000:8.1f} ms  {moves / mailbox:10.0f} moves/s")
+    print(f"scan:    {scan * 1000:8.1f} ms  {moves / scan:10.0f} moves/s")
+    print(f"speedup: {scan / mailbox:.2f}x")
+    return True
+
+
+def bench_tt(count=200, seed=0, size_mb=1):
+    """ Store and probe every child of a position corpus twice over, through
+    a transposition table of size_mb megabytes """
+    positions = random_positions(count, seed)
+    table = TranspositionTable(size_mb)
+    operations = 0
+    start = time.perf_counter()
+    for sweep in range(2):
+        table.new_search()
+        for side in positions:
+            board = side.board
+            for name, piece in list(side.pieces.items()):
+                mvs, captures = piece.possible_moves(piece.location, False, side.opponent)
+                origin = piece.location
+                for target in mvs + captures:
+                    board.make_move(piece, target)
+                    if table.probe(board.hash) is None:
+                        table.store(
+                            board.hash, sweep + 1, 0, 0, rules.encode_move(origin, target))
+                    board.unmake_move()
+                    operations += 1
+    elapsed = time.perf_counter() - start
+    stats = table.stats()
+    print(f"{stats['size']} slots ({stats['megabytes']:.1f} MB), usage {table.usage():.1%}")
+    print(f"{operations / elapsed:.0f} make/probe/unmake per second")
+    print(
+        f"probes {stats['probes']}, hits {stats['hits']}, misses {stats['misses']}, "
+        f"hit rate {stats['hit_rate']:.1%}, overwrites {stats['overwrites']}"
+    )
+    return True
+
+
+def bench_parallel(max_workers=None, positions=24, depth=2):
+    """ Batch analysis throughput with 1, 2, 4 ... worker processes """
+    max_workers = max_workers or os.cpu_count() or 1
+    fens = [fen for name, fen, counts in REFERENCE_POSITIONS]
+    fens = (fens * (positions // len(fens) + 1))[:positions]
+    worker_counts = []
+    workers = 1
+    while workers < max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(max_workers)
+
+    print(f"{positions} positions at depth {depth}, {os.cpu_count()} cpus")
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        nodes = 0
+        for index, position, result in analyse_batch(fens, workers, depth):
+            nodes += result["nodes"]
+        elapsed = time.perf_counter() - start
+        rate = positions / elapsed
+        if baseline is None:
+            baseline = rate
+        print(
+            f"{workers:3} workers: {rate:7.2f} positions/s {nodes / elapsed:9.0f} nps "
+            f"speedup {rate / baseline:5.2f}x efficiency {rate / baseline / workers:6.1%}"
+        )
+    return True
+
+
+def bench_codec(count=200, seed=0):
+    """ Encode and decode a position corpus as FEN text and binary records """
+    positions = random_positions(count, seed)
+    elapsed = timed(lambda: [fen.board_to_fen(side) for side in positions])
+    fens = [fen.board_to_fen(side) for side in positions]
+    text_bytes = sum(len(text) + 1 for text in fens)
+    print(f"fen write:     {count / elapsed:9.0f} positions/s, {text_bytes / count:.1f} bytes each")
+    elapsed = timed(lambda: [fen.parse_fen(text) for text in fens])
+    print(f"fen read:      {count / elapsed:9.0f} positions/s")
+    elapsed = timed(fen.encode_positions, positions)
+    data = fen.encode_positions(positions)
+    print(f"binary encode: {count / elapsed:9.0f} positions/s, {fen.RECORD_SIZE} bytes each")
+    elapsed = timed(lambda: list(fen.decode_positions(data)))
+    print(f"binary decode: {count / elapsed:9.0f} positions/s")
+    decoded = [fen.board_to_fen(side) for side in fen.decode_positions(data)]
+    if decoded != fens:
+        print("FAIL: binary round trip changed a position")
+        return False
+    return True
+
+
+def bench_batch(count=2000, seed=0, repeat=5):
+    """ Legal move counts and check flags per position through the rules
+    core, against the NumPy batch path """
+    import batch
+
+    positions = random_positions(count, seed)
+    start = time.perf_counter()
+    expected = [len(rules.legal_moves(side)) for side in positions]
+    checks = [rules.is_there_a_check(side, side.opponent) for side in positions]
+    single = time.perf_counter() - start
+
+    records = fen.encode_positions(positions)
+    conversion = timed(batch.from_sets, positions)
+    arrays = batch.from_sets(positions)
+    decode = min(timed(batch.from_records, records) for _ in range(repeat))
+    vectorized = min(timed(batch.analyse, *arrays) for _ in range(repeat))
+    result = batch.analyse(*arrays)
+
+    print(f"{count} positions, {sum(expected)} legal moves, {sum(checks)} in check")
+    print(f"per position:        {count / single:10.0f} positions/s")
+    print(f"batch analyse:       {count / vectorized:10.0f} positions/s  ({single / vectorized:.0f}x)")
+    print(f"batch from sets:     {count / conversion:10.0f} positions/s")
+    print(f"batch from records:  {count / decode:10.0f} positions/s")
+    if list(result["move_counts"]) != expected or list(result["in_check"]) != checks:
+        print("FAIL: batch results differ from the rules core")
+        return False
+    return True
+
+
+def scratch_evaluate(side):
+    """ evaluate after rebuilding the board's attack maps and scores, the
+    cost of the same terms without incremental updates """
+    board = side.board
+    board.refresh_attacks()
+    board.refresh_scores()
+    return evaluate.evaluate(side)
+
+
+def bench_eval(count=2000, seed=0, repeat=5):
+    """ Static evaluations per second: incremental terms, the same terms
+    rebuilt from scratch and the batch entry points """
+    positions = random_positions(count, seed)
+    records = fen.encode_positions(positions)
+    expected = evaluate.evaluate_many(positions)
+    print(f"{count} positions")
+    if [scratch_evaluate(side) for side in positions] != expected:
+        print("FAIL: incremental scores differ from a rebuild")
+        return False
+    if evaluate.evaluate_records(records) != expected:
+        print("FAIL: scores of decoded records differ")
+        return False
+
+    def incremental():
+        for side in positions:
+            evaluate.evaluate(side)
+
+    def scratch():
+        for side in positions:
+            scratch_evaluate(side)
+
+    for label, function, runs in (
+        ("incremental", incremental, repeat),
+        ("from scratch", scratch, 1),
+        ("evaluate_many", lambda: evaluate.evaluate_many(positions), repeat),
+        ("evaluate_records", lambda: evaluate.evaluate_records(records), 1),
+    ):
+        start = time.perf_counter()
+        for _ in range(runs):
+            function()
+        elapsed = (time.perf_counter() - start) / runs
+        print(f"{label:18} {count / elapsed:10.0f} evals/s")
+
+    # Make, evaluate, unmake over every legal move: the cost search pays
+    moves = 0
+    start = time.perf_counter()
+    for side in positions:
+        board = side.board
+        for move in rules.legal_moves(side):
+            board.make_move(*move)
+            evaluate.evaluate(side.opponent)
+            board.unmake_move()
+            moves += 1
+    elapsed = time.perf_counter() - start
+    print(f"{'make/eval/unmake':18} {moves / elapsed:10.0f} evals/s")
+    return True
+
+
+def bench_lookup(book_path, endgame_directory, count=2000, seed=0):
+    """ Open and probe a book and endgame tables, against a shallow search
+    of the same positions """
+    from book import Book
+    from endgame import EndgameTables
+    from engine import Engine
+
+    start = time.perf_counter()
+    book = Book(book_path)
+    tables = EndgameTables(endgame_directory)
+    print(f"open:          {(time.perf_counter() - start) * 1000:9.2f} ms")
+
+    openings = [fen.parse_fen(fen.START_FEN)] + random_positions(count - 1, seed, max_plies=8)
+    elapsed = timed(lambda: [book.moves(side) for side in openings])
+    hits = sum(1 for side in openings if book.moves(side))
+    print(f"book probe:    {count / elapsed:9.0f} positions/s, {hits} of {count} in book")
+
+    rng = random.Random(seed)
+    endings = []
+    while len(endings) < count:
+        king, piece, lone = rng.sample(range(64), 3)
+        if rules.king_attacks[king] >> lone & 1:
+            continue
+        letter = rng.choice("QR")
+        placement = ["1"] * 64
+        placement[king], placement[piece], placement[lone] = "K", letter, "k"
+        rows = ["".join(placement[row * 8:row * 8 + 8]) for row in range(8)]
+        try:
+            side = fen.parse_fen("/".join(rows) + " w - - 0 1")
+        except fen.FenError:
+            continue
+        if not rules.legal_moves(side):
+            continue
+        endings.append(side)
+    elapsed = timed(lambda: [tables.probe(side) for side in endings])
+    print(f"table probe:   {count / elapsed:9.0f} positions/s")
+    missed = sum(1 for side in endings if tables.probe(side) is None)
+    elapsed = timed(lambda: [tables.best_move(side) for side in endings])
+    print(f"table move:    {count / elapsed:9.0f} positions/s")
+
+    engine = Engine(4)
+    searched = endings[:50]
+    elapsed = timed(lambda: [engine.search(side, 3) for side in searched])
+    print(f"depth 3 search:{len(searched) / elapsed:9.0f} positions/s")
+    book.close()
+    tables.close()
+    if missed:
+        print(f"FAIL: {missed} endings missing from the tables")
+        return False
+    return True
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="cold import time of rules")
+    import_parser.add_argument("--runs", type=int, default=20)
+    import_parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+
+    movegen_parser = commands.add_parser(
+        "movegen", help="move generation over a random position corpus")
+    movegen_parser.add_argument("--positions", type=int, default=200)
+    movegen_parser.add_argument("--seed", type=int, default=0)
+
+    legality_parser = commands.add_parser(
+        "legality", help="legal-move queries: copy_set, make/unmake and pin and check masks")
+    legality_parser.add_argument("--positions", type=int, default=200)
+    legality_parser.add_argument("--seed", type=int, default=0)
+
+    checks_parser = commands.add_parser(
+        "checks", help="check detection by generation, ray casting and attack maps")
+    checks_parser.add_argument("--positions", type=int, default=200)
+    checks_parser.add_argument("--seed", type=int, default=0)
+
+    tt_parser = commands.add_parser("tt", help="transposition table throughput and hit rate")
+    tt_parser.add_argument("--positions", type=int, default=200)
+    tt_parser.add_argument("--seed", type=int, default=0)
+    tt_parser.add_argument("--size-mb", type=int, default=1)
+
+    codec_parser = commands.add_parser("codec", help="FEN and binary position encoding")
+    codec_parser.add_argument("--positions", type=int, default=200)
+    codec_parser.add_argument("--seed", type=int, default=0)
+
+    batch_parser = commands.add_parser(
+        "batch", help="NumPy batch analysis against the per-position path")
+    batch_parser.add_argument("--positions", type=int, default=2000)
+    batch_parser.add_argument("--seed", type=int, default=0)
+
+    eval_parser = commands.add_parser("eval", help="static evaluations per second")
+    eval_parser.add_argument("--positions", type=int, default=2000)
+    eval_parser.add_argument("--seed", type=int, default=0)
+
+    lookup_parser = commands.add_parser(
+        "lookup", help="opening book and endgame table probes against search")
+    lookup_parser.add_argument("book")
+    lookup_parser.add_argument("endgames", help="directory of endgame tables")
+    lookup_parser.add_argument("--positions", type=int, default=2000)
+    lookup_parser.add_argument("--seed", type=int, default=0)
+
+    parallel_parser = commands.add_parser(
+        "parallel", help="batch analysis scaling across worker processes")
+    parallel_parser.add_argument("--workers", type=int, default=None)
+    parallel_parser.add_argument("--positions", type=int, default=24)
+    parallel_parser.add_argument("--depth", type=int, default=2)
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        ok = bench_import(args.runs, args.budget_ms)
+    elif args.command == "movegen":
+        ok = bench_movegen(args.positions, args.seed)
+    elif args.command == "legality":
+        ok = bench_legality(args.positions, args.seed)
+    elif args.command == "checks":
+        ok = bench_checks(args.positions, args.seed)
+    elif args.command == "tt":
+        ok = bench_tt(args.positions, args.seed, args.size_mb)
+    elif args.command == "codec":
+        ok = bench_codec(args.positions, args.seed)
+    elif args.command == "batch":
+        ok = bench_batch(args.positions, args.seed)
+    elif args.command == "eval":
+        ok = bench_eval(args.positions, args.seed)
+    elif args.command == "lookup":
+        ok = bench_lookup(args.book, args.endgames, args.positions, args.seed)
+    elif args.command == "parallel":
+        ok = bench_parallel(args.workers, args.positions, args.depth)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
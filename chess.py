@@ -1,7 +1,23 @@
 """ Chess implementation in python """
+import argparse
+import concurrent.futures
+import time
+
 import pygame
 
-pygame.init()
+import instrument
+from engine import MAX_PLY, open_lookups, search_fen, start_worker
+from evaluate import material_balance
+from fen import board_to_fen
+from rules import (
+    game_result,
+    new_game,
+    legal_move_table,
+    legal_moves,
+    move_name,
+    move_piece,
+    promotion_types,
+)
 
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -11,338 +27,85 @@ MOVE = (50, 50, 50)
 CAPTURE = (120, 50, 50)
 
 square_size = 60
+# Transposition table size for the engine, and how often the event loop
+# wakes up to look for its move while it thinks
+ENGINE_TABLE_MB = 16
+ENGINE_POLL_MS = 50
 board_size = square_size * 8
 display_height = square_size * 8
 display_width = square_size * 8
 
-white_points = 0
-black_points = 0
-
-UP = False
-DOWN = True
-LEFT = False
-RIGHT = True
-diagonals = [[RIGHT, UP], [RIGHT, DOWN], [LEFT, UP], [LEFT, DOWN]]
-lines = [[RIGHT, None], [LEFT, None], [None, UP], [None, DOWN]]
-knight_moves = [
-    [[None, UP], [None, UP], [LEFT, None]],
-    [[None, UP], [None, UP], [RIGHT, None]],
-    [[None, DOWN], [None, DOWN], [RIGHT, None]],
-    [[None, DOWN], [None, DOWN], [LEFT, None]],
-    [[LEFT, None], [LEFT, None], [None, UP]],
-    [[LEFT, None], [LEFT, None], [None, DOWN]],
-    [[RIGHT, None], [RIGHT, None], [None, UP]],
-    [[RIGHT, None], [RIGHT, None], [None, DOWN]],
-]
-
-first_person_locations = {
-    "pawn0": (square_size * 0, square_size * 6),
-    "pawn1": (square_size * 1, square_size * 6),
-    "pawn2": (square_size * 2, square_size * 6),
-    "pawn3": (square_size * 3, square_size * 6),
-    "pawn4": (square_size * 4, square_size * 6),
-    "pawn5": (square_size * 5, square_size * 6),
-    "pawn6": (square_size * 6, square_size * 6),
-    "pawn7": (square_size * 7, square_size * 6),
-    "knight0": (square_size * 1, square_size * 7),
-    "knight1": (square_size * 6, square_size * 7),
-    "bishop0": (square_size * 2, square_size * 7),
-    "bishop1": (square_size * 5, square_size * 7),
-    "rook0": (square_size * 0, square_size * 7),
-    "rook1": (square_size * 7, square_size * 7),
-    "queen": (square_size * 3, square_size * 7),
-    "king": (square_size * 4, square_size * 7),
-}
-
-second_person_locations = {
-    "pawn0": (square_size * 0, square_size * 1),
-    "pawn1": (square_size * 1, square_size * 1),
-    "pawn2": (square_size * 2, square_size * 1),
-    "pawn3": (square_size * 3, square_size * 1),
-    "pawn4": (square_size * 4, square_size * 1),
-    "pawn5": (square_size * 5, square_size * 1),
-    "pawn6": (square_size * 6, square_size * 1),
-    "pawn7": (square_size * 7, square_size * 1),
-    "knight0": (square_size * 1, square_size * 0),
-    "knight1": (square_size * 6, square_size * 0),
-    "bishop0": (square_size * 2, square_size * 0),
-    "bishop1": (square_size * 5, square_size * 0),
-    "rook0": (square_size * 0, square_size * 0),
-    "rook1": (square_size * 7, square_size * 0),
-    "queen": (square_size * 3, square_size * 0),
-    "king": (square_size * 4, square_size * 0),
-}
-
-display = pygame.display.set_mode((display_width, display_height))
-display.fill(LIGHT)
-pygame.display.set_caption("Chess")
-
-clock = pygame.time.Clock()
-
-
-class Set:
-
-    """ Class for piece set. Can be black or white. """
-
-    def __init__(self, color, is_player):
-        self.is_player = is_player
-        self.color = color
-        self.pieces = self.generate_pieces(self.color)
-
-    def generate_pieces(self, color):
-        pieces = {}
-        for i in range(8):
-            name = "pawn" + str(i)
-            pieces[name] = Piece(color, "pawn", name, self.is_player)
-        for i in range(2):
-            pieces["bishop" + str(i)] = Piece(
-                color, "bishop", "bishop" + str(i), self.is_player
-            )
-            pieces["knight" + str(i)] = Piece(
-                color, "knight", "knight" + str(i), self.is_player
-            )
-            pieces["rook" + str(i)] = Piece(
-                color, "rook", "rook" + str(i), self.is_player
-            )
-        pieces["queen"] = Piece(color, "queen", "queen", self.is_player)
-        pieces["king"] = Piece(color, "king", "king", self.is_player)
-        return pieces
-
-
-class Piece:
-
-    """ Class for chess pieces. """
-
-    def __init__(self, color, piece_type, piece_name, is_player):
-        self.is_player = is_player
-        self.is_moved = False
-        self.color = color
-        self.set = None
-        self.opponent_set = None
-        self.piece_type = piece_type
-        self.piece_name = piece_name
-        self.image_name = "./assets/" + self.color + "/" + self.piece_type
-        self.image = pygame.image.load(self.image_name + ".png")
-        self.image = pygame.transform.scale(
-            self.image, (square_size, square_size))
-        self.location = self.start_location(self.piece_name)
-
-    def start_location(self, piece_name):
-        if self.is_player:
-            return first_person_locations[piece_name]
-        else:
-            return second_person_locations[piece_name]
-
-    def possible_moves(self, first_location, is_moving, threatened_set):
-        moves = []
-        capture_moves = []
-
-        # # Movement
-
-        # Moves for white pawn
-        if self.color == "white":
-            if self.piece_type == "pawn":
-                first_pawn_move = (
-                    first_location[0], first_location[1] - square_size)
-                moves.append(first_pawn_move)
-                if not self.is_moved and not self.is_obstructed(first_pawn_move):
-                    moves.append(
-                        (first_location[0],
-                         first_location[1] - square_size * 2)
-                    )
+display = None
 
-                tmp_location = self.calculate_move(first_location, RIGHT, UP)
-                if self.is_capture(tmp_location, self.set, threatened_set):
-                    capture_moves.append(tmp_location)
+# Sprite atlas shared by every piece drawn. Source images are read from disk
+# once per (color, piece_type) and rescaled once per square size.
+source_images = {}
+scaled_images = {}
+sprite_stats = {"loads": 0, "scales": 0, "hits": 0}
 
-                tmp_location = self.calculate_move(first_location, LEFT, UP)
-                if self.is_capture(tmp_location, self.set, threatened_set):
-                    capture_moves.append(tmp_location)
 
-        # Moves for black pawn
-        else:
-            if self.piece_type == "pawn":
-                first_pawn_move = (
-                    first_location[0], first_location[1] + square_size)
-                moves.append(first_pawn_move)
-                if not self.is_moved and not self.is_obstructed(first_pawn_move):
-                    moves.append(
-                        (first_location[0],
-                         first_location[1] + square_size * 2)
-                    )
+def get_sprite(color, piece_type, size):
+    """ Return the shared surface for a piece at the given square size """
+    key = (color, piece_type, size)
+    sprite = scaled_images.get(key)
+    if sprite is not None:
+        sprite_stats["hits"] += 1
+        return sprite
 
-                tmp_location = self.calculate_move(first_location, RIGHT, DOWN)
-                if self.is_capture(tmp_location, self.set, threatened_set):
-                    capture_moves.append(tmp_location)
-
-                tmp_location = self.calculate_move(first_location, LEFT, DOWN)
-                if self.is_capture(tmp_location, self.set, threatened_set):
-                    capture_moves.append(tmp_location)
-
-        # Moves for knights
-        if self.piece_type == "knight":
-            for knight_move in knight_moves:
-                location = first_location
-                for step in knight_move:
-                    location = self.calculate_move(location, step[0], step[1])
-                moves, capture_moves, continue_pass = self.capture_move_or_break(
-                    location, moves, capture_moves, threatened_set
-                )
-
-        # Moves for bishops
-        elif self.piece_type == "bishop":
-            moves, capture_moves = self.calculate_all_diagonals(
-                first_location, moves, capture_moves, threatened_set
-            )
+    source = source_images.get((color, piece_type))
+    if source is None:
+        source = pygame.image.load("./assets/" + color + "/" + piece_type + ".png")
+        source_images[(color, piece_type)] = source
+        sprite_stats["loads"] += 1
 
-        # Moves for rooks
-        elif self.piece_type == "rook":
-            moves, capture_moves = self.calculate_all_lines(
-                first_location, moves, capture_moves, threatened_set
-            )
+    sprite = pygame.transform.scale(source, (size, size))
+    scaled_images[key] = sprite
+    sprite_stats["scales"] += 1
+    return sprite
 
-        # Moves for queen
-        elif self.piece_type == "queen":
-            moves, capture_moves = self.calculate_all_diagonals(
-                first_location, moves, capture_moves, threatened_set
-            )
-            moves, capture_moves = self.calculate_all_lines(
-                first_location, moves, capture_moves, threatened_set
-            )
 
-        # Moves for king
-        elif self.piece_type == "king":
-            # if not self.is_moved:
-            #     can_castle(self)
-            for diagonal in diagonals:
-                temp_location = self.calculate_move(
-                    first_location, diagonal[0], diagonal[1]
-                )
-                moves, capture_moves, continue_pass = self.capture_move_or_break(
-                    temp_location, moves, capture_moves, threatened_set
-                )
-            for line in lines:
-                temp_location = self.calculate_move(
-                    first_location, line[0], line[1])
-                moves, capture_moves, continue_pass = self.capture_move_or_break(
-                    temp_location, moves, capture_moves, threatened_set
-                )
-
-        # Eliminate illegal moves
-        final_moves = []
-        for move in moves:
-            if not self.is_obstructed(move) and self.is_move_in_bounds(move):
-                if is_moving:
-                    if not self.will_there_be_check(move):
-                        final_moves.append(move)
-                else:
-                    final_moves.append(move)
-
-        return final_moves, capture_moves
-
-    def indicate_moves(self, psb_moves):
-        """ Indicate possible moves of piece on the board """
-        for possible_move in psb_moves:
-            if not self.will_there_be_check(possible_move):
-                square = pygame.Rect(
-                    possible_move[0] + square_size // 4,
-                    possible_move[1] + square_size // 4,
-                    square_size // 2,
-                    square_size // 2,
-                )
-                pygame.draw.rect(display, MOVE, square)
-
-    def indicate_captures(self, psb_captures):
-        for possible_capture in psb_captures:
-            square = pygame.Rect(
-                possible_capture[0], possible_capture[1], square_size, square_size,
-            )
-            pygame.draw.rect(display, CAPTURE, square)
+def piece_image(piece):
+    return get_sprite(piece.color, piece.piece_type, square_size)
 
-    def indicate_check(self, king_pos):
-        square = pygame.Rect(
-            king_pos[0], king_pos[1], square_size, square_size,)
-        pygame.draw.rect(display, CAPTURE, square)
 
-    def is_capture(self, mv, threatening_set, threatened_set):
-        for name, piece in threatened_set.pieces.items():
-            if mv == piece.location:
-                return True
-        return False
-
-    def is_obstructed(self, mv):
-        for set_of_pieces in all_pieces:
-            for name, piece in set_of_pieces.pieces.items():
-                if mv == piece.location:
-                    return True
-        return False
-
-    def will_there_be_check(self, mv):
-        copy_pieces = copy_set(self.set)
-        copy_pieces.pieces[self.piece_name].location = mv
-        if is_there_a_check(copy_pieces, self.opponent_set):
-            return True
-        return False
-
-    def is_move_in_bounds(self, mv):
-        if mv[0] < 0 or mv[0] >= board_size or mv[1] < 0 or mv[1] >= board_size:
-            return False
-        return True
-
-    def capture_move_or_break(self, mv, regular_mvs, capture_mvs, threatened_set):
-        will_continue = True
-        if not self.is_move_in_bounds(mv):
-            will_continue = False
-        elif self.is_capture(mv, self.set, threatened_set):
-            capture_mvs.append(mv)
-            will_continue = False
-        elif not self.is_obstructed(mv):
-            regular_mvs.append(mv)
-        else:
-            will_continue = False
+def square_to_pixels(square):
+    """ Top-left pixel of a board square """
+    return (square % 8) * square_size, (square // 8) * square_size
 
-        return regular_mvs, capture_mvs, will_continue
 
-    def calculate_move(self, mv, first, second):
-        if first is None:
-            x = mv[0]
-        elif first:
-            x = mv[0] + square_size
-        else:
-            x = mv[0] - square_size
+def pixels_to_square(position):
+    """ Board square under a pixel position, or None when off the board """
+    column = position[0] // square_size
+    row = position[1] // square_size
+    if column < 0 or column > 7 or row < 0 or row > 7:
+        return None
+    return row * 8 + column
 
-        if second is None:
-            y = mv[1]
-        elif second:
-            y = mv[1] + square_size
-        else:
-            y = mv[1] - square_size
 
-        return (x, y)
+def indicate_moves(piece, psb_moves):
+    """ Indicate possible moves of piece on the board """
+    for possible_move in psb_moves:
+        x, y = square_to_pixels(possible_move)
+        square = pygame.Rect(
+            x + square_size // 4,
+            y + square_size // 4,
+            square_size // 2,
+            square_size // 2,
+        )
+        pygame.draw.rect(display, MOVE, square)
 
-    def calculate_all_diagonals(self, start, mvs, captures, threatened_set):
-        for diagonal in diagonals:
-            mvs, captures = self.calc_moves_in_direction(
-                start, diagonal[0], diagonal[1], mvs, captures, threatened_set
-            )
-        return mvs, captures
 
-    def calculate_all_lines(self, start, mvs, captures, threatened_set):
-        for line in lines:
-            mvs, captures = self.calc_moves_in_direction(
-                start, line[0], line[1], mvs, captures, threatened_set
-            )
-        return mvs, captures
-
-    def calc_moves_in_direction(self, start, dir1, dir2, mvs, capture_mvs, threatened_set):
-        temp_location = start
-        continue_pass = True
-        while continue_pass:
-            temp_location = self.calculate_move(temp_location, dir1, dir2)
-            mvs, capture_mvs, continue_pass = self.capture_move_or_break(
-                temp_location, mvs, capture_mvs, threatened_set
-            )
-        return mvs, capture_mvs
+def indicate_captures(psb_captures):
+    for possible_capture in psb_captures:
+        x, y = square_to_pixels(possible_capture)
+        square = pygame.Rect(x, y, square_size, square_size)
+        pygame.draw.rect(display, CAPTURE, square)
+
+
+def indicate_check(king_square):
+    x, y = square_to_pixels(king_square)
+    square = pygame.Rect(x, y, square_size, square_size)
+    pygame.draw.rect(display, CAPTURE, square)
 
 
 def draw_grid():
@@ -365,201 +128,388 @@ def draw_grid():
 
 
 def check_collisions(mouse_pos, pieces):
-    for name, piece in pieces.pieces.items():
-        if piece.location[0] < mouse_pos[0] < piece.location[0] + square_size:
-            if piece.location[1] < mouse_pos[1] < piece.location[1] + square_size:
-                return piece
+    square = pixels_to_square(mouse_pos)
+    if square is None:
+        return None
+    piece = pieces.board.squares[square]
+    if piece is not None and piece.set is pieces:
+        return piece
     return None
 
 
-def snap_piece(piece):
-    """ Snap piece to game board's grid """
-    offset_x = piece.location[0] % square_size
-    offset_y = piece.location[1] % square_size
-    if offset_x > square_size // 2:
-        offset_x -= square_size
-    if offset_y > square_size // 2:
-        offset_y -= square_size
-    snapped_location = (
-        piece.location[0] - offset_x, piece.location[1] - offset_y)
-    piece.location = snapped_location
-
-
-def can_capture(capturing_piece, captured_set, location):
-    copy_capturing = copy_set(capturing_piece.set)
-    copy_captured = copy_set(capturing_piece.opponent_set)
-    capture_at_location(capturing_piece, copy_captured, location)
-    if is_there_a_check(copy_capturing, copy_captured):
-        return False
-    else:
-        return True
-
-
-def capture_at_location(capturing_piece, captured_set, location):
-    copy_of_pieces = captured_set.pieces.copy()
-    for name, piece in copy_of_pieces.items():
-        if piece.location == location:
-            piece_to_capture = name
-            captured_set.pieces.pop(piece_to_capture)
-
-
-def is_there_a_check(threatened_set, threatening_set):
-    for name, attacking_piece in threatening_set.pieces.items():
-        mvs, capture_mvs = attacking_piece.possible_moves(
-            attacking_piece.location, False, threatened_set)
-        if is_threatening_check(attacking_piece, capture_mvs, threatened_set):
-            return True
-    return False
-
-
-def is_threatening_check(piece, capture_moves_of_piece, threatened_set):
-    for capture_move in capture_moves_of_piece:
-        if capture_move == threatened_set.pieces["king"].location:
-            return True
-    return False
-
-
-def copy_set(piece_set):
-    set_copy = Set(piece_set.color, piece_set.is_player)
-    for name, piece in piece_set.pieces.items():
-        set_copy.pieces[name].location = piece.location
-    return set_copy
-
-
-def can_castle(pieces):
-    if pieces["king"].is_moved:
-        return False
-    elif pieces["rook0"].is_moved and pieces["rook1"].is_moved:
-        return False
-    elif not pieces["rook0"].is_moved:
-        pass
-
-
-def increase_point_total(captured_piece, points_to_increase):
-    if captured_piece.piece_type == "queen":
-        points_to_increase += 9
-    elif captured_piece.piece_type == "rook":
-        points_to_increase += 5
-    elif captured_piece.piece_type == "pawn":
-        points_to_increase += 1
-    else:
-        points_to_increase += 3
-    return points_to_increase
-
-
-def display_scores():
-    net_score = white_points - black_points
+def display_scores(board):
+    net_score = material_balance(board)
     if net_score > 0:
         pygame.display.set_caption(f"White {net_score} ahead")
     else:
         pygame.display.set_caption(f"Black {abs(net_score)} ahead")
 
 
-board = draw_grid()
-white_pieces = Set("white", True)
-black_pieces = Set("black", False)
-all_pieces = [white_pieces, black_pieces]
-
-current_player = white_pieces
-other_player = black_pieces
+class FrameStats:
+
+    """ Histogram of the time spent working on each frame, excluding the
+    wait for events """
+
+    bounds_ms = (0.1, 0.5, 1, 2, 5, 10, 20)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds_ms) + 1)
+        self.frames = 0
+        self.total_ms = 0.0
+
+    def record(self, elapsed_ms):
+        self.frames += 1
+        self.total_ms += elapsed_ms
+        for index, bound in enumerate(self.bounds_ms):
+            if elapsed_ms < bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def report(self):
+        lines = [f"frames: {self.frames}, mean {self.total_ms / max(self.frames, 1):.3f} ms"]
+        lower = 0
+        for bound, count in zip(self.bounds_ms + (None,), self.buckets):
+            label = f"{lower}-{bound} ms" if bound is not None else f">= {lower} ms"
+            lines.append(f"  {label:>12}: {count}")
+            lower = bound
+        return "\n".join(lines)
+
+
+def square_rect(square):
+    x, y = square_to_pixels(square)
+    return pygame.Rect(x, y, square_size, square_size)
+
+
+class BoardView:
+
+    """ Draws the board by difference. Every square's contents (its marker
+    and the piece on it) are remembered as drawn; a frame redraws only the
+    squares whose contents changed, plus those under the dragged piece, and
+    hands just those rects to pygame.display.update. """
+
+    def __init__(self, background):
+        self.background = background
+        self.shown = [None] * 64
+        self.drag_rect = None
+        self.frames = 0
+        self.rects = 0
+
+    def invalidate(self):
+        """ Force a full redraw, e.g. after the window was uncovered """
+        self.shown = [None] * 64
+
+    def draw_square(self, square, contents):
+        marker, piece = contents
+        rect = square_rect(square)
+        if marker == "choice":
+            # piece is the (color, piece_type) offered for a promotion
+            pygame.draw.rect(display, LIGHT, rect)
+            pygame.draw.rect(display, BLACK, rect, 1)
+            display.blit(get_sprite(*piece, square_size), rect)
+            return
+        display.blit(self.background, rect, rect)
+        if marker == "move":
+            indicate_moves(piece, [square])
+        elif marker == "capture":
+            indicate_captures([square])
+        elif marker == "check":
+            indicate_check(square)
+        if piece is not None:
+            display.blit(piece_image(piece), rect)
+
+    def render(self, contents, dragged=None, drag_position=None):
+        """ Bring the display in line with contents, a list of 64
+        (marker, piece) pairs, with dragged drawn at drag_position on top.
+        Returns the number of rects updated. """
+        dirty = []
+        stale = set()
+        if self.drag_rect is not None:
+            stale = self.squares_under(self.drag_rect)
+            dirty.append(self.drag_rect)
+        for square in range(64):
+            if contents[square] != self.shown[square] or square in stale:
+                self.draw_square(square, contents[square])
+                self.shown[square] = contents[square]
+                dirty.append(square_rect(square))
+
+        self.drag_rect = None
+        if dragged is not None:
+            rect = pygame.Rect(drag_position, (square_size, square_size))
+            display.blit(piece_image(dragged), rect)
+            dirty.append(rect)
+            self.drag_rect = rect
+
+        if dirty:
+            pygame.display.update(dirty)
+            self.frames += 1
+            self.rects += len(dirty)
+        return len(dirty)
+
+    @staticmethod
+    def squares_under(rect):
+        squares = set()
+        for x in (rect.left, rect.right - 1):
+            for y in (rect.top, rect.bottom - 1):
+                square = pixels_to_square((x, y))
+                if square is not None:
+                    squares.add(square)
+        return squares
+
+
+def promotion_choices(target):
+    """ Squares of the prompt for a promotion on target, each with the piece
+    type it offers, running from target towards the middle of the board """
+    step = 8 if target < 8 else -8
+    return {target + step * index: piece_type for index, piece_type in enumerate(promotion_types)}
+
+
+def square_contents(piece_sets, picked_piece, moves, captures, check_square, offer=None):
+    """ (marker, piece) for every square. The picked piece is left off its
+    square since it is drawn under the cursor. offer maps the squares of a
+    promotion prompt to the (color, piece_type) each shows. """
+    contents = [(None, None)] * 64
+    for piece_set in piece_sets:
+        for piece in piece_set.pieces.values():
+            if piece is not picked_piece:
+                contents[piece.location] = (None, piece)
+    if check_square is not None:
+        contents[check_square] = ("check", contents[check_square][1])
+    if picked_piece is not None:
+        for square in moves:
+            contents[square] = ("move", None)
+        for square in captures:
+            contents[square] = ("capture", contents[square][1])
+    for square, shown in (offer or {}).items():
+        contents[square] = ("choice", shown)
+    return contents
 
 
 def change_player(player, second_player):
     """ Change active player """
-    if player is white_pieces:
-        player = black_pieces
-        second_player = white_pieces
-    else:
-        player = white_pieces
-        second_player = black_pieces
-    return player, second_player
-
-
-for name, piece in white_pieces.pieces.items():
-    piece.set = white_pieces
-    piece.opponent_set = black_pieces
-
-for name, piece in black_pieces.pieces.items():
-    piece.set = black_pieces
-    piece.opponent_set = white_pieces
-
-is_picked_piece = False
-picked_piece = None
-checkmate = False
-# Main game loop
-
-while not checkmate:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            # If the player isn't already holding a piece, pick up the piece
-            if not is_picked_piece:
-                mouse_position = pygame.mouse.get_pos()
-                picked_piece = check_collisions(mouse_position, current_player)
-                if picked_piece is not None:
-                    pick_location = picked_piece.location
-                    possible_moves_to_play, captures = picked_piece.possible_moves(
-                        pick_location, True, picked_piece.opponent_set
-                    )
-                    picked_piece.indicate_moves(possible_moves_to_play)
-                    is_picked_piece = True
-            # Release piece
-            else:
-                snap_piece(picked_piece)
+    return second_player, player
+
 
-                if picked_piece.location in captures:
-                    if can_capture(picked_piece, picked_piece.opponent_set, picked_piece.location):
-                        capture_at_location(
-                            picked_piece, picked_piece.opponent_set, picked_piece.location)
-                        picked_piece.is_moved = True
+def announce_result(piece_set):
+    """ The game's (result, reason) once it is over with piece_set to move,
+    shown in the window title, otherwise None while the title shows the
+    material balance """
+    outcome = game_result(piece_set)
+    if outcome is None:
+        display_scores(piece_set.board)
+    else:
+        result, reason = outcome
+        pygame.display.set_caption(f"Chess - {result} ({reason})")
+        print(f"{result} ({reason})")
+    return outcome
+
+
+def main(argv=None):
+    global display
+
+    parser = argparse.ArgumentParser(description="Play chess")
+    parser.add_argument(
+        "--engine", action="store_true",
+        help="let the engine play the set that is not the player")
+    parser.add_argument(
+        "--movetime", type=float, default=2.0, help="engine seconds per move")
+    parser.add_argument("--book", metavar="FILE", help="Polyglot opening book for the engine")
+    parser.add_argument(
+        "--endgames", metavar="DIR", help="directory of endgame tables for the engine")
+    parser.add_argument(
+        "--stats", metavar="FILE",
+        help="instrument the rules and renderer, writing counts per frame and per move, "
+        "and print sprite, display and frame time totals on exit")
+    parser.add_argument(
+        "--stats-format", choices=sorted(instrument.formats), default="json")
+    args = parser.parse_args(argv)
+    stats_file = None
+    if args.stats:
+        stats_file = open(args.stats, "w")
+        export = instrument.formats[args.stats_format]
+        instrument.enable()
+        last_frame = last_move = instrument.snapshot()
+    moves_played = last_move_number = frames = 0
+    engine = None
+    if args.engine:
+        # The engine searches in a worker process, so the window keeps
+        # answering events while it thinks. Opening the book and tables here
+        # first makes a bad path fail at startup.
+        open_lookups(args.book, args.endgames)
+        engine = concurrent.futures.ProcessPoolExecutor(
+            1, initializer=start_worker, initargs=(ENGINE_TABLE_MB, args.book, args.endgames))
+    # The engine's search in progress, if any
+    search = None
+
+    pygame.init()
+    display = pygame.display.set_mode((display_width, display_height))
+    display.fill(LIGHT)
+    pygame.display.set_caption("Chess")
+    clock = pygame.time.Clock()
+
+    board = draw_grid()
+    view = BoardView(board)
+    white_pieces, black_pieces = new_game()
+    all_pieces = [white_pieces, black_pieces]
+
+    current_player = white_pieces
+    other_player = black_pieces
+    # Legal moves, captures and check status only change when a move is
+    # committed, so frames in between read this table instead of the rules
+    move_table = legal_move_table(current_player)
+    frame_stats = FrameStats()
+
+    is_picked_piece = False
+    picked_piece = None
+    possible_moves_to_play = captures = ()
+    # (pawn, target) while the player picks the piece it promotes to, and
+    # the prompt's squares with the (color, piece_type) each offers
+    promotion = None
+    offer = None
+    # Set once the game is over; the board then stays up until the window
+    # is closed
+    outcome = None
+    # Mouse motion only matters while a piece is held
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
+    # Main game loop
+
+    while True:
+        # The engine moves for the non-player set, starting one frame after
+        # the player's move so that move is drawn first. While it thinks the
+        # loop wakes up every ENGINE_POLL_MS to collect its move; otherwise
+        # sleep until something happens instead of polling.
+        if (
+            engine is not None and outcome is None
+            and not current_player.is_player and not is_picked_piece
+        ):
+            if search is None:
+                search = engine.submit(
+                    search_fen, board_to_fen(current_player), MAX_PLY, args.movetime)
+            if search.done():
+                name = search.result()["move"]
+                search = None
+                frame_start = time.perf_counter()
+                for move in legal_moves(current_player):
+                    if move_name(move) == name:
+                        move_piece(*move)
                         current_player, other_player = change_player(
                             current_player, other_player)
-                    else:
-                        picked_piece.location = pick_location
-                elif is_there_a_check(current_player, other_player):
-                    picked_piece.location = pick_location
-                elif picked_piece.location in possible_moves_to_play:
-                    if pick_location != picked_piece.location:
-                        picked_piece.is_moved = True
-                    current_player, other_player = change_player(
-                        current_player, other_player
+                        move_table = legal_move_table(current_player)
+                        moves_played += 1
+                        outcome = announce_result(current_player)
+                        break
+                events = pygame.event.get()
+            else:
+                events = [pygame.event.wait(ENGINE_POLL_MS)]
+                frame_start = time.perf_counter()
+                events.extend(pygame.event.get())
+        else:
+            events = [pygame.event.wait()]
+            frame_start = time.perf_counter()
+            events.extend(pygame.event.get())
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                if stats_file is not None:
+                    print(
+                        f"sprites: {sprite_stats['loads']} loads, "
+                        f"{sprite_stats['scales']} scales, {sprite_stats['hits']} hits"
                     )
+                    print(f"display updates: {view.frames}, {view.rects} rects")
+                    print(frame_stats.report())
+                    instrument.disable()
+                    stats_file.close()
+                if engine is not None:
+                    engine.shutdown(wait=False, cancel_futures=True)
+                pygame.quit()
+                return
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                view.invalidate()
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                move = None
+                # A click on the promotion prompt picks the piece; anywhere
+                # else takes the pawn back
+                if promotion is not None:
+                    square = pixels_to_square(pygame.mouse.get_pos())
+                    if square in offer:
+                        move = promotion + (offer[square][1],)
+                    else:
+                        display_scores(current_player.board)
+                    promotion = offer = None
+                # If the player isn't already holding a piece, pick up the piece
+                elif not is_picked_piece:
+                    if outcome is not None or search is not None:
+                        continue
+                    mouse_position = pygame.mouse.get_pos()
+                    picked_piece = check_collisions(mouse_position, current_player)
+                    if picked_piece is not None:
+                        possible_moves_to_play = move_table.moves[picked_piece.location]
+                        captures = move_table.captures[picked_piece.location]
+                        is_picked_piece = True
+                        pygame.event.set_allowed(pygame.MOUSEMOTION)
+                # Release piece
                 else:
-                    picked_piece.location = pick_location
-
-                king_location = current_player.pieces["king"].location
-                picked_piece = None
-                is_picked_piece = False
-
-    # Draw board
-
-    display.blit(board, (0, 0))
-
-    # Get picked piece's location and draw possible moves
-
-    if is_picked_piece and picked_piece is not None:
-
-        mouse_pos = pygame.mouse.get_pos()
-        picked_piece.location = (
-            mouse_pos[0] - square_size // 2,
-            mouse_pos[1] - square_size // 2,
-        )
-        picked_piece.indicate_moves(possible_moves_to_play)
-        picked_piece.indicate_captures(captures)
-
-    # Indicate if there is a check
-    if is_there_a_check(current_player, other_player):
-        current_player.pieces["king"].indicate_check(king_location)
-
-    # Draw pieces
-
-    for piece_set in all_pieces:
-        for name, piece in piece_set.pieces.items():
-            display.blit(piece.image, piece.location)
-
-    if picked_piece is not None:
-        display.blit(picked_piece.image, picked_piece.location)
-
-    pygame.display.update()
-    clock.tick(60)
+                    drop_location = pixels_to_square(pygame.mouse.get_pos())
+
+                    if drop_location in captures or drop_location in possible_moves_to_play:
+                        if picked_piece.piece_type == "pawn" and (
+                            drop_location < 8 or drop_location >= 56
+                        ):
+                            promotion = (picked_piece, drop_location)
+                            offer = {
+                                square: (picked_piece.color, piece_type)
+                                for square, piece_type in promotion_choices(drop_location).items()
+                            }
+                            pygame.display.set_caption("Chess - promote to?")
+                        else:
+                            move = (picked_piece, drop_location)
+
+                    picked_piece = None
+                    possible_moves_to_play = captures = ()
+                    is_picked_piece = False
+                    pygame.event.set_blocked(pygame.MOUSEMOTION)
+
+                if move is not None:
+                    move_piece(*move)
+                    current_player, other_player = change_player(
+                        current_player, other_player)
+                    move_table = legal_move_table(current_player)
+                    moves_played += 1
+                    outcome = announce_result(current_player)
+
+        # Draw only what changed since the last frame
+
+        check_square = None
+        if move_table.in_check:
+            check_square = current_player.pieces["king"].location
+        contents = square_contents(
+            all_pieces, picked_piece, possible_moves_to_play, captures, check_square, offer)
+        drag_position = None
+        if picked_piece is not None:
+            mouse_pos = pygame.mouse.get_pos()
+            drag_position = (
+                mouse_pos[0] - square_size // 2,
+                mouse_pos[1] - square_size // 2,
+            )
+        view.render(contents, picked_piece, drag_position)
+        frame_stats.record((time.perf_counter() - frame_start) * 1000)
+        frames += 1
+
+        if stats_file is not None:
+            counts = instrument.snapshot()
+            stats_file.write(
+                export(instrument.difference(counts, last_frame), scope="frame", frame=frames) + "\n")
+            last_frame = counts
+            if moves_played != last_move_number:
+                stats_file.write(
+                    export(instrument.difference(counts, last_move), scope="move", move=moves_played)
+                    + "\n")
+                last_move = counts
+                last_move_number = moves_played
+        # Motion events can arrive far faster than the screen refreshes
+        if is_picked_piece:
+            clock.tick(60)
+
+
+if __name__ == "__main__":
+    main()
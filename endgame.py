@@ -0,0 +1,315 @@
+""" King and queen / king and rook against king: distance-to-mate tables
+generated by retrograde analysis and read through mmap.
+
+A table file holds a 16-byte header, then one byte per position with the
+strong side to move and one per position with the lone king to move. A
+position is indexed strong king * 4096 + piece * 64 + lone king, with the
+strong side seen as white; a black strong side is mirrored top to bottom.
+A byte is plies to mate + 1, or 0 for a draw or an impossible position.
+Probes are single reads at a computed offset, so opening a table parses
+nothing and every process shares the page-cached file.
+
+Building the tables needs numpy; probing them does not. """
+import argparse
+import mmap
+import os
+import sys
+
+from fen import parse_fen
+from rules import (
+    king_attacks,
+    legal_moves,
+    piece_letters,
+    slider_rays,
+    square_name,
+)
+
+HEADER_SIZE = 16
+MAGIC = b"CHESSPY-EGTB"
+POSITIONS = 64 * 64 * 64
+ENDINGS = ("queen", "rook")
+
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+
+def table_name(piece_type):
+    return f"K{piece_letters[piece_type].upper()}K.egtb"
+
+
+def position_index(strong_king, piece, lone_king):
+    return strong_king << 12 | piece << 6 | lone_king
+
+
+def blocked_attacks(piece_type):
+    """ [square][blocker] -> squares a slider on square attacks when the only
+    other piece in its way stands on blocker """
+    table = []
+    for square in range(64):
+        row = []
+        for blocker in range(64):
+            mask = 0
+            for squares_out in slider_rays[piece_type][square]:
+                for target in squares_out:
+                    mask |= 1 << target
+                    if target == blocker:
+                        break
+            row.append(mask)
+        table.append(row)
+    return table
+
+
+def generate(piece_type):
+    """ (strong side to move, lone king to move) arrays of plies to mate,
+    -1 where the position is drawn or impossible """
+    import numpy as np
+
+    index = np.arange(POSITIONS, dtype=np.int64)
+    strong_king = index >> 12
+    piece = (index >> 6) & 63
+    lone_king = index & 63
+    one = np.uint64(1)
+
+    def bit(squares):
+        return np.left_shift(one, squares.astype(np.uint64))
+
+    king_masks = np.array(king_attacks, dtype=np.uint64)
+    piece_masks = np.array(blocked_attacks(piece_type), dtype=np.uint64)[piece, strong_king]
+    distinct = (strong_king != piece) & (strong_king != lone_king) & (piece != lone_king)
+    kings_apart = (king_masks[strong_king] & bit(lone_king)) == 0
+    # The lone king may not step along a line it is standing on, so the
+    # piece's attacks are taken with the lone king off the board
+    covered = king_masks[strong_king] | piece_masks
+    in_check = (piece_masks & bit(lone_king)) != 0
+    valid_lone = distinct & kings_apart
+    valid_strong = valid_lone & ~in_check
+
+    # Lone king moves: to uncovered squares, possibly taking the piece
+    lone_sources = []
+    lone_targets = []
+    escapes = np.zeros(POSITIONS, bool)
+    lone_moves = np.zeros(POSITIONS, np.int64)
+    for column_step, row_step in king_steps():
+        column = (lone_king & 7) + column_step
+        row = (lone_king >> 3) + row_step
+        target = row * 8 + column
+        legal = valid_lone & (column >= 0) & (column < 8) & (row >= 0) & (row < 8)
+        target = np.where(legal, target, 0)
+        legal &= (covered & bit(target)) == 0
+        lone_moves += legal
+        escapes |= legal & (target == piece)
+        quiet = legal & (target != piece)
+        lone_sources.append(index[quiet])
+        lone_targets.append(position_index(strong_king[quiet], piece[quiet], target[quiet]))
+    lone_sources = np.concatenate(lone_sources)
+    lone_targets = np.concatenate(lone_targets)
+
+    # Strong side moves: the king, then the piece along each of its rays
+    strong_sources = []
+    strong_targets = []
+    for column_step, row_step in king_steps():
+        column = (strong_king & 7) + column_step
+        row = (strong_king >> 3) + row_step
+        target = row * 8 + column
+        legal = valid_strong & (column >= 0) & (column < 8) & (row >= 0) & (row < 8)
+        target = np.where(legal, target, 0)
+        legal &= (target != piece) & ((king_masks[lone_king] & bit(target)) == 0)
+        strong_sources.append(index[legal])
+        strong_targets.append(position_index(target[legal], piece[legal], lone_king[legal]))
+    for column_step, row_step in piece_steps(piece_type):
+        column = piece & 7
+        row = piece >> 3
+        alive = valid_strong.copy()
+        for distance in range(7):
+            column = column + column_step
+            row = row + row_step
+            alive &= (column >= 0) & (column < 8) & (row >= 0) & (row < 8)
+            target = np.where(alive, row * 8 + column, 0)
+            alive &= (target != strong_king) & (target != lone_king)
+            strong_sources.append(index[alive])
+            strong_targets.append(
+                position_index(strong_king[alive], target[alive], lone_king[alive]))
+    strong_sources = np.concatenate(strong_sources)
+    strong_targets = np.concatenate(strong_targets)
+
+    strong = np.full(POSITIONS, -1, np.int64)
+    lone = np.full(POSITIONS, -1, np.int64)
+    lone[valid_lone & in_check & (lone_moves == 0)] = 0
+    ply = 0
+    last_change = 0
+    while ply - last_change <= 2:
+        ply += 1
+        if ply % 2:
+            # Strong side to move wins in ply if some move reaches a mate
+            # in ply - 1
+            winning = strong_sources[lone[strong_targets] == ply - 1]
+            winning = winning[strong[winning] == -1]
+            if len(winning):
+                strong[winning] = ply
+                last_change = ply
+        else:
+            # The lone king loses in ply once every move loses
+            unknown = np.bincount(
+                lone_sources[strong[lone_targets] == -1], minlength=POSITIONS)
+            losing = valid_lone & (lone == -1) & (lone_moves > 0) & ~escapes & (unknown == 0)
+            if losing.any():
+                lone[losing] = ply
+                last_change = ply
+    return strong, lone
+
+
+def king_steps():
+    return [(column_step, row_step) for column_step in (-1, 0, 1) for row_step in (-1, 0, 1)
+            if column_step or row_step]
+
+
+def piece_steps(piece_type):
+    if piece_type == "rook":
+        return [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    return [step for step in king_steps()]
+
+
+def write_table(path, piece_type, strong, lone):
+    import numpy as np
+
+    header = MAGIC + piece_letters[piece_type].encode()
+    header += bytes(HEADER_SIZE - len(header))
+    with open(path, "wb") as stream:
+        stream.write(header)
+        for table in (strong, lone):
+            stream.write((table + 1).astype(np.uint8).tobytes())
+
+
+def build(directory, endings=ENDINGS):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for piece_type in endings:
+        strong, lone = generate(piece_type)
+        path = os.path.join(directory, table_name(piece_type))
+        write_table(path, piece_type, strong, lone)
+        paths.append((path, int(strong.max())))
+    return paths
+
+
+class EndgameTables:
+
+    """ The tables found in a directory, mapped read-only """
+
+    def __init__(self, directory):
+        self.maps = {}
+        self.files = []
+        for piece_type in ENDINGS:
+            path = os.path.join(directory, table_name(piece_type))
+            if not os.path.exists(path):
+                continue
+            stream = open(path, "rb")
+            table = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            if table[:len(MAGIC)] != MAGIC or len(table) != HEADER_SIZE + 2 * POSITIONS:
+                table.close()
+                stream.close()
+                raise ValueError(f"{path} is not an endgame table")
+            self.files.append(stream)
+            self.maps[piece_type] = table
+        self.hits = 0
+
+    def close(self):
+        for table in self.maps.values():
+            table.close()
+        for stream in self.files:
+            stream.close()
+        self.maps = {}
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def covers(self, piece_set):
+        """ (strong set, its piece) when a table covers the position """
+        for strong in (piece_set, piece_set.opponent):
+            lone = strong.opponent
+            if len(strong.pieces) != 2 or len(lone.pieces) != 1:
+                continue
+            for piece in strong.pieces.values():
+                if piece.piece_type in self.maps:
+                    return strong, piece
+        return None
+
+    def probe(self, piece_set):
+        """ (WIN, DRAW or LOSS for piece_set, plies to mate), or None when
+        no table covers the position """
+        covered = self.covers(piece_set)
+        if covered is None:
+            return None
+        strong, piece = covered
+        flip = 0 if strong.color == "white" else 56
+        index = position_index(
+            strong.pieces["king"].location ^ flip,
+            piece.location ^ flip,
+            strong.opponent.pieces["king"].location ^ flip,
+        )
+        strong_to_move = piece_set is strong
+        value = self.maps[piece.piece_type][
+            HEADER_SIZE + (0 if strong_to_move else POSITIONS) + index]
+        self.hits += 1
+        if value == 0:
+            return DRAW, 0
+        return (WIN if strong_to_move else LOSS), value - 1
+
+    def best_move(self, piece_set):
+        """ (move, outcome, plies to mate) playing the fastest mate or the
+        longest defence, or None when no table covers the position """
+        if self.probe(piece_set) is None:
+            return None
+        board = piece_set.board
+        best = None
+        best_rank = None
+        for move in legal_moves(piece_set):
+            board.make_move(*move)
+            reply = self.probe(piece_set.opponent)
+            board.unmake_move()
+            if reply is None:
+                # The piece was taken: a bare-kings draw
+                outcome, plies = DRAW, 0
+            else:
+                outcome, plies = -reply[0], reply[1] + 1
+            # Win fastest, draw rather than lose, lose slowest
+            rank = (outcome, -plies if outcome == WIN else plies)
+            if best_rank is None or rank > best_rank:
+                best = (move, outcome, plies)
+                best_rank = rank
+        return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="generate the tables (needs numpy)")
+    build_parser.add_argument("directory")
+    probe_parser = commands.add_parser("probe", help="look a position up")
+    probe_parser.add_argument("directory")
+    probe_parser.add_argument("fen")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        for path, longest in build(args.directory):
+            print(f"{path}: longest mate {longest} plies")
+        return 0
+
+    piece_set = parse_fen(args.fen)
+    with EndgameTables(args.directory) as tables:
+        found = tables.best_move(piece_set)
+        if found is None:
+            print("not covered")
+            return 1
+        (piece, target), outcome, plies = found
+        label = {WIN: "win", DRAW: "draw", LOSS: "loss"}[outcome]
+        print(f"{label} in {plies} plies, best {square_name(piece.location)}{square_name(target)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,418 @@
+""" Alpha-beta search engine over the rules core """
+import argparse
+import sys
+import time
+
+from evaluate import evaluate
+from fen import START_FEN, parse_fen
+from rules import (
+    decode_move,
+    encode_move,
+    is_there_a_check,
+    legal_moves,
+    move_name,
+    piece_values,
+)
+from transposition import EXACT, LOWER_BOUND, UPPER_BOUND, TranspositionTable
+
+MATE = 100000
+# Scores beyond this are mates, stored relative to the node in the table
+MATE_BOUND = MATE - 1000
+INFINITY = MATE + 1
+MAX_PLY = 64
+# Nodes searched between looks at the clock: a few milliseconds at the
+# engine's speed of 5-20k nodes a second. The node limit is checked on
+# every node.
+CHECK_EVERY = 64
+
+# Piece values for ordering captures; positions are scored by evaluate.py
+centipawns = {piece_type: value * 100 for piece_type, value in piece_values.items()}
+
+
+class SearchResult:
+
+    """ Outcome of a search: best move as (piece, target) and its score in
+    centipawns for the side to move, with the statistics behind it.
+
+    depth is the deepest completed iteration. depth 0 means the budget ran
+    out before depth 1 finished: move is then the best of the root moves
+    searched so far, or the first legal move if none was, and score is
+    only as good as that. """
+
+    def __init__(self, move, score, depth, nodes, elapsed, pv):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv
+
+    @property
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return (
+            f"SearchResult(move={move_name(self.move)}, score={self.score}, "
+            f"depth={self.depth}, nodes={self.nodes}, nps={self.nps:.0f})"
+        )
+
+
+def encode(move):
+    """ encode_move for a move as generated """
+    return encode_move(move[0].location, *move[1:])
+
+
+class Engine:
+
+    """ Negamax with alpha-beta pruning, iterative deepening, a quiescence
+    search over captures and queen promotions, and a transposition table.
+    Leaves are scored by evaluate.py; repetitions and the fifty-move rule
+    score as draws inside the tree.
+
+    Moves are ordered: the table's best move, then captures by most valuable
+    victim / least valuable attacker, then the two killer moves stored for
+    the ply, then the rest. Searches stop on a time or node budget; the move
+    from the last completed iteration is returned.
+
+    book (a book.Book) and endgames (an endgame.EndgameTables), when given,
+    answer the positions they cover without searching. """
+
+    def __init__(self, table_mb=16, book=None, endgames=None):
+        self.table = TranspositionTable(table_mb)
+        self.book = book
+        self.endgames = endgames
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.nodes = 0
+        self.next_check = CHECK_EVERY
+        self.stopped = False
+        self.deadline = None
+        self.node_limit = None
+
+    def search(
+        self, piece_set, max_depth=MAX_PLY, time_limit=None, node_limit=None,
+        info=None, only_moves=None,
+    ):
+        """ Search the position with piece_set to move. time_limit is in
+        seconds. info, if given, is called with a SearchResult after every
+        completed depth. only_moves restricts the root to moves with these
+        names, e.g. ["e2e4", "d2d4"]. """
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.next_check = CHECK_EVERY
+        self.stopped = False
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.table.new_search()
+
+        root_moves = legal_moves(piece_set)
+        if only_moves is not None:
+            root_moves = [move for move in root_moves if move_name(move) in only_moves]
+        if not root_moves:
+            score = -MATE if is_there_a_check(piece_set, piece_set.opponent) else 0
+            return SearchResult(None, score, 0, 0, 0.0, [])
+        if only_moves is None:
+            found = self.lookup(piece_set)
+            if found is not None:
+                found.elapsed = time.perf_counter() - start
+                if info is not None:
+                    info(found)
+                return found
+        # Captures first, so a search cut short inside depth 1 has looked at
+        # the likeliest moves
+        root_moves = self.order_moves(piece_set.board, root_moves, 0, (0, 0))
+        result = SearchResult(root_moves[0], 0, 0, 0, 0.0, [move_name(root_moves[0])])
+
+        for depth in range(1, min(max_depth, MAX_PLY - 1) + 1):
+            score, move = self.search_root(piece_set, root_moves, depth)
+            if self.stopped:
+                if depth == 1 and score > -INFINITY:
+                    result = SearchResult(move, score, 0, 0, 0.0, [move_name(move)])
+                break
+            elapsed = time.perf_counter() - start
+            result = SearchResult(
+                move, score, depth, self.nodes, elapsed, self.principal_variation(piece_set, move))
+            if info is not None:
+                info(result)
+            # Put the best move first for the next iteration
+            root_moves.remove(move)
+            root_moves.insert(0, move)
+            if abs(score) >= MATE_BOUND:
+                break
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def lookup(self, piece_set):
+        """ A SearchResult from the opening book or the endgame tables, or
+        None when neither covers the position """
+        if self.book is not None:
+            move = self.book.choose(piece_set)
+            if move is not None:
+                return SearchResult(move, evaluate(piece_set), 0, 0, 0.0, [move_name(move)])
+        if self.endgames is not None:
+            found = self.endgames.best_move(piece_set)
+            if found is not None:
+                move, outcome, plies = found
+                score = outcome * (MATE - plies) if outcome else 0
+                return SearchResult(move, score, 0, 0, 0.0, [move_name(move)])
+        return None
+
+    def search_root(self, piece_set, root_moves, depth):
+        board = piece_set.board
+        alpha = -INFINITY
+        best_move = root_moves[0]
+        for move in root_moves:
+            board.make_move(*move)
+            score = -self.negamax(piece_set.opponent, depth - 1, -INFINITY, -alpha, 1)
+            board.unmake_move()
+            if self.stopped:
+                break
+            if score > alpha:
+                alpha = score
+                best_move = move
+        if not self.stopped:
+            self.table.store(board.hash, depth, alpha, EXACT, encode(best_move))
+        return alpha, best_move
+
+    def negamax(self, piece_set, depth, alpha, beta, ply):
+        if self.out_of_budget():
+            return 0
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiescence(piece_set, alpha, beta, ply)
+        self.nodes += 1
+
+        board = piece_set.board
+        # A repeated position or a dead fifty-move count is a draw; one
+        # repetition is enough inside the search
+        if board.halfmove >= 100 or board.repetitions():
+            return 0
+        key = board.hash
+        table_move = 0
+        entry = self.table.probe(key)
+        if entry is not None:
+            entry_depth, entry_score, flag, table_move = entry
+            if entry_depth >= depth:
+                entry_score = score_from_table(entry_score, ply)
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER_BOUND and entry_score >= beta:
+                    return entry_score
+                if flag == UPPER_BOUND and entry_score <= alpha:
+                    return entry_score
+
+        moves = legal_moves(piece_set)
+        if not moves:
+            if is_there_a_check(piece_set, piece_set.opponent):
+                return -MATE + ply
+            return 0
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        killers = self.killers[ply]
+        for move in self.order_moves(board, moves, table_move, killers):
+            encoded = encode(move)
+            captured = board.squares[move[1]]
+            board.make_move(*move)
+            score = -self.negamax(piece_set.opponent, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                best_move = encoded
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if captured is None and killers[0] != best_move:
+                    killers[1] = killers[0]
+                    killers[0] = best_move
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.table.store(key, depth, score_to_table(best_score, ply), flag, best_move)
+        return best_score
+
+    def quiescence(self, piece_set, alpha, beta, ply):
+        """ Search captures and queen promotions only, so the static score
+        is never taken in the middle of an exchange """
+        if self.out_of_budget():
+            return 0
+        self.nodes += 1
+        stand_pat = evaluate(piece_set)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        if ply >= MAX_PLY - 1:
+            return alpha
+
+        board = piece_set.board
+        captures = [
+            move for move in legal_moves(piece_set)
+            if board.squares[move[1]] is not None or move[-1] == "queen"
+        ]
+        for move in self.order_moves(board, captures, 0, (0, 0)):
+            board.make_move(*move)
+            score = -self.quiescence(piece_set.opponent, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if self.out_of_budget():
+                return 0
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def order_moves(self, board, moves, table_move, killers):
+        def priority(move):
+            piece, target = move[0], move[1]
+            encoded = encode(move)
+            if encoded == table_move:
+                return 1000000
+            victim = board.squares[target]
+            if victim is not None:
+                # Most valuable victim, then least valuable attacker
+                return 10000 + centipawns[victim.piece_type] * 10 - centipawns[piece.piece_type] // 10
+            if encoded == killers[0]:
+                return 9000
+            if encoded == killers[1]:
+                return 8000
+            return 0
+
+        return sorted(moves, key=priority, reverse=True)
+
+    def out_of_budget(self):
+        if self.stopped:
+            return True
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            self.stopped = True
+        elif self.nodes >= self.next_check:
+            self.next_check = self.nodes + CHECK_EVERY
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                self.stopped = True
+        return self.stopped
+
+    def principal_variation(self, piece_set, first_move):
+        """ Follow table moves from the root to recover the expected line """
+        board = piece_set.board
+        names = []
+        seen = set()
+        side = piece_set
+        move = first_move
+        while move is not None and len(names) < MAX_PLY and board.hash not in seen:
+            seen.add(board.hash)
+            names.append(move_name(move))
+            board.make_move(*move)
+            side = side.opponent
+            move = self.table_move(side)
+        for _ in names:
+            board.unmake_move()
+        return names
+
+    def table_move(self, piece_set):
+        """ The table's best move for piece_set to move, if it is legal here """
+        entry = self.table.probe(piece_set.board.hash)
+        if entry is None or not entry[3]:
+            return None
+        origin, target, promotion = decode_move(entry[3])
+        for move in legal_moves(piece_set):
+            if (
+                move[0].location == origin and move[1] == target
+                and (move[2] if len(move) > 2 else None) == promotion
+            ):
+                return move
+        return None
+
+
+def score_to_table(score, ply):
+    """ Store mate scores as distance from this node rather than the root """
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def open_lookups(book_path=None, endgame_directory=None):
+    """ (book, endgames) opened from the given paths, None where not given """
+    book = endgames = None
+    if book_path:
+        from book import Book
+        book = Book(book_path)
+    if endgame_directory:
+        from endgame import EndgameTables
+        endgames = EndgameTables(endgame_directory)
+    return book, endgames
+
+
+# One engine per worker process, made by start_worker
+_worker_engine = None
+
+
+def start_worker(table_mb, book_path=None, endgame_directory=None):
+    """ Process pool initializer for search_fen """
+    global _worker_engine
+    _worker_engine = Engine(table_mb, *open_lookups(book_path, endgame_directory))
+
+
+def search_fen(fen, max_depth=MAX_PLY, time_limit=None, node_limit=None):
+    """ Worker: search the position in fen, for callers that must not wait
+    on the search themselves. The move comes back by name, since pieces
+    belong to the worker's board. """
+    result = _worker_engine.search(parse_fen(fen), max_depth, time_limit, node_limit)
+    return {
+        "move": move_name(result.move),
+        "score": result.score,
+        "depth": result.depth,
+        "nodes": result.nodes,
+    }
+
+
+def print_info(result):
+    print(
+        f"depth {result.depth} score {result.score} nodes {result.nodes} "
+        f"nps {result.nps:.0f} time {result.elapsed:.3f} pv {' '.join(result.pv)}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("fen", nargs="?", default=START_FEN)
+    parser.add_argument("--depth", type=int, default=MAX_PLY)
+    parser.add_argument("--movetime", type=float, default=None, help="seconds")
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--hash-mb", type=int, default=16)
+    parser.add_argument("--book", metavar="FILE", help="Polyglot opening book")
+    parser.add_argument("--endgames", metavar="DIR", help="directory of endgame tables")
+    args = parser.parse_args(argv)
+    if args.movetime is None and args.nodes is None and args.depth == MAX_PLY:
+        args.movetime = 5.0
+
+    engine = Engine(args.hash_mb, *open_lookups(args.book, args.endgames))
+    result = engine.search(
+        parse_fen(args.fen), args.depth, args.movetime, args.nodes, print_info)
+    print(f"bestmove {move_name(result.move)}")
+    stats = engine.table.stats()
+    print(f"tt hits {stats['hits']}/{stats['probes']} ({stats['hit_rate']:.1%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
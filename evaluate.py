@@ -0,0 +1,153 @@
+""" Static evaluation in centipawns.
+
+Material and piece-square scores, blended between middlegame and endgame
+tables by how much material is left, and mobility are all kept by the board
+as moves are made and taken back, so they cost nothing extra here. Only
+king safety is looked up per call: the enemy attacks on the squares around
+each king, which the board's attack maps count, and the pawns sheltering
+it. All terms are summed from white's side and fade out of the middlegame
+score as pieces come off. """
+import argparse
+import sys
+import time
+
+from fen import START_FEN, decode_positions, parse_fen
+from rules import MAX_PHASE, king_targets, pawn_capture_targets, pawn_forward, piece_values
+
+# Centipawns per attacked square, middlegame and endgame
+MOBILITY_MIDDLEGAME = 3
+MOBILITY_ENDGAME = 2
+# Middlegame centipawns per enemy attack on the squares around a king, and
+# per own pawn on the squares in front of it
+KING_ZONE_ATTACK = 8
+PAWN_SHIELD = 12
+
+
+class Evaluation:
+
+    """ An evaluation broken into its terms, all from white's side """
+
+    __slots__ = ("middlegame", "endgame", "phase", "mobility", "king_safety", "score")
+
+    def __init__(self, middlegame, endgame, phase, mobility, king_safety, score):
+        self.middlegame = middlegame
+        self.endgame = endgame
+        self.phase = phase
+        self.mobility = mobility
+        self.king_safety = king_safety
+        self.score = score
+
+    def __repr__(self):
+        return (
+            f"<Evaluation {self.score} (material and squares {self.middlegame}/{self.endgame}, "
+            f"phase {self.phase}, mobility {self.mobility}, king safety {self.king_safety})>"
+        )
+
+
+def king_safety(board, piece_set):
+    """ Middlegame king safety of piece_set: pawns in front of its king
+    count for it, enemy attacks around its king against it """
+    king = piece_set.pieces["king"].location
+    enemy_attacks = board.attack_counts[piece_set.opponent.color]
+    attacks = enemy_attacks[king]
+    for square in king_targets[king]:
+        attacks += enemy_attacks[square]
+    squares = board.squares
+    shield = 0
+    # The three squares in front of the king, towards the enemy
+    ahead = king + 8 * pawn_forward(piece_set.color)
+    shelter = pawn_capture_targets[piece_set.color][king]
+    if 0 <= ahead < 64:
+        shelter = shelter + (ahead,)
+    for square in shelter:
+        piece = squares[square]
+        if piece is not None and piece.piece_type == "pawn" and piece.set is piece_set:
+            shield += 1
+    return PAWN_SHIELD * shield - KING_ZONE_ATTACK * attacks
+
+
+def white_sets(piece_set):
+    if piece_set.color == "white":
+        return piece_set, piece_set.opponent
+    return piece_set.opponent, piece_set
+
+
+def evaluate(piece_set):
+    """ Score of the position in centipawns from piece_set's point of view """
+    board = piece_set.board
+    white, black = white_sets(piece_set)
+    mobility = board.mobility["white"] - board.mobility["black"]
+    phase = min(board.phase, MAX_PHASE)
+    middlegame = (
+        board.middlegame + MOBILITY_MIDDLEGAME * mobility
+        + king_safety(board, white) - king_safety(board, black)
+    )
+    endgame = board.endgame + MOBILITY_ENDGAME * mobility
+    score = middlegame * phase + endgame * (MAX_PHASE - phase)
+    # Take the side before dividing, so mirrored positions round alike
+    if piece_set is not white:
+        score = -score
+    return score // MAX_PHASE
+
+
+def explain(piece_set):
+    """ Evaluation of piece_set's position with its terms, from white's side """
+    board = piece_set.board
+    white, black = white_sets(piece_set)
+    mobility = board.mobility["white"] - board.mobility["black"]
+    safety = king_safety(board, white) - king_safety(board, black)
+    return Evaluation(
+        board.middlegame, board.endgame, min(board.phase, MAX_PHASE), mobility, safety,
+        evaluate(white))
+
+
+def evaluate_many(piece_sets):
+    """ evaluate for each set in an iterable, as a list """
+    return [evaluate(piece_set) for piece_set in piece_sets]
+
+
+def evaluate_fens(fens):
+    """ Scores from the side to move for an iterable of FENs """
+    return [evaluate(parse_fen(fen)) for fen in fens]
+
+
+def evaluate_records(data):
+    """ Scores from the side to move for concatenated fen records """
+    return evaluate_many(decode_positions(data))
+
+
+def material_balance(board):
+    """ Material alone, in pawns, white minus black """
+    points = 0
+    for piece_set in board.sets:
+        sign = 1 if piece_set.color == "white" else -1
+        for piece in piece_set.pieces.values():
+            points += sign * piece_values[piece.piece_type]
+    return points
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("fens", nargs="*", default=[START_FEN])
+    parser.add_argument("--file", help="evaluate one FEN per line of FILE ('-' for stdin)")
+    args = parser.parse_args(argv)
+
+    if args.file:
+        lines = sys.stdin if args.file == "-" else open(args.file)
+        fens = [line.split(";")[0].strip() for line in lines if line.strip()]
+        start = time.perf_counter()
+        scores = evaluate_fens(fens)
+        elapsed = time.perf_counter() - start
+        for fen, score in zip(fens, scores):
+            print(f"{score}\t{fen}")
+        print(f"{len(fens)} positions in {elapsed:.2f} s ({len(fens) / max(elapsed, 1e-9):.0f}/s)")
+        return 0
+
+    for fen in args.fens:
+        piece_set = parse_fen(fen)
+        print(f"{evaluate(piece_set)}\t{fen}\n  {explain(piece_set)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+""" FEN and EPD reading and writing, and a compact binary position encoding """
+from rules import (
+    Board,
+    Piece,
+    Set,
+    is_there_a_check,
+    link_sets,
+    new_piece_name,
+    parse_square,
+    square_name,
+    piece_letters,
+    first_person_locations,
+    second_person_locations,
+    WHITE_KINGSIDE,
+    WHITE_QUEENSIDE,
+    BLACK_KINGSIDE,
+    BLACK_QUEENSIDE,
+)
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+piece_types = {letter: piece_type for piece_type, letter in piece_letters.items()}
+
+castling_letters = {
+    "K": WHITE_KINGSIDE,
+    "Q": WHITE_QUEENSIDE,
+    "k": BLACK_KINGSIDE,
+    "q": BLACK_QUEENSIDE,
+}
+
+# Castling right -> name of the rook it needs unmoved
+castling_rooks = {
+    WHITE_KINGSIDE: "rook1",
+    WHITE_QUEENSIDE: "rook0",
+    BLACK_KINGSIDE: "rook1",
+    BLACK_QUEENSIDE: "rook0",
+}
+
+# Binary records: 8 bytes of occupancy, a 4-bit piece code per occupied
+# square in square order (16 bytes for up to 32 pieces), then side to move
+# and castling rights, en passant square, halfmove clock and fullmove number
+RECORD_SIZE = 32
+NO_SQUARE = 255
+piece_codes = {
+    (color, piece_type): index * 2 + (color == "black")
+    for index, piece_type in enumerate(piece_letters)
+    for color in ("white", "black")
+}
+code_pieces = {code: key for key, code in piece_codes.items()}
+
+
+class FenError(ValueError):
+    pass
+
+
+def build_position(placement, side_to_move, castling, en_passant, halfmove=0, fullmove=1):
+    """ Create linked sets from a 64-entry list of (color, piece_type) or
+    None, and return the set whose turn it is. Raises FenError when the
+    position cannot arise: a missing or extra king, an en passant square
+    no pawn can have passed, or the side to move able to take the king. """
+    white_pieces = Set("white", True, {})
+    black_pieces = Set("black", False, {})
+    for location, occupant in enumerate(placement):
+        if occupant is None:
+            continue
+        color, piece_type = occupant
+        piece_set = white_pieces if color == "white" else black_pieces
+        name = starting_name(piece_set, piece_type, location)
+        piece = Piece(color, piece_type, name, piece_set.is_player, location)
+        if piece_type == "pawn":
+            piece.is_moved = location // 8 != (6 if piece_set.is_player else 1)
+        elif piece_type in ("king", "rook"):
+            piece.is_moved = True
+        piece_set.pieces[name] = piece
+    for piece_set in (white_pieces, black_pieces):
+        if "king" not in piece_set.pieces:
+            raise FenError(f"no {piece_set.color} king")
+    if en_passant is not None:
+        check_en_passant(placement, side_to_move, en_passant)
+
+    # Kings and rooks count as unmoved only where a castling right says so
+    for right, rook_name in castling_rooks.items():
+        if castling & right:
+            piece_set = white_pieces if right & (WHITE_KINGSIDE | WHITE_QUEENSIDE) else black_pieces
+            rook = piece_set.pieces.get(rook_name)
+            if rook is not None and rook.piece_type == "rook":
+                rook.is_moved = False
+                piece_set.pieces["king"].is_moved = False
+
+    board = Board()
+    link_sets(white_pieces, black_pieces, board, side_to_move, en_passant)
+    board.halfmove = halfmove
+    board.fullmove = fullmove
+    to_move = white_pieces if side_to_move == "white" else black_pieces
+    if is_there_a_check(to_move.opponent, to_move):
+        raise FenError(
+            f"the {to_move.opponent.color} king is in check with {side_to_move} to move")
+    return to_move
+
+
+def check_en_passant(placement, side_to_move, en_passant):
+    """ Raise FenError unless a pawn of the side that just moved can have
+    passed en_passant with a double push: the square is on the row behind
+    it, and both it and the square the pawn came from are empty """
+    mover = "black" if side_to_move == "white" else "white"
+    # The row the square must be on, and the row step towards the pawn
+    row, step = (2, 8) if side_to_move == "white" else (5, -8)
+    if not 0 <= en_passant < 64:
+        raise FenError(f"en passant square {en_passant} is off the board")
+    name = square_name(en_passant)
+    if en_passant // 8 != row:
+        raise FenError(f"en passant square {name} is not where {mover} can have passed")
+    if (
+        placement[en_passant] is not None
+        or placement[en_passant - step] is not None
+        or placement[en_passant + step] != (mover, "pawn")
+    ):
+        raise FenError(f"no {mover} pawn can have just passed en passant square {name}")
+
+
+def starting_name(piece_set, piece_type, location):
+    """ Give a piece standing on its starting square its usual name, so
+    rook0 / rook1 keep meaning the queenside / kingside rook. Other pieces
+    get names that cannot clash with one still to be read. """
+    if piece_type == "king":
+        if "king" in piece_set.pieces:
+            raise FenError(f"more than one {piece_set.color} king")
+        return "king"
+    if piece_set.is_player:
+        start_locations = first_person_locations
+    else:
+        start_locations = second_person_locations
+    for name, start in start_locations.items():
+        if (
+            start == location
+            and name.rstrip("0123456789") == piece_type
+            and name not in piece_set.pieces
+        ):
+            return name
+    taken = dict.fromkeys(start_locations)
+    taken.update(piece_set.pieces)
+    return new_piece_name(taken, piece_type)
+
+
+def parse_fen(fen):
+    """ Build linked white and black sets from a FEN string and return the
+    set whose turn it is. The opponent is reachable as its opponent. """
+    fields = fen.split()
+    if len(fields) < 4:
+        raise FenError(f"expected at least 4 fields: {fen!r}")
+    return parse_fields(*fields[:6])
+
+
+def parse_fields(
+    placement_text, side, castling_text, en_passant_text, halfmove_text="0", fullmove_text="1",
+):
+    rows = placement_text.split("/")
+    if len(rows) != 8:
+        raise FenError(f"expected 8 rows: {placement_text!r}")
+    placement = []
+    for row_text in rows:
+        row = []
+        for letter in row_text:
+            if letter.isdigit():
+                row.extend([None] * int(letter))
+                continue
+            piece_type = piece_types.get(letter.lower())
+            if piece_type is None:
+                raise FenError(f"bad row {row_text!r}")
+            row.append(("white" if letter.isupper() else "black", piece_type))
+        if len(row) != 8:
+            raise FenError(f"bad row {row_text!r}")
+        placement.extend(row)
+
+    if side not in ("w", "b"):
+        raise FenError(f"bad side to move {side!r}")
+    castling = 0
+    if castling_text != "-":
+        for letter in castling_text:
+            if letter not in castling_letters:
+                raise FenError(f"bad castling field {castling_text!r}")
+            castling |= castling_letters[letter]
+    en_passant = None
+    if en_passant_text != "-":
+        try:
+            en_passant = parse_square(en_passant_text)
+        except (ValueError, IndexError):
+            raise FenError(f"bad en passant square {en_passant_text!r}") from None
+        if len(en_passant_text) != 2 or not 0 <= en_passant < 64:
+            raise FenError(f"bad en passant square {en_passant_text!r}")
+    if not halfmove_text.isdigit() or not fullmove_text.isdigit():
+        raise FenError(f"bad move counters {halfmove_text!r} {fullmove_text!r}")
+    return build_position(
+        placement, "white" if side == "w" else "black", castling, en_passant,
+        int(halfmove_text), max(int(fullmove_text), 1))
+
+
+def placement_text(board):
+    rows = []
+    for row in range(8):
+        text = ""
+        empty = 0
+        for piece in board.squares[row * 8:row * 8 + 8]:
+            if piece is None:
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            letter = piece_letters[piece.piece_type]
+            text += letter.upper() if piece.color == "white" else letter
+        if empty:
+            text += str(empty)
+        rows.append(text)
+    return "/".join(rows)
+
+
+def position_fields(piece_set):
+    """ The first four FEN fields for the position piece_set belongs to """
+    board = piece_set.board
+    castling = "".join(
+        letter for letter, right in castling_letters.items() if board.castling & right)
+    en_passant = "-" if board.en_passant is None else square_name(board.en_passant)
+    return [
+        placement_text(board),
+        "w" if board.side_to_move == "white" else "b",
+        castling or "-",
+        en_passant,
+    ]
+
+
+def board_to_fen(piece_set, halfmove=None, fullmove=None):
+    """ FEN string for the position piece_set belongs to, with the board's
+    move counters unless others are given """
+    board = piece_set.board
+    halfmove = board.halfmove if halfmove is None else halfmove
+    fullmove = board.fullmove if fullmove is None else fullmove
+    return " ".join(position_fields(piece_set) + [str(halfmove), str(fullmove)])
+
+
+def parse_epd(line):
+    """ Parse an EPD line into (set to move, operations). Operations map
+    each opcode to its operand string, e.g. {"bm": "Nf3", "id": "WAC.001"}. """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise FenError(f"expected at least 4 fields: {line!r}")
+    piece_set = parse_fields(*fields[:4])
+    operations = {}
+    if len(fields) == 5:
+        for operation in split_operations(fields[4]):
+            opcode, _, operand = operation.strip().partition(" ")
+            if opcode:
+                operations[opcode] = operand.strip().strip('"')
+    return piece_set, operations
+
+
+def split_operations(text):
+    """ Split EPD operations on semicolons outside quoted strings """
+    operations = []
+    current = ""
+    quoted = False
+    for character in text:
+        if character == '"':
+            quoted = not quoted
+        if character == ";" and not quoted:
+            operations.append(current)
+            current = ""
+        else:
+            current += character
+    if current.strip():
+        operations.append(current)
+    return operations
+
+
+def board_to_epd(piece_set, operations=None):
+    """ EPD line for the position piece_set belongs to """
+    text = " ".join(position_fields(piece_set))
+    for opcode, operand in (operations or {}).items():
+        if " " in operand or not operand:
+            operand = f'"{operand}"'
+        text += f" {opcode} {operand};"
+    return text
+
+
+def encode_position(piece_set, halfmove=None, fullmove=None):
+    """ Fixed-size RECORD_SIZE-byte encoding of a position, with the
+    board's move counters unless others are given """
+    board = piece_set.board
+    halfmove = board.halfmove if halfmove is None else halfmove
+    fullmove = board.fullmove if fullmove is None else fullmove
+    occupancy = 0
+    codes = 0
+    count = 0
+    for location, piece in enumerate(board.squares):
+        if piece is not None:
+            occupancy |= 1 << location
+            codes |= piece_codes[(piece.color, piece.piece_type)] << (4 * count)
+            count += 1
+    if count > 32:
+        raise FenError("more than 32 pieces")
+    flags = (board.side_to_move == "black") | board.castling << 1
+    en_passant = NO_SQUARE if board.en_passant is None else board.en_passant
+    return (
+        occupancy.to_bytes(8, "little")
+        + codes.to_bytes(16, "little")
+        + bytes((flags, en_passant, min(halfmove, 255)))
+        + min(fullmove, 0xFFFF).to_bytes(2, "little")
+        + bytes(3)
+    )
+
+
+def decode_header(record):
+    """ (placement, side to move, castling, en passant, halfmove, fullmove)
+    from a record made by encode_position """
+    if len(record) != RECORD_SIZE:
+        raise FenError(f"record must be {RECORD_SIZE} bytes")
+    occupancy = int.from_bytes(record[0:8], "little")
+    codes = int.from_bytes(record[8:24], "little")
+    placement = [None] * 64
+    count = 0
+    while occupancy:
+        low = occupancy & -occupancy
+        code = (codes >> (4 * count)) & 15
+        if code not in code_pieces:
+            raise FenError(f"bad piece code {code}")
+        placement[low.bit_length() - 1] = code_pieces[code]
+        occupancy ^= low
+        count += 1
+    flags = record[24]
+    en_passant = None if record[25] == NO_SQUARE else record[25]
+    fullmove = int.from_bytes(record[27:29], "little")
+    side_to_move = "black" if flags & 1 else "white"
+    return placement, side_to_move, flags >> 1 & 15, en_passant, record[26], fullmove
+
+
+def decode_position(record):
+    """ Rebuild linked sets from a record made by encode_position and return
+    the set to move """
+    return build_position(*decode_header(record))
+
+
+def encode_positions(piece_sets):
+    """ Concatenated records for an iterable of sets """
+    return b"".join(encode_position(piece_set) for piece_set in piece_sets)
+
+
+def decode_positions(data):
+    """ Yield the set to move for each record in data """
+    view = memoryview(data)
+    for offset in range(0, len(view) - RECORD_SIZE + 1, RECORD_SIZE):
+        yield decode_position(bytes(view[offset:offset + RECORD_SIZE]))
+
+
+def write_positions(stream, piece_sets):
+    """ Write records for piece_sets to a binary stream; returns the count """
+    count = 0
+    for piece_set in piece_sets:
+        stream.write(encode_position(piece_set))
+        count += 1
+    return count
+
+
+def read_positions(stream):
+    """ Yield the set to move for each record in a binary stream """
+    while True:
+        record = stream.read(RECORD_SIZE)
+        if len(record) < RECORD_SIZE:
+            return
+        yield decode_position(record)
@@ -0,0 +1,106 @@
+""" Self-contained game state: one position, its side to move and history """
+from fen import START_FEN, board_to_fen, parse_fen
+from pgn import IllegalMoveError
+from rules import game_result, legal_move_table, piece_letters, promotion_types, square_name
+
+
+class GameState:
+
+    """ One game, with no state outside the object, so a process can hold
+    as many as memory allows.
+
+    Moves are named in coordinate notation ("e2e4", "e7e8q"). The legal
+    moves of the current position come from the board's move table cache
+    and their names are kept until the position changes. move_table_limit
+    bounds how many positions that cache holds for this game. """
+
+    __slots__ = ("side", "history", "result", "reason", "names_key", "names")
+
+    def __init__(self, fen=START_FEN, move_table_limit=None):
+        self.side = parse_fen(fen)
+        if move_table_limit is not None:
+            self.side.board.move_table_limit = move_table_limit
+        self.history = []
+        self.names_key = None
+        self.names = None
+        self.result = None
+        self.reason = None
+        self.update_result()
+
+    @property
+    def board(self):
+        return self.side.board
+
+    @property
+    def side_to_move(self):
+        return self.side.color
+
+    def move_table(self):
+        return legal_move_table(self.side)
+
+    def in_check(self):
+        return self.move_table().in_check
+
+    def legal_move_names(self):
+        """ Legal moves of the current position by name, each as (origin,
+        target) or (origin, target, piece type) """
+        key = self.board.position_key(self.side.color)
+        if key != self.names_key:
+            table = self.move_table()
+            squares = self.board.squares
+            names = {}
+            for origin, targets in table.moves.items():
+                is_pawn = squares[origin].piece_type == "pawn"
+                for target in targets + table.captures[origin]:
+                    name = square_name(origin) + square_name(target)
+                    if is_pawn and (target < 8 or target >= 56):
+                        for piece_type in promotion_types:
+                            names[name + piece_letters[piece_type]] = (origin, target, piece_type)
+                    else:
+                        names[name] = (origin, target)
+            self.names_key = key
+            self.names = names
+        return self.names
+
+    def play(self, name):
+        """ Play a move given by name. Raises IllegalMoveError when it is
+        not legal here or the game is over. Returns the captured piece. """
+        if self.result is not None:
+            raise IllegalMoveError(f"{name}: the game is over ({self.result})")
+        move = self.legal_move_names().get(name)
+        if move is None:
+            raise IllegalMoveError(f"{name}: not a legal move")
+        # Names hold origin squares; the piece is whatever stands there now
+        captured = self.board.make_move(self.board.squares[move[0]], *move[1:])
+        self.side = self.side.opponent
+        try:
+            self.update_result()
+        except Exception:
+            # Leave the game as it was rather than half moved
+            self.board.unmake_move()
+            self.side = self.side.opponent
+            raise
+        self.history.append(name)
+        return captured
+
+    def undo(self):
+        """ Take back the last move """
+        if not self.history:
+            raise IllegalMoveError("no move to take back")
+        self.board.unmake_move()
+        self.side = self.side.opponent
+        self.history.pop()
+        self.result = self.reason = None
+
+    def update_result(self):
+        """ Record the result and its reason once the game is over: mate,
+        stalemate, the fifty-move rule, threefold repetition or bare
+        material """
+        # The move table is wanted for the names anyway, and game_result
+        # reads it from the cache instead of trying moves one by one
+        self.move_table()
+        self.result, self.reason = game_result(self.side) or (None, None)
+
+    def fen(self):
+        return board_to_fen(self.side)
+
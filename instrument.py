@@ -0,0 +1,278 @@
+""" Opt-in call counts and timings for the hot paths of the rules core and
+the renderer, with a profiled scripted game """
+import argparse
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import sys
+import time
+
+from engine import Engine
+from rules import game_result, legal_move_table, legal_moves, move_piece, new_game
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Probe name -> (module, attribute). Nothing is wrapped until enable() is
+# called, so with instrumentation off the code runs exactly as written.
+PROBES = {
+    "movegen.possible_moves": ("rules", "Piece.possible_moves"),
+    "movegen.legal_moves": ("rules", "legal_moves"),
+    "movegen.legal_move_table": ("rules", "legal_move_table"),
+    "check.is_there_a_check": ("rules", "is_there_a_check"),
+    "check.pins_and_checks": ("rules", "pins_and_checks"),
+    "check.will_there_be_check": ("rules", "Piece.will_there_be_check"),
+    "check.can_capture": ("rules", "can_capture"),
+    "check.is_square_attacked": ("rules", "is_square_attacked"),
+    "check.game_result": ("rules", "game_result"),
+    "board.make_move": ("rules", "Board.make_move"),
+    "board.unmake_move": ("rules", "Board.unmake_move"),
+    "copy.copy_set": ("rules", "copy_set"),
+    "render.square_contents": ("chess", "square_contents"),
+    "render.board_view": ("chess", "BoardView.render"),
+}
+
+# Probe name -> [calls, seconds], cumulative since enable() or reset()
+totals = {}
+# (owner, attribute, original) for every wrapped attribute
+patches = []
+
+
+def find_module(name):
+    """ A loaded module by name, including the script being run as __main__ """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    main = sys.modules.get("__main__")
+    main_file = getattr(main, "__file__", None)
+    if main_file and os.path.splitext(os.path.basename(main_file))[0] == name:
+        return main
+    return None
+
+
+def repo_modules():
+    for module in list(sys.modules.values()):
+        module_file = getattr(module, "__file__", None)
+        if module_file and os.path.dirname(os.path.abspath(module_file)) == HERE:
+            yield module
+
+
+def make_probe(name, function):
+    record = totals.setdefault(name, [0, 0.0])
+    clock = time.perf_counter
+
+    @functools.wraps(function)
+    def probe(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record[0] += 1
+            record[1] += clock() - start
+
+    return probe
+
+
+def enable(names=None):
+    """ Wrap the probed functions. Probes in modules that are not loaded
+    (the renderer, when running headless) are skipped. Functions imported by
+    name into other modules of the repo are wrapped there too. """
+    if patches:
+        return
+    for name in names or PROBES:
+        module_name, path = PROBES[name]
+        module = find_module(module_name)
+        if module is None:
+            continue
+        *parents, attribute = path.split(".")
+        owner = module
+        for part in parents:
+            owner = getattr(owner, part)
+        original = vars(owner)[attribute]
+        probe = make_probe(name, original)
+        patches.append((owner, attribute, original))
+        setattr(owner, attribute, probe)
+        if not parents:
+            for other in repo_modules():
+                if other is not module and vars(other).get(attribute) is original:
+                    patches.append((other, attribute, original))
+                    setattr(other, attribute, probe)
+
+
+def disable():
+    """ Put the original functions back """
+    while patches:
+        owner, attribute, original = patches.pop()
+        setattr(owner, attribute, original)
+
+
+def is_enabled():
+    return bool(patches)
+
+
+def reset():
+    for record in totals.values():
+        record[0] = 0
+        record[1] = 0.0
+
+
+def snapshot():
+    """ {probe: {"calls": n, "seconds": s}} accumulated so far """
+    return {
+        name: {"calls": calls, "seconds": seconds}
+        for name, (calls, seconds) in totals.items()
+    }
+
+
+def difference(after, before):
+    """ What happened between two snapshots, e.g. during one frame """
+    empty = {"calls": 0, "seconds": 0.0}
+    return {
+        name: {
+            "calls": counts["calls"] - before.get(name, empty)["calls"],
+            "seconds": counts["seconds"] - before.get(name, empty)["seconds"],
+        }
+        for name, counts in after.items()
+    }
+
+
+def to_json(counts, **labels):
+    """ One JSON line: the labels plus the probe counts """
+    record = dict(labels)
+    record["probes"] = counts
+    return json.dumps(record, sort_keys=True)
+
+
+def to_prometheus(counts, **labels):
+    """ Prometheus text exposition of the probe counts """
+    label_text = "".join(f',{key}="{value}"' for key, value in sorted(labels.items()))
+    lines = ["# TYPE chesspy_calls_total counter"]
+    for name in sorted(counts):
+        lines.append(f'chesspy_calls_total{{probe="{name}"{label_text}}} {counts[name]["calls"]}')
+    lines.append("# TYPE chesspy_seconds_total counter")
+    for name in sorted(counts):
+        lines.append(
+            f'chesspy_seconds_total{{probe="{name}"{label_text}}} {counts[name]["seconds"]:.9f}')
+    return "\n".join(lines)
+
+
+formats = {"json": to_json, "prometheus": to_prometheus}
+
+
+class StackTracer:
+
+    """ Records self time per call stack through sys.setprofile and writes
+    it as folded stacks ("outer;inner;leaf microseconds" lines), the input
+    format of flamegraph.pl, inferno and speedscope """
+
+    def __init__(self):
+        self.stacks = []
+        self.folded = {}
+        self.last = None
+
+    def charge(self, now):
+        if self.stacks and self.last is not None:
+            key = self.stacks[-1]
+            self.folded[key] = self.folded.get(key, 0.0) + now - self.last
+        self.last = now
+
+    def profile(self, frame, event, arg):
+        if event == "call":
+            self.charge(time.perf_counter())
+            code = frame.f_code
+            name = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            self.stacks.append(self.stacks[-1] + ";" + name if self.stacks else name)
+        elif event == "return":
+            self.charge(time.perf_counter())
+            if self.stacks:
+                self.stacks.pop()
+
+    def start(self):
+        self.last = time.perf_counter()
+        sys.setprofile(self.profile)
+
+    def stop(self):
+        sys.setprofile(None)
+
+    def write(self, stream):
+        for key in sorted(self.folded):
+            microseconds = round(self.folded[key] * 1000000)
+            if microseconds:
+                stream.write(f"{key} {microseconds}\n")
+
+
+def scripted_game(plies=40, seed=0, depth=None, on_move=None):
+    """ Play a reproducible game: seeded random legal moves, or the engine's
+    choice at a fixed depth. Each turn asks for the move table the way the
+    renderer does. on_move, if given, is called with the ply number after
+    every move. Returns the number of plies played. """
+    white_pieces, black_pieces = new_game()
+    side = white_pieces
+    choose = random.Random(seed).choice
+    engine = Engine(table_mb=4) if depth else None
+    played = 0
+    for ply in range(1, plies + 1):
+        legal_move_table(side)
+        if game_result(side) is not None:
+            break
+        moves = legal_moves(side)
+        if engine is not None:
+            move = engine.search(side, max_depth=depth).move
+        else:
+            move = choose(moves)
+        move_piece(*move)
+        side = side.opponent
+        played = ply
+        if on_move is not None:
+            on_move(ply)
+    return played
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--plies", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--depth", type=int, default=None, help="let the engine pick moves")
+    parser.add_argument("--format", choices=sorted(formats), default="json")
+    parser.add_argument("--per-move", action="store_true", help="export counts after every move")
+    parser.add_argument("--profile", metavar="FILE", help="write cProfile stats of the game")
+    parser.add_argument("--folded", metavar="FILE", help="write folded stacks of the game")
+    args = parser.parse_args(argv)
+    export = formats[args.format]
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(scripted_game, args.plies, args.seed, args.depth)
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+    if args.folded:
+        tracer = StackTracer()
+        tracer.start()
+        try:
+            scripted_game(args.plies, args.seed, args.depth)
+        finally:
+            tracer.stop()
+        with open(args.folded, "w") as stream:
+            tracer.write(stream)
+        print(f"{len(tracer.folded)} stacks written to {args.folded}")
+
+    enable()
+    previous = snapshot()
+
+    def on_move(ply):
+        nonlocal previous
+        current = snapshot()
+        print(export(difference(current, previous), scope="move", ply=ply))
+        previous = current
+
+    played = scripted_game(
+        args.plies, args.seed, args.depth, on_move if args.per_move else None)
+    disable()
+    print(export(snapshot(), scope="game", plies=played))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+""" Multi-process search and batch analysis on top of engine.py """
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from engine import MAX_PLY, Engine
+from fen import START_FEN, parse_fen
+from rules import legal_moves, move_name
+
+
+def search_subset(fen, move_names, max_depth, time_limit, node_limit, table_mb):
+    """ Worker: search fen with the root limited to move_names. Returns the
+    (depth, score, move, nodes) of every completed iteration. """
+    iterations = []
+
+    def record(result):
+        iterations.append((result.depth, result.score, move_name(result.move), result.nodes))
+
+    engine = Engine(table_mb)
+    result = engine.search(
+        parse_fen(fen), max_depth, time_limit, node_limit, record, move_names)
+    if not iterations and result.move is not None:
+        iterations.append((0, result.score, move_name(result.move), result.nodes))
+    return iterations, engine.nodes
+
+
+def parallel_search(
+    fen, workers=None, max_depth=MAX_PLY, time_limit=None, node_limit=None, table_mb=16,
+):
+    """ Split the root moves of fen across worker processes, each running
+    its own iterative deepening. The answer is the best move at the deepest
+    depth every worker completed. node_limit applies per worker.
+
+    Returns (move name, score, depth, total nodes, elapsed seconds). """
+    workers = workers or os.cpu_count() or 1
+    names = [move_name(move) for move in legal_moves(parse_fen(fen))]
+    if not names:
+        return None, 0, 0, 0, 0.0
+    # Deal moves round-robin so each worker gets a mix of early and late ones
+    subsets = [names[index::workers] for index in range(workers)]
+    subsets = [subset for subset in subsets if subset]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(len(subsets)) as pool:
+        jobs = [
+            pool.apply_async(
+                search_subset, (fen, subset, max_depth, time_limit, node_limit, table_mb))
+            for subset in subsets
+        ]
+        outcomes = [job.get() for job in jobs]
+    elapsed = time.perf_counter() - start
+
+    nodes = sum(worker_nodes for iterations, worker_nodes in outcomes)
+    depth = min(iterations[-1][0] for iterations, worker_nodes in outcomes)
+    best = None
+    for iterations, worker_nodes in outcomes:
+        for iteration_depth, score, name, iteration_nodes in iterations:
+            if iteration_depth == depth and (best is None or score > best[1]):
+                best = (name, score)
+    return best[0], best[1], depth, nodes, elapsed
+
+
+def analyse_one(job):
+    """ Worker: search one batch position. A FEN that cannot be read gives
+    {"error": message} instead of ending the whole batch. """
+    index, fen, max_depth, time_limit, node_limit, table_mb = job
+    try:
+        piece_set = parse_fen(fen)
+    except ValueError as error:
+        return index, fen, {"error": str(error)}
+    engine = Engine(table_mb)
+    result = engine.search(piece_set, max_depth, time_limit, node_limit)
+    return index, fen, {
+        "move": move_name(result.move),
+        "score": result.score,
+        "depth": result.depth,
+        "nodes": result.nodes,
+        "elapsed": result.elapsed,
+    }
+
+
+def analyse_batch(
+    fens, workers=None, max_depth=MAX_PLY, time_limit=None, node_limit=None, table_mb=16,
+):
+    """ Search every FEN in fens on a pool of worker processes and yield
+    (index, fen, result) as each one finishes, in completion order. fens may
+    be any iterable, including a generator reading from a file. result is
+    {"error": message} for a FEN that cannot be read. """
+    workers = workers or os.cpu_count() or 1
+    jobs = (
+        (index, fen, max_depth, time_limit, node_limit, table_mb)
+        for index, fen in enumerate(fens)
+    )
+    with multiprocessing.Pool(workers) as pool:
+        for outcome in pool.imap_unordered(analyse_one, jobs):
+            yield outcome
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("fen", nargs="?", default=START_FEN)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--depth", type=int, default=MAX_PLY)
+    parser.add_argument("--movetime", type=float, default=None, help="seconds")
+    parser.add_argument("--nodes", type=int, default=None, help="per worker")
+    parser.add_argument(
+        "--batch", metavar="FILE",
+        help="analyse one FEN per line of FILE ('-' for stdin) instead of one position")
+    args = parser.parse_args(argv)
+    if args.movetime is None and args.nodes is None and args.depth == MAX_PLY:
+        args.movetime = 5.0
+
+    if args.batch:
+        lines = sys.stdin if args.batch == "-" else open(args.batch)
+        fens = (line.strip() for line in lines if line.strip())
+        start = time.perf_counter()
+        count = errors = 0
+        for index, fen, result in analyse_batch(
+            fens, args.workers, args.depth, args.movetime, args.nodes
+        ):
+            count += 1
+            if "error" in result:
+                errors += 1
+                print(f"{index}\terror\t{result['error']}\t{fen}", flush=True)
+                continue
+            print(
+                f"{index}\t{result['move']}\t{result['score']}\t"
+                f"depth {result['depth']}\tnodes {result['nodes']}\t{fen}",
+                flush=True,
+            )
+        elapsed = time.perf_counter() - start
+        print(
+            f"{count} positions in {elapsed:.2f} s ({count / elapsed:.2f}/s), "
+            f"{errors} unreadable")
+        return 1 if errors else 0
+
+    move, score, depth, nodes, elapsed = parallel_search(
+        args.fen, args.workers, args.depth, args.movetime, args.nodes)
+    print(
+        f"bestmove {move} score {score} depth {depth} nodes {nodes} "
+        f"nps {nodes / max(elapsed, 1e-9):.0f}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
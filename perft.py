@@ -0,0 +1,128 @@
+""" Perft: count leaf nodes of the legal move tree to a fixed depth """
+import argparse
+import sys
+import time
+
+from fen import START_FEN, parse_fen
+from rules import legal_moves, move_name
+
+# Standard reference positions with their node counts at depth 1, 2, ...
+REFERENCE_POSITIONS = [
+    ("start", START_FEN, [20, 400, 8902, 197281, 4865609]),
+    (
+        "kiwipete",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603],
+    ),
+    (
+        "position 3",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624],
+    ),
+    (
+        "position 4",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333],
+    ),
+    (
+        "position 5",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487],
+    ),
+    (
+        "position 6",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594],
+    ),
+]
+
+
+def perft(piece_set, depth):
+    """ Number of leaf nodes depth plies below the position with piece_set
+    to move """
+    moves = legal_moves(piece_set)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    board = piece_set.board
+    opponent = piece_set.opponent
+    nodes = 0
+    for move in moves:
+        board.make_move(*move)
+        nodes += perft(opponent, depth - 1)
+        board.unmake_move()
+    return nodes
+
+
+def divide(piece_set, depth):
+    """ Leaf counts below each root move, keyed by move name """
+    board = piece_set.board
+    counts = {}
+    for move in legal_moves(piece_set):
+        name = move_name(move)
+        board.make_move(*move)
+        counts[name] = perft(piece_set.opponent, depth - 1)
+        board.unmake_move()
+    return counts
+
+
+def run(fen, depth, show_divide=False):
+    piece_set = parse_fen(fen)
+    start = time.perf_counter()
+    if show_divide:
+        counts = divide(piece_set, depth)
+        for name in sorted(counts):
+            print(f"{name}: {counts[name]}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(piece_set, depth)
+    elapsed = time.perf_counter() - start
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.3f} s ({nodes / max(elapsed, 1e-9):.0f} nps)")
+    return nodes
+
+
+def run_suite(max_nodes=100000):
+    """ Check every reference position at each depth whose expected count
+    is at most max_nodes. Returns True when all counts match. """
+    ok = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected_counts in REFERENCE_POSITIONS:
+        piece_set = parse_fen(fen)
+        for depth, expected in enumerate(expected_counts, 1):
+            if expected > max_nodes:
+                break
+            start = time.perf_counter()
+            nodes = perft(piece_set, depth)
+            elapsed = time.perf_counter() - start
+            total_nodes += nodes
+            total_time += elapsed
+            status = "ok" if nodes == expected else "FAIL"
+            if nodes != expected:
+                ok = False
+            print(
+                f"{status:4} {name:10} depth {depth}: {nodes:>9} "
+                f"(expected {expected}) {nodes / max(elapsed, 1e-9):8.0f} nps"
+            )
+    print(f"{total_nodes} nodes in {total_time:.2f} s ({total_nodes / max(total_time, 1e-9):.0f} nps)")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("fen", nargs="?", default=START_FEN)
+    parser.add_argument("--divide", action="store_true", help="show counts per root move")
+    parser.add_argument("--suite", action="store_true", help="run the reference positions")
+    parser.add_argument(
+        "--max-nodes", type=int, default=100000,
+        help="skip suite depths expected to exceed this many nodes")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.max_nodes) else 1
+    run(args.fen, args.depth, args.divide)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
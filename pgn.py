@@ -0,0 +1,383 @@
+""" Streaming PGN reader that replays games through the rules core """
+import argparse
+import bz2
+import gzip
+import sys
+import time
+
+from fen import parse_fen
+from rules import (
+    BLACK_KINGSIDE,
+    BLACK_QUEENSIDE,
+    WHITE_KINGSIDE,
+    WHITE_QUEENSIDE,
+    castling_paths,
+    castling_targets,
+    has_legal_move,
+    increase_point_total,
+    is_legal_move,
+    is_there_a_check,
+    new_game,
+    parse_square,
+    piece_letters,
+    square_name,
+)
+
+san_piece_types = {
+    "N": "knight",
+    "B": "bishop",
+    "R": "rook",
+    "Q": "queen",
+    "K": "king",
+}
+
+results = ("1-0", "0-1", "1/2-1/2", "*")
+
+# Tags written first, in this order, by format_game
+seven_tag_roster = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+# SAN castling -> the castling right it uses, by color
+san_castling = {
+    ("O-O", "white"): WHITE_KINGSIDE,
+    ("O-O-O", "white"): WHITE_QUEENSIDE,
+    ("O-O", "black"): BLACK_KINGSIDE,
+    ("O-O-O", "black"): BLACK_QUEENSIDE,
+}
+
+
+class IllegalMoveError(ValueError):
+    pass
+
+
+class Game:
+
+    """ One game as read from a PGN file: tag pairs and SAN moves """
+
+    __slots__ = ("headers", "moves", "result")
+
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+
+def open_pgn(path):
+    """ Open a PGN file for reading text, decompressing .gz and .bz2 """
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def read_games(lines):
+    """ Yield a Game for every game in an iterable of lines. Only the game
+    being read is held in memory, so files of any size stream through. """
+    headers = {}
+    moves = []
+    result = None
+    in_comment = False
+    in_movetext = False
+    variation_depth = 0
+
+    for line in lines:
+        if not in_comment and line.startswith("["):
+            if in_movetext or result is not None:
+                yield Game(headers, moves, result or "*")
+                headers, moves, result = {}, [], None
+                in_movetext = False
+                variation_depth = 0
+            tag = parse_tag(line)
+            if tag is not None:
+                headers[tag[0]] = tag[1]
+            continue
+        if not in_comment and line.startswith("%"):
+            continue
+
+        position = 0
+        length = len(line)
+        while position < length:
+            if in_comment:
+                end = line.find("}", position)
+                if end < 0:
+                    break
+                in_comment = False
+                position = end + 1
+                continue
+            character = line[position]
+            if character.isspace():
+                position += 1
+            elif character == "{":
+                in_comment = True
+                position += 1
+            elif character == ";":
+                break
+            elif character == "(":
+                variation_depth += 1
+                position += 1
+            elif character == ")":
+                variation_depth = max(0, variation_depth - 1)
+                position += 1
+            else:
+                end = position
+                while end < length and not line[end].isspace() and line[end] not in "{};()":
+                    end += 1
+                token = line[position:end]
+                position = end
+                in_movetext = True
+                if variation_depth or token.startswith("$"):
+                    continue
+                if token in results:
+                    result = token
+                    continue
+                # Move numbers, possibly glued to the move as in "12.e4"
+                token = token.lstrip("0123456789").lstrip(".")
+                if token:
+                    moves.append(token)
+
+    if in_movetext or headers:
+        yield Game(headers, moves, result or "*")
+
+
+def parse_tag(line):
+    line = line.strip()
+    if not line.endswith("]"):
+        return None
+    body = line[1:-1].strip()
+    name, _, value = body.partition(" ")
+    value = value.strip()
+    if value.startswith('"') and value.endswith('"') and len(value) >= 2:
+        value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return name, value
+
+
+def parse_san(piece_set, san):
+    """ The legal move in piece_set's position that san names: (piece,
+    target), or (piece, target, piece type) for a promotion. Raises
+    IllegalMoveError when no legal move matches, or more than one. """
+    text = san.rstrip("+#!?")
+    castling = text.replace("0", "O")
+    if castling in ("O-O", "O-O-O"):
+        king = piece_set.pieces["king"]
+        target = castling_paths[san_castling[(castling, piece_set.color)]][0]
+        if target not in castling_targets(piece_set) or not is_legal_move(king, target):
+            raise IllegalMoveError(f"{san}: castling is not allowed here")
+        return king, target
+
+    promotion = None
+    if "=" in text or (len(text) > 2 and text[-1] in "NBRQ" and text[-2].isdigit()):
+        promotion = san_piece_types.get(text[-1])
+        text = text[:-1].rstrip("=")
+        if promotion is None or promotion == "king":
+            raise IllegalMoveError(f"{san}: bad promotion")
+
+    if text[:1] in san_piece_types:
+        piece_type = san_piece_types[text[0]]
+        text = text[1:]
+    else:
+        piece_type = "pawn"
+    if len(text) < 2:
+        raise IllegalMoveError(f"{san}: cannot parse")
+    try:
+        target = parse_square(text[-2:])
+    except (ValueError, IndexError):
+        raise IllegalMoveError(f"{san}: cannot parse") from None
+    qualifier = text[:-2].replace("x", "")
+
+    matches = []
+    for name, piece in list(piece_set.pieces.items()):
+        if piece.piece_type != piece_type:
+            continue
+        origin = square_name(piece.location)
+        if not all(character in origin for character in qualifier):
+            continue
+        if piece_type == "king" and abs(target - piece.location) == 2:
+            continue
+        mvs, captures = piece.possible_moves(piece.location, False, piece_set.opponent)
+        if (target in mvs or target in captures) and is_legal_move(piece, target):
+            matches.append((piece, target))
+    if not matches:
+        raise IllegalMoveError(f"{san}: no legal move matches")
+    if len(matches) > 1:
+        raise IllegalMoveError(f"{san}: ambiguous")
+    if piece_type == "pawn" and (target < 8 or target >= 56):
+        if promotion is None:
+            raise IllegalMoveError(f"{san}: promotion piece missing")
+        return matches[0] + (promotion,)
+    if promotion is not None:
+        raise IllegalMoveError(f"{san}: only pawns reaching the last row promote")
+    return matches[0]
+
+
+def san_name(piece_set, move):
+    """ SAN for move, one of piece_set's legal moves, with the fewest
+    origin characters that make it unambiguous and a check or mate mark """
+    piece, target = move[0], move[1]
+    board = piece_set.board
+    origin = square_name(piece.location)
+    if piece.piece_type == "king" and abs(target - piece.location) == 2:
+        text = "O-O" if target % 8 == 6 else "O-O-O"
+    elif piece.piece_type == "pawn":
+        text = square_name(target)
+        if target % 8 != piece.location % 8:
+            text = origin[0] + "x" + text
+        if len(move) > 2:
+            text += "=" + piece_letters[move[2]].upper()
+    else:
+        rivals = []
+        for other in list(piece_set.pieces.values()):
+            if other is piece or other.piece_type != piece.piece_type:
+                continue
+            mvs, captures = other.possible_moves(other.location, False, piece_set.opponent)
+            if (target in mvs or target in captures) and is_legal_move(other, target):
+                rivals.append(square_name(other.location))
+        qualifier = ""
+        if rivals:
+            if all(rival[0] != origin[0] for rival in rivals):
+                qualifier = origin[0]
+            elif all(rival[1] != origin[1] for rival in rivals):
+                qualifier = origin[1]
+            else:
+                qualifier = origin
+        capture = "x" if board.squares[target] is not None else ""
+        text = piece_letters[piece.piece_type].upper() + qualifier + capture + square_name(target)
+
+    board.make_move(*move)
+    opponent = piece_set.opponent
+    if is_there_a_check(opponent, piece_set):
+        text += "+" if has_legal_move(opponent) else "#"
+    board.unmake_move()
+    return text
+
+
+def format_game(headers, sans, result):
+    """ PGN text for one game: the seven tag roster, any other tags, then
+    the movetext wrapped at 80 columns """
+    tags = dict(headers, Result=result)
+    names = [name for name in seven_tag_roster if name in tags]
+    names += [name for name in tags if name not in seven_tag_roster]
+    lines = []
+    for name in names:
+        value = str(tags[name]).replace("\\", "\\\\").replace('"', '\\"')
+        lines.append(f'[{name} "{value}"]')
+    lines.append("")
+
+    tokens = []
+    for ply, san in enumerate(sans):
+        if ply % 2 == 0:
+            tokens.append(f"{ply // 2 + 1}.")
+        tokens.append(san)
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def starting_set(game):
+    """ The set to move at the start of game, honouring a FEN tag """
+    fen = game.headers.get("FEN")
+    if fen:
+        return parse_fen(fen)
+    white_pieces, black_pieces = new_game()
+    return white_pieces
+
+
+class Replay:
+
+    """ Outcome of replaying one game: plies played, the first illegal
+    move if any as (ply, SAN or None, reason), and the material won by each
+    side after every ply """
+
+    __slots__ = ("game", "plies", "illegal", "timeline")
+
+    def __init__(self, game):
+        self.game = game
+        self.plies = 0
+        self.illegal = None
+        self.timeline = []
+
+
+def positions(game):
+    """ Yield (ply, side to move, move played, captured piece) for each move
+    of game as it is replayed. The sets are live and change as the
+    generator advances. Raises IllegalMoveError at the first illegal move. """
+    piece_set = starting_set(game)
+    for ply, san in enumerate(game.moves, 1):
+        move = parse_san(piece_set, san)
+        captured = piece_set.board.make_move(*move)
+        yield ply, piece_set.opponent, move, captured
+        piece_set = piece_set.opponent
+
+
+def replay(game, with_timeline=False):
+    """ Replay game, recording where it first goes wrong and optionally the
+    material timeline as (white points, black points) per ply """
+    outcome = Replay(game)
+    points = {"white": 0, "black": 0}
+    moves = positions(game)
+    while True:
+        try:
+            ply, piece_set, move, captured = next(moves)
+        except StopIteration:
+            break
+        except (IllegalMoveError, ValueError) as error:
+            # A bad FEN tag fails before any move, possibly in a game with none
+            san = game.moves[outcome.plies] if outcome.plies < len(game.moves) else None
+            outcome.illegal = (outcome.plies + 1, san, str(error))
+            break
+        outcome.plies = ply
+        if captured is not None:
+            mover = move[0].color
+            points[mover] = increase_point_total(captured, points[mover])
+        if with_timeline:
+            outcome.timeline.append((points["white"], points["black"]))
+    return outcome
+
+
+def validate(lines, with_timeline=False):
+    """ Replay every game in lines, yielding a Replay for each """
+    for game in read_games(lines):
+        yield replay(game, with_timeline)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pgn", help="PGN file, optionally .gz or .bz2, or - for stdin")
+    parser.add_argument("--timeline", action="store_true", help="print material per ply")
+    parser.add_argument("--quiet", action="store_true", help="only report illegal games")
+    args = parser.parse_args(argv)
+
+    games = plies = illegal = 0
+    start = time.perf_counter()
+    with open_pgn(args.pgn) as lines:
+        for outcome in validate(lines, args.timeline):
+            games += 1
+            plies += outcome.plies
+            headers = outcome.game.headers
+            label = f"{headers.get('White', '?')} - {headers.get('Black', '?')}"
+            if outcome.illegal is not None:
+                illegal += 1
+                ply, san, reason = outcome.illegal
+                print(f"game {games} ({label}): illegal move at ply {ply}: {reason}")
+            elif not args.quiet:
+                print(f"game {games} ({label}): {outcome.plies} plies ok {outcome.game.result}")
+            if args.timeline:
+                print("  " + " ".join(f"{white}-{black}" for white, black in outcome.timeline))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{games} games, {plies} plies, {illegal} with illegal moves in {elapsed:.2f} s "
+        f"({games / max(elapsed, 1e-9):.1f} games/s, {plies / max(elapsed, 1e-9):.0f} plies/s)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1291 @@
+""" Rules core for chess, free of any pygame or display dependency """
+
+# Squares are indexed 0-63, row by row from the top of the board as the
+# first person sees it: square = row * 8 + column. Pixels only exist in the
+# renderer, which converts with square_to_pixels / pixels_to_square.
+
+UP = -1
+DOWN = 1
+LEFT = -1
+RIGHT = 1
+diagonals = [(RIGHT, UP), (RIGHT, DOWN), (LEFT, UP), (LEFT, DOWN)]
+lines = [(RIGHT, 0), (LEFT, 0), (0, UP), (0, DOWN)]
+knight_moves = [
+    (LEFT, UP * 2),
+    (RIGHT, UP * 2),
+    (RIGHT, DOWN * 2),
+    (LEFT, DOWN * 2),
+    (LEFT * 2, UP),
+    (LEFT * 2, DOWN),
+    (RIGHT * 2, UP),
+    (RIGHT * 2, DOWN),
+]
+
+
+def square_at(column, row):
+    return row * 8 + column
+
+
+def square_name(square):
+    """ Algebraic name of a square, e.g. 52 -> "e2" """
+    return "abcdefgh"[square % 8] + str(8 - square // 8)
+
+
+def parse_square(name):
+    """ Square index of an algebraic name, e.g. "e2" -> 52 """
+    return square_at("abcdefgh".index(name[0]), 8 - int(name[1]))
+
+
+first_person_locations = {
+    "pawn0": square_at(0, 6),
+    "pawn1": square_at(1, 6),
+    "pawn2": square_at(2, 6),
+    "pawn3": square_at(3, 6),
+    "pawn4": square_at(4, 6),
+    "pawn5": square_at(5, 6),
+    "pawn6": square_at(6, 6),
+    "pawn7": square_at(7, 6),
+    "knight0": square_at(1, 7),
+    "knight1": square_at(6, 7),
+    "bishop0": square_at(2, 7),
+    "bishop1": square_at(5, 7),
+    "rook0": square_at(0, 7),
+    "rook1": square_at(7, 7),
+    "queen": square_at(3, 7),
+    "king": square_at(4, 7),
+}
+
+second_person_locations = {
+    "pawn0": square_at(0, 1),
+    "pawn1": square_at(1, 1),
+    "pawn2": square_at(2, 1),
+    "pawn3": square_at(3, 1),
+    "pawn4": square_at(4, 1),
+    "pawn5": square_at(5, 1),
+    "pawn6": square_at(6, 1),
+    "pawn7": square_at(7, 1),
+    "knight0": square_at(1, 0),
+    "knight1": square_at(6, 0),
+    "bishop0": square_at(2, 0),
+    "bishop1": square_at(5, 0),
+    "rook0": square_at(0, 0),
+    "rook1": square_at(7, 0),
+    "queen": square_at(3, 0),
+    "king": square_at(4, 0),
+}
+
+
+def offset_square(square, column_step, row_step):
+    """ Step from square, or return None when leaving the board """
+    column = square % 8 + column_step
+    row = square // 8 + row_step
+    if column < 0 or column > 7 or row < 0 or row > 7:
+        return None
+    return row * 8 + column
+
+
+def pawn_forward(color):
+    if color == "white":
+        return UP
+    return DOWN
+
+
+piece_letters = {
+    "pawn": "p",
+    "knight": "n",
+    "bishop": "b",
+    "rook": "r",
+    "queen": "q",
+    "king": "k",
+}
+
+# Positions whose legal-move tables a board remembers before starting over
+MOVE_TABLE_LIMIT = 4096
+
+sliding_directions = {
+    "bishop": diagonals,
+    "rook": lines,
+    "queen": diagonals + lines,
+}
+
+other_color = {"white": "black", "black": "white"}
+
+
+# Move tables, built once at import. Targets are tuples of squares in the
+# same order the step lists above give them; attack tables are bitmasks.
+def step_targets(steps):
+    targets = []
+    for square in range(64):
+        stepped = (offset_square(square, column_step, row_step) for column_step, row_step in steps)
+        targets.append(tuple(target for target in stepped if target is not None))
+    return targets
+
+
+def target_mask(targets):
+    mask = 0
+    for target in targets:
+        mask |= 1 << target
+    return mask
+
+
+def ray(square, column_step, row_step):
+    """ Squares from square outwards in one direction, to the board edge """
+    squares = []
+    target = offset_square(square, column_step, row_step)
+    while target is not None:
+        squares.append(target)
+        target = offset_square(target, column_step, row_step)
+    return tuple(squares)
+
+
+knight_targets = step_targets(knight_moves)
+king_targets = step_targets(diagonals + lines)
+pawn_capture_targets = {
+    color: step_targets([(RIGHT, pawn_forward(color)), (LEFT, pawn_forward(color))])
+    for color in ("white", "black")
+}
+knight_attacks = [target_mask(targets) for targets in knight_targets]
+king_attacks = [target_mask(targets) for targets in king_targets]
+pawn_attacks = {
+    color: [target_mask(targets) for targets in pawn_capture_targets[color]]
+    for color in ("white", "black")
+}
+# Per-direction rays from every square, and for each slider the non-empty
+# rays it can travel from every square
+rays = {direction: [ray(square, *direction) for square in range(64)] for direction in diagonals + lines}
+slider_rays = {
+    piece_type: [
+        tuple(rays[direction][square] for direction in directions if rays[direction][square])
+        for square in range(64)
+    ]
+    for piece_type, directions in sliding_directions.items()
+}
+
+# Castling rights bitmask. White is the first person, so its king and rooks
+# start on the bottom row.
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+castling_squares = {
+    WHITE_KINGSIDE: (square_at(4, 7), square_at(7, 7)),
+    WHITE_QUEENSIDE: (square_at(4, 7), square_at(0, 7)),
+    BLACK_KINGSIDE: (square_at(4, 0), square_at(7, 0)),
+    BLACK_QUEENSIDE: (square_at(4, 0), square_at(0, 0)),
+}
+castling_colors = {
+    WHITE_KINGSIDE: "white",
+    WHITE_QUEENSIDE: "white",
+    BLACK_KINGSIDE: "black",
+    BLACK_QUEENSIDE: "black",
+}
+# Rights that survive a move starting or ending on each square
+castling_keep = [ALL_CASTLING] * 64
+for right, (king_square, rook_square) in castling_squares.items():
+    castling_keep[king_square] &= ~right
+    castling_keep[rook_square] &= ~right
+# Castling is played as a two-square king move. For each right: the king's
+# target, the squares that must be empty and the squares the king stands on,
+# crosses or lands on, none of which may be attacked.
+castling_paths = {
+    WHITE_KINGSIDE: (square_at(6, 7), (square_at(5, 7), square_at(6, 7)),
+                     (square_at(4, 7), square_at(5, 7), square_at(6, 7))),
+    WHITE_QUEENSIDE: (square_at(2, 7), (square_at(1, 7), square_at(2, 7), square_at(3, 7)),
+                      (square_at(4, 7), square_at(3, 7), square_at(2, 7))),
+    BLACK_KINGSIDE: (square_at(6, 0), (square_at(5, 0), square_at(6, 0)),
+                     (square_at(4, 0), square_at(5, 0), square_at(6, 0))),
+    BLACK_QUEENSIDE: (square_at(2, 0), (square_at(1, 0), square_at(2, 0), square_at(3, 0)),
+                      (square_at(4, 0), square_at(3, 0), square_at(2, 0))),
+}
+# King target of a castling move -> (rook origin, rook target)
+castling_rook_moves = {
+    castling_paths[right][0]: (rook_square, (king_square + castling_paths[right][0]) // 2)
+    for right, (king_square, rook_square) in castling_squares.items()
+}
+
+# Pieces a pawn may promote to, in the order promotions are generated
+promotion_types = ("queen", "rook", "bishop", "knight")
+
+# Every square: the check or pin mask that restricts nothing
+ALL_SQUARES = (1 << 64) - 1
+
+
+def splitmix64(seed):
+    """ Endless stream of 64-bit pseudo-random numbers from seed. Used
+    instead of the random module to keep importing this module cheap. """
+    mask = 0xFFFFFFFFFFFFFFFF
+    while True:
+        seed = (seed + 0x9E3779B97F4A7C15) & mask
+        value = ((seed ^ (seed >> 30)) * 0xBF58476D1CE4E5B9) & mask
+        value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & mask
+        yield value ^ (value >> 31)
+
+
+# Zobrist keys, fixed by seed so hashes are stable across processes
+zobrist_random = splitmix64(0x5EED)
+zobrist_pieces = {
+    color: {
+        piece_type: [next(zobrist_random) for square in range(64)]
+        for piece_type in piece_letters
+    }
+    for color in ("white", "black")
+}
+zobrist_side = next(zobrist_random)
+zobrist_castling = [next(zobrist_random) for rights in range(16)]
+zobrist_castling[0] = 0
+zobrist_en_passant = [next(zobrist_random) for column in range(8)]
+del zobrist_random
+
+# Material plus piece-square scores in centipawns, from white's side and
+# laid out like the board, a8 first. The king has a middlegame and an
+# endgame table; everything else scores the same in both. Boards keep the
+# sums incrementally, like the hash, and evaluate.py blends them by phase.
+material_scores = {"pawn": 100, "knight": 320, "bishop": 330, "rook": 500, "queen": 900, "king": 0}
+piece_square_tables = {
+    "pawn": (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    "knight": (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    "bishop": (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    "rook": (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    "queen": (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    "king": (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ),
+}
+king_endgame_table = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+# Game phase: 24 with all minor and major pieces on the board, 0 with none
+phase_weights = {"pawn": 0, "knight": 1, "bishop": 1, "rook": 2, "queen": 4, "king": 0}
+MAX_PHASE = 24
+
+
+def square_scores(color, table, material):
+    """ Per-square scores of one piece with white's sign: black mirrors the
+    table top to bottom and counts negatively """
+    if color == "white":
+        return [material + table[square] for square in range(64)]
+    return [-(material + table[square ^ 56]) for square in range(64)]
+
+
+middlegame_scores = {
+    color: {
+        piece_type: square_scores(color, table, material_scores[piece_type])
+        for piece_type, table in piece_square_tables.items()
+    }
+    for color in ("white", "black")
+}
+endgame_scores = {
+    color: dict(tables, king=square_scores(color, king_endgame_table, 0))
+    for color, tables in middlegame_scores.items()
+}
+
+
+class Board:
+
+    """ Mailbox of 64 squares shared by both sets, kept in sync with
+    Piece.location so occupancy is a single index lookup.
+
+    The board also keeps an attack map per side: attack_counts[color][square]
+    is the number of that side's pieces attacking (or defending) square.
+    make_move and unmake_move update it incrementally, so asking whether a
+    king is in check is one lookup.
+
+    hash is a Zobrist hash of the piece placement, side to move, castling
+    rights and en passant file, also updated incrementally. The en passant
+    file only counts when an enemy pawn stands beside the pawn that just
+    moved two squares.
+
+    middlegame and endgame are the material and piece-square scores of the
+    position from white's side, phase how much material is left to blend
+    them (see evaluate.py), and mobility[color] the total number of squares
+    color's pieces attack. All are kept up to date the same way.
+
+    The rest of the game state sits beside it: castling is a bitmask of the
+    rights still held, en_passant the square a pawn may take on, halfmove
+    the plies since the last capture or pawn move and fullmove the FEN move
+    number. The undo stack of hashes doubles as the repetition history. """
+
+    __slots__ = (
+        "squares",
+        "sets",
+        "attack_counts",
+        "move_tables",
+        "move_table_limit",
+        "side_to_move",
+        "castling",
+        "en_passant",
+        "en_passant_key",
+        "halfmove",
+        "fullmove",
+        "hash",
+        "middlegame",
+        "endgame",
+        "phase",
+        "mobility",
+        "undo_pieces",
+        "undo_origins",
+        "undo_captured",
+        "undo_was_moved",
+        "undo_castling",
+        "undo_en_passant",
+        "undo_en_passant_key",
+        "undo_halfmove",
+        "undo_hash",
+    )
+
+    def __init__(self):
+        self.squares = [None] * 64
+        self.sets = ()
+        self.attack_counts = {"white": [0] * 64, "black": [0] * 64}
+        self.move_tables = {}
+        self.move_table_limit = MOVE_TABLE_LIMIT
+        self.side_to_move = "white"
+        self.castling = 0
+        self.en_passant = None
+        self.en_passant_key = 0
+        self.halfmove = 0
+        self.fullmove = 1
+        self.hash = 0
+        self.middlegame = 0
+        self.endgame = 0
+        self.phase = 0
+        self.mobility = {"white": 0, "black": 0}
+        # make_move pushes one entry onto each stack; unmake_move pops them.
+        # Only references to existing objects are stored, so trying a move
+        # allocates nothing beyond list growth.
+        self.undo_pieces = []
+        self.undo_origins = []
+        self.undo_captured = []
+        self.undo_was_moved = []
+        self.undo_castling = []
+        self.undo_en_passant = []
+        self.undo_en_passant_key = []
+        self.undo_halfmove = []
+        self.undo_hash = []
+
+    def place(self, piece, location):
+        piece.location = location
+        self.squares[location] = piece
+
+    def lift(self, piece):
+        self.squares[piece.location] = None
+
+    def move_piece(self, piece, location):
+        self.squares[piece.location] = None
+        piece.location = location
+        self.squares[location] = piece
+
+    def make_move(self, piece, location, promotion=None):
+        """ Move piece to location in place, capturing any enemy standing
+        there. A king moving two squares castles, a pawn moving to the en
+        passant square takes the pawn beside it and a pawn reaching the last
+        row becomes promotion (a queen unless given). Reversed exactly by
+        unmake_move. """
+        squares = self.squares
+        origin = piece.location
+        captured = squares[location]
+        captured_location = location
+        changed = (1 << origin) | (1 << location)
+        promoted = None
+        rook = None
+        if piece.piece_type == "pawn":
+            if location == self.en_passant:
+                captured_location = origin - origin % 8 + location % 8
+                captured = squares[captured_location]
+                changed |= 1 << captured_location
+            elif location < 8 or location >= 56:
+                promoted = self.promoted_piece(piece, promotion or "queen", location)
+        elif piece.piece_type == "king" and abs(location - origin) == 2:
+            rook_origin, rook_location = castling_rook_moves[location]
+            rook = squares[rook_origin]
+            changed |= (1 << rook_origin) | (1 << rook_location)
+        affected = self.sliders_through(changed)
+        if rook is not None and rook not in affected:
+            affected.append(rook)
+        for other in affected:
+            if other is not piece:
+                self.count_attacks(other, -1)
+        self.count_attacks(piece, -1)
+        if captured is not None:
+            del captured.set.pieces[captured.piece_name]
+            if captured not in affected:
+                self.count_attacks(captured, -1)
+
+        self.undo_pieces.append(piece)
+        self.undo_origins.append(origin)
+        self.undo_captured.append(captured)
+        self.undo_was_moved.append(piece.is_moved)
+        self.undo_castling.append(self.castling)
+        self.undo_en_passant.append(self.en_passant)
+        self.undo_en_passant_key.append(self.en_passant_key)
+        self.undo_halfmove.append(self.halfmove)
+        self.undo_hash.append(self.hash)
+        squares[origin] = None
+        squares[captured_location] = None
+        piece.location = location
+        piece.is_moved = True
+        moved = piece
+        if promoted is not None:
+            # The pawn leaves the set but keeps its location, like a
+            # captured piece, so unmake_move knows where it went
+            del piece.set.pieces[piece.piece_name]
+            piece.set.pieces[promoted.piece_name] = promoted
+            moved = promoted
+        squares[location] = moved
+
+        position_hash = (
+            self.hash ^ zobrist_side ^ self.en_passant_key
+            ^ piece.zobrist[origin] ^ moved.zobrist[location]
+        )
+        if captured is not None:
+            position_hash ^= captured.zobrist[captured_location]
+        if rook is not None:
+            squares[rook_origin] = None
+            rook.location = rook_location
+            squares[rook_location] = rook
+            position_hash ^= rook.zobrist[rook_origin] ^ rook.zobrist[rook_location]
+        castling = self.castling & castling_keep[origin] & castling_keep[location]
+        if castling != self.castling:
+            position_hash ^= zobrist_castling[self.castling] ^ zobrist_castling[castling]
+            self.castling = castling
+        self.en_passant = None
+        self.en_passant_key = 0
+        if piece.piece_type == "pawn":
+            self.halfmove = 0
+            if abs(location - origin) == 16:
+                self.en_passant = (origin + location) // 2
+                self.en_passant_key = self.en_passant_key_for(location)
+                position_hash ^= self.en_passant_key
+        elif captured is not None:
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        if piece.color == "black":
+            self.fullmove += 1
+        self.hash = position_hash
+        self.shift_scores(piece, moved, origin, location, captured, captured_location, rook, 1)
+        self.side_to_move = other_color[self.side_to_move]
+
+        for other in affected:
+            if other is not piece and other is not captured:
+                other.attacks = self.attacks_of(other)
+                self.count_attacks(other, 1)
+        moved.attacks = self.attacks_of(moved)
+        self.count_attacks(moved, 1)
+        return captured
+
+    def promoted_piece(self, pawn, piece_type, location):
+        """ A new piece_type for pawn's set, standing on location """
+        piece_set = pawn.set
+        promoted = Piece(
+            pawn.color, piece_type, new_piece_name(piece_set.pieces, piece_type),
+            pawn.is_player, location)
+        promoted.is_moved = True
+        promoted.set = piece_set
+        promoted.opponent_set = pawn.opponent_set
+        return promoted
+
+    def unmake_move(self):
+        """ Take back the last make_move """
+        squares = self.squares
+        piece = self.undo_pieces.pop()
+        location = piece.location
+        origin = self.undo_origins.pop()
+        captured = self.undo_captured.pop()
+        # The piece standing on location: piece itself, or what it became
+        moved = squares[location]
+        changed = (1 << origin) | (1 << location)
+        if captured is not None:
+            changed |= 1 << captured.location
+        rook = None
+        if piece.piece_type == "king" and abs(location - origin) == 2:
+            rook_origin, rook_location = castling_rook_moves[location]
+            rook = squares[rook_location]
+            changed |= (1 << rook_origin) | (1 << rook_location)
+        affected = self.sliders_through(changed)
+        if rook is not None and rook not in affected:
+            affected.append(rook)
+        for other in affected:
+            if other is not moved:
+                self.count_attacks(other, -1)
+        self.count_attacks(moved, -1)
+
+        squares[location] = None
+        piece.location = origin
+        squares[origin] = piece
+        if captured is not None:
+            squares[captured.location] = captured
+        if moved is not piece:
+            del piece.set.pieces[moved.piece_name]
+            piece.set.pieces[piece.piece_name] = piece
+        if rook is not None:
+            squares[rook_location] = None
+            rook.location = rook_origin
+            squares[rook_origin] = rook
+        piece.is_moved = self.undo_was_moved.pop()
+        self.castling = self.undo_castling.pop()
+        self.en_passant = self.undo_en_passant.pop()
+        self.en_passant_key = self.undo_en_passant_key.pop()
+        self.halfmove = self.undo_halfmove.pop()
+        self.hash = self.undo_hash.pop()
+        self.side_to_move = other_color[self.side_to_move]
+        if piece.color == "black":
+            self.fullmove -= 1
+        self.shift_scores(
+            piece, moved, origin, location, captured,
+            captured.location if captured is not None else None, rook, -1)
+
+        for other in affected:
+            if other is not moved:
+                other.attacks = self.attacks_of(other)
+                self.count_attacks(other, 1)
+        piece.attacks = self.attacks_of(piece)
+        self.count_attacks(piece, 1)
+        if captured is not None:
+            # The captured piece's mask was left untouched while it was off
+            # the board, and the occupancy around it is back as it was.
+            captured.set.pieces[captured.piece_name] = captured
+            self.count_attacks(captured, 1)
+
+    def shift_scores(self, piece, moved, origin, location, captured, captured_location, rook, step):
+        """ Apply a move's change to the scores and phase: step 1 to make it,
+        -1 to take it back. moved is what piece became on location. """
+        middlegame = moved.middlegame[location] - piece.middlegame[origin]
+        endgame = moved.endgame[location] - piece.endgame[origin]
+        phase = phase_weights[moved.piece_type] - phase_weights[piece.piece_type]
+        if captured is not None:
+            middlegame -= captured.middlegame[captured_location]
+            endgame -= captured.endgame[captured_location]
+            phase -= phase_weights[captured.piece_type]
+        if rook is not None:
+            rook_origin, rook_location = castling_rook_moves[location]
+            middlegame += rook.middlegame[rook_location] - rook.middlegame[rook_origin]
+            endgame += rook.endgame[rook_location] - rook.endgame[rook_origin]
+        self.middlegame += step * middlegame
+        self.endgame += step * endgame
+        self.phase += step * phase
+
+    def repetitions(self):
+        """ How many times the current position occurred before, looking
+        back only as far as the last capture or pawn move """
+        history = self.undo_hash
+        position_hash = self.hash
+        count = 0
+        for back in range(2, min(self.halfmove, len(history)) + 1, 2):
+            if history[-back] == position_hash:
+                count += 1
+        return count
+
+    def attacks_of(self, piece):
+        """ Bitmask of the squares piece attacks from where it stands,
+        including friendly pieces it defends """
+        location = piece.location
+        piece_type = piece.piece_type
+        if piece_type == "pawn":
+            return pawn_attacks[piece.color][location]
+        if piece_type == "knight":
+            return knight_attacks[location]
+        if piece_type == "king":
+            return king_attacks[location]
+        squares = self.squares
+        mask = 0
+        for squares_out in slider_rays[piece_type][location]:
+            for target in squares_out:
+                mask |= 1 << target
+                if squares[target] is not None:
+                    break
+        return mask
+
+    def count_attacks(self, piece, step):
+        counts = self.attack_counts[piece.color]
+        mask = piece.attacks
+        self.mobility[piece.color] += step * mask.bit_count()
+        while mask:
+            low = mask & -mask
+            counts[low.bit_length() - 1] += step
+            mask ^= low
+
+    def sliders_through(self, mask):
+        """ Sliding pieces whose attack rays reach any square in mask """
+        found = []
+        for piece_set in self.sets:
+            for piece in piece_set.pieces.values():
+                if piece.attacks & mask and piece.piece_type in sliding_directions:
+                    found.append(piece)
+        return found
+
+    def refresh_attacks(self):
+        """ Rebuild every piece's mask and both attack maps from scratch """
+        self.attack_counts = {"white": [0] * 64, "black": [0] * 64}
+        self.mobility = {"white": 0, "black": 0}
+        for piece_set in self.sets:
+            for piece in piece_set.pieces.values():
+                piece.attacks = self.attacks_of(piece)
+                self.count_attacks(piece, 1)
+
+    def en_passant_key_for(self, pawn_location):
+        """ Hash contribution of a double pawn push to pawn_location: the
+        file's key when an enemy pawn could take en passant, otherwise 0 """
+        pawn = self.squares[pawn_location]
+        for side in (RIGHT, LEFT):
+            beside = offset_square(pawn_location, side, 0)
+            if beside is not None:
+                other = self.squares[beside]
+                if (
+                    other is not None
+                    and other.piece_type == "pawn"
+                    and other.color != pawn.color
+                ):
+                    return zobrist_en_passant[pawn_location % 8]
+        return 0
+
+    def compute_hash(self):
+        """ Zobrist hash of the current state, built from scratch """
+        position_hash = zobrist_castling[self.castling] ^ self.en_passant_key
+        if self.side_to_move == "black":
+            position_hash ^= zobrist_side
+        for location, piece in enumerate(self.squares):
+            if piece is not None:
+                position_hash ^= piece.zobrist[location]
+        return position_hash
+
+    def refresh_state(self, side_to_move="white", en_passant=None):
+        """ Derive castling rights from which kings and rooks have moved and
+        rebuild the attack maps and hash from scratch """
+        self.side_to_move = side_to_move
+        self.castling = 0
+        for right, (king_square, rook_square) in castling_squares.items():
+            color = castling_colors[right]
+            king = self.squares[king_square]
+            rook = self.squares[rook_square]
+            if (
+                king is not None and king.piece_type == "king"
+                and king.color == color and not king.is_moved
+                and rook is not None and rook.piece_type == "rook"
+                and rook.color == color and not rook.is_moved
+            ):
+                self.castling |= right
+        self.en_passant = en_passant
+        self.en_passant_key = 0
+        if en_passant is not None:
+            pawn_location = en_passant - 8 if side_to_move == "black" else en_passant + 8
+            self.en_passant_key = self.en_passant_key_for(pawn_location)
+        self.refresh_attacks()
+        self.hash = self.compute_hash()
+        self.refresh_scores()
+
+    def refresh_scores(self):
+        """ Rebuild the scores and phase from scratch """
+        self.middlegame = 0
+        self.endgame = 0
+        self.phase = 0
+        for location, piece in enumerate(self.squares):
+            if piece is not None:
+                self.middlegame += piece.middlegame[location]
+                self.endgame += piece.endgame[location]
+                self.phase += phase_weights[piece.piece_type]
+
+    def position_key(self, color):
+        """ Key identifying the position with color to move """
+        if color == self.side_to_move:
+            return self.hash
+        return self.hash ^ zobrist_side
+
+    def attack_map(self, color):
+        """ Per-square count of color's attackers; do not modify """
+        return self.attack_counts[color]
+
+    def is_attacked(self, square, color):
+        return self.attack_counts[color][square] > 0
+
+
+def is_square_attacked(board, square, color):
+    """ Whether color attacks square, found by looking outwards from square
+    instead of through the attack map """
+    squares = board.squares
+    for source in knight_targets[square]:
+        piece = squares[source]
+        if piece is not None and piece.color == color and piece.piece_type == "knight":
+            return True
+    # A pawn of color attacks square from where a pawn of the other color on
+    # square would capture
+    for source in pawn_capture_targets[other_color[color]][square]:
+        piece = squares[source]
+        if piece is not None and piece.color == color and piece.piece_type == "pawn":
+            return True
+    for directions, slider in ((diagonals, "bishop"), (lines, "rook")):
+        for direction in directions:
+            for distance, source in enumerate(rays[direction][square], 1):
+                piece = squares[source]
+                if piece is not None:
+                    if piece.color == color and (
+                        piece.piece_type == slider
+                        or piece.piece_type == "queen"
+                        or (piece.piece_type == "king" and distance == 1)
+                    ):
+                        return True
+                    break
+    return False
+
+
+class Set:
+
+    """ Class for piece set. Can be black or white. """
+
+    def __init__(self, color, is_player, pieces=None):
+        self.is_player = is_player
+        self.color = color
+        self.board = None
+        self.opponent = None
+        if pieces is None:
+            pieces = self.generate_pieces(self.color)
+        self.pieces = pieces
+
+    def generate_pieces(self, color):
+        pieces = {}
+        for i in range(8):
+            name = "pawn" + str(i)
+            pieces[name] = Piece(color, "pawn", name, self.is_player)
+        for i in range(2):
+            pieces["bishop" + str(i)] = Piece(
+                color, "bishop", "bishop" + str(i), self.is_player
+            )
+            pieces["knight" + str(i)] = Piece(
+                color, "knight", "knight" + str(i), self.is_player
+            )
+            pieces["rook" + str(i)] = Piece(
+                color, "rook", "rook" + str(i), self.is_player
+            )
+        pieces["queen"] = Piece(color, "queen", "queen", self.is_player)
+        pieces["king"] = Piece(color, "king", "king", self.is_player)
+        return pieces
+
+
+class Piece:
+
+    """ Class for chess pieces. """
+
+    __slots__ = (
+        "is_player",
+        "is_moved",
+        "color",
+        "set",
+        "opponent_set",
+        "piece_type",
+        "piece_name",
+        "location",
+        "attacks",
+        "zobrist",
+        "middlegame",
+        "endgame",
+    )
+
+    def __init__(self, color, piece_type, piece_name, is_player, location=None):
+        self.is_player = is_player
+        self.is_moved = False
+        self.color = color
+        self.set = None
+        self.opponent_set = None
+        self.piece_type = piece_type
+        self.piece_name = piece_name
+        if location is None:
+            location = self.start_location(self.piece_name)
+        self.location = location
+        self.attacks = 0
+        self.zobrist = zobrist_pieces[color][piece_type]
+        self.middlegame = middlegame_scores[color][piece_type]
+        self.endgame = endgame_scores[color][piece_type]
+
+    def start_location(self, piece_name):
+        if self.is_player:
+            return first_person_locations[piece_name]
+        else:
+            return second_person_locations[piece_name]
+
+    def possible_moves(self, first_location, is_moving, threatened_set):
+        moves = []
+        capture_moves = []
+        squares = self.set.board.squares
+
+        # # Movement
+
+        # Moves for pawns
+        if self.piece_type == "pawn":
+            forward = pawn_forward(self.color)
+            first_pawn_move = offset_square(first_location, 0, forward)
+            if first_pawn_move is not None and squares[first_pawn_move] is None:
+                moves.append(first_pawn_move)
+                if not self.is_moved:
+                    second_pawn_move = offset_square(first_pawn_move, 0, forward)
+                    if second_pawn_move is not None and squares[second_pawn_move] is None:
+                        moves.append(second_pawn_move)
+
+            # En passant only for the side to move, right after the push
+            en_passant = self.set.board.en_passant
+            for target in pawn_capture_targets[self.color][first_location]:
+                if self.is_capture(target, self.set, threatened_set) or (
+                    target == en_passant and self.color == self.set.board.side_to_move
+                ):
+                    capture_moves.append(target)
+
+        # Moves for knights and kings: fixed jumps from the tables
+        elif self.piece_type == "knight" or self.piece_type == "king":
+            if self.piece_type == "knight":
+                targets = knight_targets[first_location]
+            else:
+                targets = king_targets[first_location]
+            for target in targets:
+                occupant = squares[target]
+                if occupant is None:
+                    moves.append(target)
+                elif occupant.color == threatened_set.color:
+                    capture_moves.append(target)
+            if self.piece_type == "king" and self.set.board.castling:
+                moves.extend(castling_targets(self.set))
+
+        # Moves for bishops, rooks and queens: walk each ray to a blocker
+        else:
+            for squares_out in slider_rays[self.piece_type][first_location]:
+                for target in squares_out:
+                    occupant = squares[target]
+                    if occupant is None:
+                        moves.append(target)
+                        continue
+                    if occupant.color == threatened_set.color:
+                        capture_moves.append(target)
+                    break
+
+        # Eliminate moves that leave the king in check
+        if is_moving:
+            if self.piece_type == "king":
+                moves = [move for move in moves if not self.will_there_be_check(move)]
+            else:
+                check_mask, pins = pins_and_checks(self.set)
+                allowed = check_mask & pins.get(self, ALL_SQUARES)
+                moves = [move for move in moves if allowed >> move & 1]
+
+        return moves, capture_moves
+
+    def is_capture(self, mv, threatening_set, threatened_set):
+        occupant = self.set.board.squares[mv]
+        return occupant is not None and occupant.color == threatened_set.color
+
+    def is_obstructed(self, mv):
+        return self.set.board.squares[mv] is not None
+
+    def will_there_be_check(self, mv):
+        return not is_legal_move(self, mv)
+
+
+class MoveTable:
+
+    """ Legal moves, legal captures and check status for the side to move in
+    one position. Targets are keyed by the square the moving piece stands
+    on: the table is cached by position, and the same position can be
+    reached with two same-type pieces swapped, so piece names or identities
+    would not carry over. """
+
+    __slots__ = ("moves", "captures", "in_check")
+
+    def __init__(self, moves, captures, in_check):
+        self.moves = moves
+        self.captures = captures
+        self.in_check = in_check
+
+    def count(self):
+        total = 0
+        for targets in self.moves.values():
+            total += len(targets)
+        for targets in self.captures.values():
+            total += len(targets)
+        return total
+
+
+def pins_and_checks(piece_set):
+    """ (check mask, pins) for piece_set to move, found by looking outwards
+    from its king once. A piece other than the king must move onto the
+    check mask: every square when not in check, the checker and the squares
+    between it and the king in check, none in double check. pins maps each
+    pinned piece to the squares it may still move to along its pin. """
+    board = piece_set.board
+    squares = board.squares
+    color = piece_set.color
+    king_square = piece_set.pieces["king"].location
+    check_mask = ALL_SQUARES
+    checkers = 0
+    if board.attack_counts[other_color[color]][king_square]:
+        check_mask = 0
+        for sources, piece_type in (
+            (knight_targets[king_square], "knight"),
+            (pawn_capture_targets[color][king_square], "pawn"),
+        ):
+            for source in sources:
+                piece = squares[source]
+                if piece is not None and piece.color != color and piece.piece_type == piece_type:
+                    check_mask |= 1 << source
+                    checkers += 1
+    pins = {}
+    for directions, slider in ((diagonals, "bishop"), (lines, "rook")):
+        for direction in directions:
+            mask = 0
+            pinned = None
+            for source in rays[direction][king_square]:
+                mask |= 1 << source
+                piece = squares[source]
+                if piece is None:
+                    continue
+                if piece.color == color:
+                    if pinned is not None:
+                        break
+                    pinned = piece
+                    continue
+                if piece.piece_type == slider or piece.piece_type == "queen":
+                    if pinned is None:
+                        check_mask |= mask
+                        checkers += 1
+                    else:
+                        pins[pinned] = mask
+                break
+    if checkers > 1:
+        check_mask = 0
+    return check_mask, pins
+
+
+def legal_targets(piece, check_mask, pins):
+    """ Legal (moves, captures) of piece, given pins_and_checks of its set.
+    Other pieces are filtered through the masks; only king moves and en
+    passant, which can uncover a check the masks do not see, are tried on
+    the board. """
+    mvs, captures = piece.possible_moves(piece.location, False, piece.opponent_set)
+    if piece.piece_type == "king":
+        return (
+            [target for target in mvs if not piece.will_there_be_check(target)],
+            [target for target in captures if not piece.will_there_be_check(target)],
+        )
+    allowed = check_mask & pins.get(piece, ALL_SQUARES)
+    moves = [target for target in mvs if allowed >> target & 1]
+    en_passant = piece.set.board.en_passant
+    if piece.piece_type == "pawn" and en_passant in captures:
+        captures = [
+            target for target in captures
+            if (not piece.will_there_be_check(target) if target == en_passant
+                else allowed >> target & 1)
+        ]
+    else:
+        captures = [target for target in captures if allowed >> target & 1]
+    return moves, captures
+
+
+def legal_moves(piece_set):
+    """ Moves piece_set may legally play, without caching: (piece, target)
+    pairs, or (piece, target, piece type) for each promotion choice """
+    check_mask, pins = pins_and_checks(piece_set)
+    moves = []
+    for piece in list(piece_set.pieces.values()):
+        mvs, captures = legal_targets(piece, check_mask, pins)
+        if piece.piece_type == "pawn":
+            for target in mvs + captures:
+                if target < 8 or target >= 56:
+                    for piece_type in promotion_types:
+                        moves.append((piece, target, piece_type))
+                else:
+                    moves.append((piece, target))
+        else:
+            for target in mvs + captures:
+                moves.append((piece, target))
+    return moves
+
+
+def has_legal_move(piece_set):
+    """ Whether piece_set has any legal move, stopping at the first piece
+    that has one """
+    board = piece_set.board
+    table = board.move_tables.get(board.position_key(piece_set.color))
+    if table is not None:
+        return table.count() > 0
+    check_mask, pins = pins_and_checks(piece_set)
+    for piece in list(piece_set.pieces.values()):
+        mvs, captures = legal_targets(piece, check_mask, pins)
+        if mvs or captures:
+            return True
+    return False
+
+
+def legal_move_table(piece_set):
+    """ MoveTable for piece_set to move, computed once per position and then
+    served from the board's cache """
+    board = piece_set.board
+    key = board.position_key(piece_set.color)
+    table = board.move_tables.get(key)
+    if table is not None:
+        return table
+
+    check_mask, pins = pins_and_checks(piece_set)
+    moves = {}
+    captures = {}
+    for piece in list(piece_set.pieces.values()):
+        moves[piece.location], captures[piece.location] = legal_targets(piece, check_mask, pins)
+    table = MoveTable(moves, captures, is_there_a_check(piece_set, piece_set.opponent))
+
+    if len(board.move_tables) >= board.move_table_limit:
+        board.move_tables.clear()
+    board.move_tables[key] = table
+    return table
+
+
+def is_legal_move(piece, location):
+    """ Whether moving piece to location, one of its possible moves or
+    captures, leaves its own king out of check """
+    board = piece.set.board
+    board.make_move(piece, location)
+    check = is_there_a_check(piece.set, piece.opponent_set)
+    board.unmake_move()
+    return not check
+
+
+def can_capture(capturing_piece, captured_set, location):
+    return is_legal_move(capturing_piece, location)
+
+
+def capture_at_location(capturing_piece, captured_set, location):
+    board = captured_set.board
+    piece = board.squares[location]
+    if piece is not None and piece.set is captured_set:
+        captured_set.pieces.pop(piece.piece_name)
+        board.lift(piece)
+        board.refresh_state(board.side_to_move, board.en_passant)
+        return piece
+    return None
+
+
+def move_piece(piece, location, promotion=None):
+    """ Play a move for piece, capturing whatever stands on location. The
+    move stays on the board's undo stack, so it can be taken back. """
+    return piece.set.board.make_move(piece, location, promotion)
+
+
+def is_there_a_check(threatened_set, threatening_set):
+    king_location = threatened_set.pieces["king"].location
+    return threatening_set.board.attack_counts[threatening_set.color][king_location] > 0
+
+
+def link_sets(first_set, second_set, board, side_to_move="white", en_passant=None):
+    """ Put both sets on board and point every piece at its own and the
+    opposing set """
+    for piece_set, opponent in ((first_set, second_set), (second_set, first_set)):
+        piece_set.board = board
+        piece_set.opponent = opponent
+        for name, piece in piece_set.pieces.items():
+            piece.set = piece_set
+            piece.opponent_set = opponent
+            board.place(piece, piece.location)
+    board.sets = (first_set, second_set)
+    board.refresh_state(side_to_move, en_passant)
+
+
+def copy_set(piece_set):
+    """ Copy piece_set and its opponent onto a fresh board. The opponent's
+    copy is reachable as the returned set's opponent. """
+    copies = []
+    for original in (piece_set, piece_set.opponent):
+        pieces = {}
+        for name, piece in original.pieces.items():
+            piece_copy = Piece(
+                piece.color, piece.piece_type, name, piece.is_player, piece.location)
+            piece_copy.is_moved = piece.is_moved
+            pieces[name] = piece_copy
+        copies.append(Set(original.color, original.is_player, pieces))
+    board = piece_set.board
+    copy_board = Board()
+    link_sets(copies[0], copies[1], copy_board, board.side_to_move, board.en_passant)
+    copy_board.halfmove = board.halfmove
+    copy_board.fullmove = board.fullmove
+    return copies[0]
+
+
+def can_castle(piece_set, right):
+    """ Whether piece_set may castle with right now: the right is still
+    held, the squares between king and rook are empty and the king is not in
+    check and crosses no attacked square. Landing in check is left to the
+    usual legality test. """
+    board = piece_set.board
+    if not board.castling & right or castling_colors[right] != piece_set.color:
+        return False
+    king_target, empty, path = castling_paths[right]
+    squares = board.squares
+    for square in empty:
+        if squares[square] is not None:
+            return False
+    attacks = board.attack_counts[piece_set.opponent.color]
+    for square in path:
+        if attacks[square]:
+            return False
+    return True
+
+
+def castling_targets(piece_set):
+    """ Squares piece_set's king may castle to """
+    return [
+        castling_paths[right][0] for right in castling_paths if can_castle(piece_set, right)
+    ]
+
+
+def insufficient_material(board):
+    """ Whether neither side can mate: bare kings, or one knight or bishop
+    beside them """
+    minors = 0
+    for piece_set in board.sets:
+        for piece in piece_set.pieces.values():
+            if piece.piece_type in ("pawn", "rook", "queen"):
+                return False
+            if piece.piece_type != "king":
+                minors += 1
+    return minors <= 1
+
+
+def game_result(piece_set):
+    """ (result, reason) when the game is over with piece_set to move,
+    otherwise None. result is "1-0", "0-1" or "1/2-1/2"; reason one of
+    "checkmate", "stalemate", "fifty-move rule", "threefold repetition" and
+    "insufficient material". """
+    board = piece_set.board
+    if not has_legal_move(piece_set):
+        if is_there_a_check(piece_set, piece_set.opponent):
+            return ("0-1" if piece_set.color == "white" else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if board.halfmove >= 100:
+        return "1/2-1/2", "fifty-move rule"
+    if board.repetitions() >= 2:
+        return "1/2-1/2", "threefold repetition"
+    if insufficient_material(board):
+        return "1/2-1/2", "insufficient material"
+    return None
+
+
+# Material values used by increase_point_total, for scoring whole positions
+piece_values = {
+    "pawn": 1,
+    "knight": 3,
+    "bishop": 3,
+    "rook": 5,
+    "queen": 9,
+    "king": 0,
+}
+
+
+def encode_move(origin, target, promotion=None):
+    """ Pack a move into an int: origin in bits 0-5, target in bits 6-11
+    and a promotion, as 1 + its index in promotion_types, in bits 12-14 """
+    if promotion is None:
+        return origin | target << 6
+    return origin | target << 6 | (promotion_types.index(promotion) + 1) << 12
+
+
+def decode_move(move):
+    """ (origin, target, promotion or None) of a move packed by encode_move """
+    promotion = move >> 12 & 7
+    return move & 63, (move >> 6) & 63, promotion_types[promotion - 1] if promotion else None
+
+
+def move_name(move):
+    """ Coordinate notation for a move as generated, e.g. "e2e4" or
+    "e7e8q", and "none" for no move """
+    if move is None:
+        return "none"
+    name = square_name(move[0].location) + square_name(move[1])
+    if len(move) > 2:
+        name += piece_letters[move[2]]
+    return name
+
+
+def increase_point_total(captured_piece, points_to_increase):
+    if captured_piece.piece_type == "queen":
+        points_to_increase += 9
+    elif captured_piece.piece_type == "rook":
+        points_to_increase += 5
+    elif captured_piece.piece_type == "pawn":
+        points_to_increase += 1
+    else:
+        points_to_increase += 3
+    return points_to_increase
+
+
+def new_piece_name(pieces, piece_type):
+    """ First name for another piece_type not already taken in pieces,
+    following the pawn0..pawn7 / knight0, knight1 / queen, king scheme """
+    if piece_type not in pieces and piece_type in ("king", "queen"):
+        return piece_type
+    index = 0
+    if piece_type == "queen":
+        index = 1
+    while piece_type + str(index) in pieces:
+        index += 1
+    return piece_type + str(index)
+
+
+def new_game():
+    """ Create both sets in their starting positions, linked to each other """
+    white_pieces = Set("white", True)
+    black_pieces = Set("black", False)
+    link_sets(white_pieces, black_pieces, Board())
+    return white_pieces, black_pieces
@@ -0,0 +1,281 @@
+""" Self-play soak test and throughput benchmark: whole games of random or
+engine moves played through the headless rules core in worker processes.
+
+Every game is checked as it is played unless --no-check is given: the
+incremental hash, attack maps and evaluation terms against a position
+rebuilt from FEN, game_result against the legal move list, SAN written and
+read back to the same move, and finally every move taken back to the
+starting position.
+Results can be written as PGN or as binary game records, gzip-compressed
+when the path ends in .gz. """
+import argparse
+import gzip
+import multiprocessing
+import os
+import random
+import resource
+import struct
+import sys
+import time
+
+from engine import Engine
+from fen import RECORD_SIZE, START_FEN, board_to_fen, decode_position, encode_position, parse_fen
+from pgn import format_game, parse_san, san_name
+from rules import decode_move, encode_move, game_result, legal_moves
+
+PLAYERS = ("random", "engine")
+# Result codes in game records
+RECORD_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+RECORD_REASONS = (
+    None, "checkmate", "stalemate", "fifty-move rule", "threefold repetition",
+    "insufficient material", "ply limit",
+)
+# Game record header: result code, reason code, plies; followed by the
+# starting position record and one little-endian uint16 per move
+RECORD_HEADER = struct.Struct("<BBH")
+ENGINE_TABLE_MB = 4
+
+
+class Settings:
+
+    """ How the games of one run are played """
+
+    __slots__ = ("white", "black", "depth", "nodes", "random_plies", "max_plies", "check",
+                 "names")
+
+    def __init__(
+        self, white="random", black="random", depth=2, nodes=None, random_plies=4,
+        max_plies=1000, check=True, names=False,
+    ):
+        self.white = white
+        self.black = black
+        self.depth = depth
+        self.nodes = nodes
+        self.random_plies = random_plies
+        self.max_plies = max_plies
+        self.check = check
+        # Whether games come back with SAN, needed only for PGN output
+        self.names = names
+
+
+class Played:
+
+    """ One finished game as sent back from a worker """
+
+    __slots__ = ("index", "start", "moves", "sans", "result", "reason", "problems",
+                 "elapsed", "worker", "maxrss_kb")
+
+    def __init__(self, index, start, moves, sans, result, reason, problems, elapsed):
+        self.index = index
+        self.start = start
+        self.moves = moves
+        self.sans = sans
+        self.result = result
+        self.reason = reason
+        self.problems = problems
+        self.elapsed = elapsed
+        self.worker = os.getpid()
+        self.maxrss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# One engine per worker process, so the table is allocated once
+_engine = None
+
+
+def worker_engine():
+    global _engine
+    if _engine is None:
+        _engine = Engine(ENGINE_TABLE_MB)
+    return _engine
+
+
+def choose_move(piece_set, moves, player, settings, rng, ply):
+    if player == "random" or ply < settings.random_plies:
+        return rng.choice(moves)
+    result = worker_engine().search(piece_set, settings.depth, None, settings.nodes)
+    return result.move
+
+
+def check_position(piece_set, ply, problems):
+    """ Compare the incrementally kept state with a fresh rebuild """
+    board = piece_set.board
+    if board.hash != board.compute_hash():
+        problems.append(f"ply {ply}: hash drifted from the position")
+    rebuilt = parse_fen(board_to_fen(piece_set)).board
+    if rebuilt.hash != board.hash:
+        problems.append(f"ply {ply}: hash differs from the FEN rebuild")
+    if rebuilt.attack_counts != board.attack_counts or rebuilt.mobility != board.mobility:
+        problems.append(f"ply {ply}: attack maps differ from the FEN rebuild")
+    scores = (board.middlegame, board.endgame, board.phase)
+    if scores != (rebuilt.middlegame, rebuilt.endgame, rebuilt.phase):
+        problems.append(f"ply {ply}: evaluation terms differ from the FEN rebuild")
+
+
+def play_game(job):
+    """ Worker: play game index from seed and return a Played """
+    index, seed, start_fen, settings = job
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    piece_set = parse_fen(start_fen)
+    board = piece_set.board
+    start_hash = board.hash
+    start_position = board_to_fen(piece_set)
+    moves = []
+    sans = []
+    problems = []
+    result, reason = "*", "ply limit"
+
+    for ply in range(settings.max_plies + 1):
+        if settings.check:
+            check_position(piece_set, ply, problems)
+        outcome = game_result(piece_set)
+        legal = legal_moves(piece_set)
+        if settings.check:
+            no_moves = outcome is not None and outcome[1] in ("checkmate", "stalemate")
+            if no_moves != (not legal):
+                problems.append(f"ply {ply}: {outcome} with {len(legal)} legal moves")
+        if outcome is not None:
+            result, reason = outcome
+            break
+        if ply == settings.max_plies:
+            break
+        player = settings.white if piece_set.color == "white" else settings.black
+        move = choose_move(piece_set, legal, player, settings, rng, ply)
+        if settings.check or settings.names:
+            san = san_name(piece_set, move)
+            sans.append(san)
+            if settings.check:
+                try:
+                    read_back = parse_san(piece_set, san)
+                except ValueError as error:
+                    read_back = error
+                if read_back != move:
+                    problems.append(f"ply {ply}: {san} reads back as {read_back}")
+        moves.append(encode_move(move[0].location, *move[1:]))
+        board.make_move(*move)
+        piece_set = piece_set.opponent
+
+    if settings.check:
+        final_fen = board_to_fen(piece_set)
+        for ply in range(len(moves)):
+            board.unmake_move()
+        piece_set = board.sets[0] if board.side_to_move == board.sets[0].color else board.sets[1]
+        if board.hash != start_hash or board_to_fen(piece_set) != start_position:
+            problems.append(
+                f"taking back {len(moves)} moves from {final_fen} did not restore the start")
+
+    return Played(index, start_fen, moves, sans if settings.names else None, result, reason,
+                  problems, time.perf_counter() - start)
+
+
+def play_games(count, settings, workers=None, seed=0, start_fen=START_FEN):
+    """ Play count games on a pool of worker processes and yield a Played
+    for each as it finishes, in completion order """
+    workers = workers or os.cpu_count() or 1
+    jobs = ((index, seed * 1000003 + index, start_fen, settings) for index in range(count))
+    with multiprocessing.Pool(workers) as pool:
+        for played in pool.imap_unordered(play_game, jobs):
+            yield played
+
+
+def encode_record(played):
+    """ Binary record for a played game """
+    header = RECORD_HEADER.pack(
+        RECORD_RESULTS.index(played.result), RECORD_REASONS.index(played.reason),
+        len(played.moves))
+    start = encode_position(parse_fen(played.start))
+    return header + start + struct.pack(f"<{len(played.moves)}H", *played.moves)
+
+
+def read_records(stream):
+    """ Yield (starting set, moves as (origin, target, promotion), result,
+    reason) for each record in a binary stream """
+    while True:
+        header = stream.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        result, reason, plies = RECORD_HEADER.unpack(header)
+        start = decode_position(stream.read(RECORD_SIZE))
+        moves = struct.unpack(f"<{plies}H", stream.read(2 * plies))
+        yield (start, [decode_move(move) for move in moves],
+               RECORD_RESULTS[result], RECORD_REASONS[reason])
+
+
+def open_output(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--white", choices=PLAYERS, default="random")
+    parser.add_argument("--black", choices=PLAYERS, default="random")
+    parser.add_argument("--depth", type=int, default=2, help="engine search depth")
+    parser.add_argument("--nodes", type=int, default=None, help="engine nodes per move")
+    parser.add_argument(
+        "--random-plies", type=int, default=4,
+        help="random opening plies before engines take over, so games differ")
+    parser.add_argument("--max-plies", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fen", default=START_FEN, help="starting position")
+    parser.add_argument("--no-check", action="store_true",
+                        help="skip the consistency checks, for raw throughput")
+    parser.add_argument("--pgn", metavar="PATH", help="write the games as PGN (.gz to compress)")
+    parser.add_argument("--records", metavar="PATH",
+                        help="write the games as binary records (.gz to compress)")
+    args = parser.parse_args(argv)
+
+    settings = Settings(
+        args.white, args.black, args.depth, args.nodes, args.random_plies, args.max_plies,
+        not args.no_check, args.pgn is not None)
+    pgn_stream = open_output(args.pgn, "wt") if args.pgn else None
+    record_stream = open_output(args.records, "wb") if args.records else None
+
+    games = plies = 0
+    reasons = {}
+    problems = []
+    workers = {}
+    start = time.perf_counter()
+    try:
+        for played in play_games(args.games, settings, args.workers, args.seed, args.fen):
+            games += 1
+            plies += len(played.moves)
+            reasons[played.reason] = reasons.get(played.reason, 0) + 1
+            workers[played.worker] = max(workers.get(played.worker, 0), played.maxrss_kb)
+            for problem in played.problems:
+                problems.append(f"game {played.index}: {problem}")
+            if pgn_stream is not None:
+                headers = {
+                    "Event": "selfplay", "Site": "?", "Date": "????.??.??",
+                    "Round": played.index + 1, "White": args.white, "Black": args.black,
+                }
+                if played.start != START_FEN:
+                    headers.update(SetUp="1", FEN=played.start)
+                pgn_stream.write(format_game(headers, played.sans, played.result))
+            if record_stream is not None:
+                record_stream.write(encode_record(played))
+    finally:
+        for stream in (pgn_stream, record_stream):
+            if stream is not None:
+                stream.close()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{games} games, {plies} plies in {elapsed:.2f} s: "
+        f"{games / max(elapsed, 1e-9):.2f} games/s, {plies / max(elapsed, 1e-9):.0f} plies/s"
+    )
+    print("endings: " + ", ".join(
+        f"{reason} {count}" for reason, count in sorted(reasons.items(), key=lambda item: -item[1])))
+    print("worker maxrss: " + ", ".join(
+        f"{maxrss_kb / 1024:.0f} MB" for pid, maxrss_kb in sorted(workers.items())))
+    print(f"{len(problems)} inconsistencies")
+    for problem in problems[:20]:
+        print("  " + problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+""" Asyncio server hosting many independent games over a JSON-lines protocol,
+and a load-test client for it.
+
+Every request is one JSON object per line and gets one JSON object back:
+
+    {"id": 1, "op": "new"}                          -> {"id": 1, "ok": true, "game": "1", ...}
+    {"id": 2, "op": "new", "fen": "..."}
+    {"id": 3, "op": "moves", "game": "1"}           -> {"ok": true, "moves": ["e2e4", ...], ...}
+    {"id": 4, "op": "move", "game": "1", "move": "e2e4"}
+    {"id": 5, "op": "undo", "game": "1"}
+    {"id": 6, "op": "state", "game": "1"}
+    {"id": 7, "op": "close", "game": "1"}
+    {"id": 8, "op": "hint", "game": "1"}            -> {"ok": true, "move": "e2e4", "score": 0, ...}
+    {"id": 9, "op": "stats"}
+
+Failures answer {"ok": false, "error": "..."}. Games are shared by every
+connection and live until closed. Hints come from the opening book or the
+endgame tables when the server has them and they cover the position (depth
+0), otherwise from a shallow search capped by nodes and time. Searches run in
+a worker process so a hint never holds up the other connections. """
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from engine import open_lookups, search_fen, start_worker
+from fen import FenError, START_FEN
+from game import GameState
+from pgn import IllegalMoveError
+
+DEFAULT_PORT = 8765
+# Positions whose move tables each hosted game keeps
+GAME_MOVE_TABLES = 16
+# Search budget for hints the book and endgame tables cannot answer
+HINT_DEPTH = 3
+HINT_NODES = 5000
+HINT_SECONDS = 0.5
+HINT_TABLE_MB = 4
+HINT_WORKERS = 1
+
+
+def text_field(request, name, required=False):
+    """ request[name] as a string, None when absent and not required """
+    value = request.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value
+
+
+def internal_error(error):
+    return {"ok": False, "error": f"internal error: {type(error).__name__}: {error}"}
+
+
+class GameServer:
+
+    """ Games by id, and the handlers for each protocol operation """
+
+    def __init__(
+        self, max_games=100000, book_path=None, endgame_directory=None,
+        hint_workers=HINT_WORKERS,
+    ):
+        self.games = {}
+        self.lookup_paths = (book_path, endgame_directory)
+        self.hint_workers = hint_workers
+        # Started by the first hint request
+        self.hint_pool = None
+        self.max_games = max_games
+        self.next_id = 1
+        self.requests = 0
+        self.moves = 0
+        self.started = time.perf_counter()
+
+    def game(self, request):
+        game_id = request.get("game")
+        if not isinstance(game_id, (str, int)) or isinstance(game_id, bool):
+            raise ValueError("game must be a game id")
+        game = self.games.get(str(game_id))
+        if game is None:
+            raise KeyError(f"no game {request.get('game')!r}")
+        return game
+
+    def describe(self, game_id, game):
+        return {
+            "game": game_id,
+            "fen": game.fen(),
+            "to_move": game.side_to_move,
+            "in_check": game.in_check(),
+            "result": game.result,
+            "reason": game.reason,
+        }
+
+    def op_new(self, request):
+        if len(self.games) >= self.max_games:
+            raise ValueError(f"server is full ({self.max_games} games)")
+        game = GameState(text_field(request, "fen") or START_FEN, GAME_MOVE_TABLES)
+        game_id = str(self.next_id)
+        self.next_id += 1
+        self.games[game_id] = game
+        return self.describe(game_id, game)
+
+    def op_moves(self, request):
+        game = self.game(request)
+        # A game drawn by rule still has legal moves, but none may be played
+        moves = list(game.legal_move_names()) if game.result is None else []
+        return {
+            "moves": moves,
+            "in_check": game.in_check(),
+            "result": game.result,
+            "reason": game.reason,
+        }
+
+    def op_move(self, request):
+        game = self.game(request)
+        game.play(text_field(request, "move", required=True))
+        self.moves += 1
+        return self.describe(str(request["game"]), game)
+
+    def op_undo(self, request):
+        game = self.game(request)
+        game.undo()
+        return self.describe(str(request["game"]), game)
+
+    def op_state(self, request):
+        return self.describe(str(request["game"]), self.game(request))
+
+    async def op_hint(self, request):
+        game = self.game(request)
+        if game.result is not None:
+            raise ValueError(f"the game is over ({game.result})")
+        if self.hint_pool is None:
+            self.hint_pool = concurrent.futures.ProcessPoolExecutor(
+                self.hint_workers, initializer=start_worker,
+                initargs=(HINT_TABLE_MB, *self.lookup_paths))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.hint_pool, search_fen, game.fen(), HINT_DEPTH, HINT_SECONDS, HINT_NODES)
+
+    def op_close(self, request):
+        self.game(request)
+        del self.games[str(request["game"])]
+        return {}
+
+    def op_stats(self, request):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "games": len(self.games),
+            "requests": self.requests,
+            "moves": self.moves,
+            "uptime": round(elapsed, 3),
+            "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    async def handle(self, line):
+        """ Answer one request line with one response object """
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+        except ValueError as error:
+            return {"ok": False, "error": f"bad request: {error}"}
+        handler = getattr(self, "op_" + str(request.get("op")), None)
+        if handler is None:
+            response = {"ok": False, "error": f"unknown op {request.get('op')!r}"}
+        else:
+            try:
+                response = handler(request)
+                if asyncio.iscoroutine(response):
+                    response = await response
+                response["ok"] = True
+            except (KeyError, ValueError, FenError, IllegalMoveError) as error:
+                message = error.args[0] if error.args else str(error)
+                response = {"ok": False, "error": str(message)}
+            except Exception as error:
+                # A bug behind one request must not take the connection or
+                # the server down with it
+                response = internal_error(error)
+        if "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    response = await self.handle(line)
+                except Exception as error:
+                    response = internal_error(error)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionResetError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.hint_pool is not None:
+            self.hint_pool.shutdown(cancel_futures=True)
+            self.hint_pool = None
+
+
+async def serve(
+    host="127.0.0.1", port=DEFAULT_PORT, unix_path=None, max_games=100000,
+    book_path=None, endgame_directory=None,
+):
+    # Hint workers open these for themselves; opening them here first makes a
+    # bad path fail at startup rather than on the first hint
+    open_lookups(book_path, endgame_directory)
+    game_server = GameServer(max_games, book_path, endgame_directory)
+    if unix_path:
+        server = await asyncio.start_unix_server(game_server.serve_connection, unix_path)
+        where = unix_path
+    else:
+        server = await asyncio.start_server(game_server.serve_connection, host, port)
+        where = "%s:%d" % server.sockets[0].getsockname()[:2]
+    print(f"listening on {where}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.close()
+
+
+class Client:
+
+    """ One connection speaking the protocol, one request at a time """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 1
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        if unix_path:
+            reader, writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, op, **fields):
+        fields["op"] = op
+        fields["id"] = self.next_id
+        self.next_id += 1
+        self.writer.write(json.dumps(fields).encode() + b"\n")
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        return json.loads(line)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def play_games(client, games, plies, seed, latencies):
+    """ Open games on one connection and play random legal moves in all of
+    them in turn, timing every move request. Games that end are retired.
+    Returns the moves played. """
+    choose = random.Random(seed).choice
+    opened = []
+    for _ in range(games):
+        response = await client.request("new")
+        opened.append(response["game"])
+    game_ids = list(opened)
+    played = 0
+    clock = time.perf_counter
+    for _ in range(plies):
+        for game_id in list(game_ids):
+            moves = (await client.request("moves", game=game_id))["moves"]
+            if not moves:
+                game_ids.remove(game_id)
+                continue
+            start = clock()
+            response = await client.request("move", game=game_id, move=choose(moves))
+            latencies.append(clock() - start)
+            if not response["ok"]:
+                raise RuntimeError(response["error"])
+            played += 1
+            if response["result"] is not None:
+                game_ids.remove(game_id)
+    for game_id in opened:
+        await client.request("close", game=game_id)
+    return played
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def load_test(
+    games=1000, plies=20, connections=50, seed=0,
+    host="127.0.0.1", port=DEFAULT_PORT, unix_path=None,
+):
+    """ Play plies moves in each of games games spread over connections
+    clients. Returns moves per second and latency percentiles in ms. """
+    clients = [await Client.connect(host, port, unix_path) for _ in range(connections)]
+    per_client = [games // connections + (index < games % connections) for index in range(connections)]
+    latencies = []
+    start = time.perf_counter()
+    counts = await asyncio.gather(*(
+        play_games(client, count, plies, seed + index, latencies)
+        for index, (client, count) in enumerate(zip(clients, per_client))
+    ))
+    elapsed = time.perf_counter() - start
+    stats = await clients[0].request("stats")
+    for client in clients:
+        await client.close()
+    moves = sum(counts)
+    return {
+        "games": games,
+        "moves": moves,
+        "seconds": elapsed,
+        "moves_per_second": moves / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else 0.0,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+        "server_requests": stats.get("requests"),
+        "server_maxrss_kb": stats.get("maxrss_kb"),
+    }
+
+
+def start_server_process(max_games):
+    """ Run a server on a free local port in a child process; returns the
+    process and the port it listens on """
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--port", "0",
+         "--max-games", str(max_games)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    line = process.stdout.readline()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise RuntimeError("server did not start")
+    return process, int(line.rsplit(":", 1)[1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-game chess server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="host games on a local socket")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--unix", metavar="PATH", help="listen on a unix socket instead")
+    serve_parser.add_argument("--max-games", type=int, default=100000)
+    serve_parser.add_argument("--book", metavar="FILE", help="Polyglot opening book for hints")
+    serve_parser.add_argument("--endgames", metavar="DIR", help="endgame tables for hints")
+
+    load_parser = commands.add_parser(
+        "load", help="load-test a server, starting one unless --port or --unix is given")
+    load_parser.add_argument("--games", type=int, default=1000)
+    load_parser.add_argument("--plies", type=int, default=20)
+    load_parser.add_argument("--connections", type=int, default=50)
+    load_parser.add_argument("--seed", type=int, default=0)
+    load_parser.add_argument("--host", default="127.0.0.1")
+    load_parser.add_argument("--port", type=int, default=None)
+    load_parser.add_argument("--unix", metavar="PATH")
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(
+                args.host, args.port, args.unix, args.max_games, args.book, args.endgames))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    process = None
+    port = args.port
+    if port is None and not args.unix:
+        process, port = start_server_process(args.games)
+    try:
+        report = asyncio.run(load_test(
+            args.games, args.plies, min(args.connections, args.games), args.seed,
+            args.host, port, args.unix,
+        ))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print(
+        f"{report['games']} games, {report['moves']} moves in {report['seconds']:.2f} s: "
+        f"{report['moves_per_second']:.0f} moves/s, "
+        f"p50 {report['p50_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms, "
+        f"server maxrss {report['server_maxrss_kb'] / 1024:.0f} MB"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+""" Tests for Polyglot keys and opening books """
+import random
+
+import pytest
+
+from book import Book, book_entries, move_from_polyglot, polyglot_key, polyglot_move, write_book
+from engine import Engine
+from fen import START_FEN, parse_fen
+from pgn import read_games
+from rules import move_name, parse_square
+
+GAMES = """[Event "a"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 *
+
+[Event "b"]
+
+1. e4 c5 2. Nf3 d6 *
+
+[Event "c"]
+
+1. d4 d5 *
+"""
+CASTLING = "r1bqk1nr/pppp1ppp/2n5/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"
+
+
+@pytest.mark.parametrize("fen, key", [
+    # Reference keys from the Polyglot book format description
+    (START_FEN, 0x463B96181691FC9C),
+    ("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1", 0x823C9B50FD114196),
+    ("rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2", 0x0756B94461C50FB0),
+    ("rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3", 0x22A48B5A8E47FF78),
+    ("rnbq1bnr/ppp1pkpp/8/3pPp2/8/8/PPPPKPPP/RNBQ1BNR w - - 0 4", 0x00FDD303C946BDD9),
+])
+def test_polyglot_keys_match_the_reference(fen, key):
+    assert polyglot_key(parse_fen(fen)) == key
+
+
+@pytest.fixture
+def book(tmp_path):
+    path = tmp_path / "book.bin"
+    write_book(path, book_entries(read_games(GAMES.splitlines(keepends=True))))
+    with Book(path) as opened:
+        yield opened
+
+
+def test_book_moves_are_weighted_by_games(book):
+    found = [(move_name(move), weight) for move, weight in book.moves(parse_fen(START_FEN))]
+    assert found == [("e2e4", 2), ("d2d4", 1)]
+    assert move_name(book.choose(parse_fen(START_FEN))) == "e2e4"
+    picks = {move_name(book.choose(parse_fen(START_FEN), random.Random(seed))) for seed in range(40)}
+    assert picks == {"e2e4", "d2d4"}
+
+
+def test_castling_is_stored_as_king_takes_rook(book):
+    piece_set = parse_fen(CASTLING)
+    entries = book.entries(polyglot_key(piece_set))
+    assert [raw for raw, weight, learn in entries] == [
+        polyglot_move(parse_square("e1"), parse_square("h1"))]
+    assert [move_name(move) for move, weight in book.moves(piece_set)] == ["e1g1"]
+
+
+def test_out_of_book_and_illegal_entries_give_nothing(book):
+    assert book.choose(parse_fen("4k3/8/8/8/8/8/8/4K2R w K - 0 1")) is None
+    piece_set = parse_fen(START_FEN)
+    assert move_from_polyglot(piece_set, polyglot_move(parse_square("e2"), parse_square("e5"))) is None
+    assert move_from_polyglot(piece_set, polyglot_move(parse_square("e7"), parse_square("e5"))) is None
+
+
+def test_engine_plays_from_the_book_without_searching(book):
+    result = Engine(1, book).search(parse_fen(START_FEN), 4)
+    assert move_name(result.move) == "e2e4"
+    assert result.depth == 0 and result.nodes == 0
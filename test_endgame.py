@@ -0,0 +1,56 @@
+""" Tests for the KQK and KRK endgame tables """
+import pytest
+
+from engine import Engine
+from fen import parse_fen
+from rules import game_result, move_name
+
+pytest.importorskip("numpy")
+
+from endgame import DRAW, LOSS, WIN, EndgameTables, build  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def tables(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("egtb")
+    build(str(directory))
+    with EndgameTables(str(directory)) as opened:
+        yield opened
+
+
+@pytest.mark.parametrize("fen, expected", [
+    ("6k1/8/6K1/8/8/8/8/Q7 w - - 0 1", (WIN, 1)),
+    ("k7/8/1K6/8/8/8/8/7R w - - 0 1", (WIN, 1)),
+    # The same, strong side black
+    ("7r/8/8/8/8/1k6/8/K7 b - - 0 1", (WIN, 1)),
+    ("6k1/8/6K1/8/8/8/8/Q7 b - - 0 1", (LOSS, 4)),
+    # The lone king takes the undefended rook
+    ("8/8/8/8/8/2k5/3R4/7K b - - 0 1", (DRAW, 0)),
+])
+def test_probe(tables, fen, expected):
+    assert tables.probe(parse_fen(fen)) == expected
+
+
+def test_tables_cover_only_their_endings(tables):
+    assert tables.probe(parse_fen("4k3/8/8/8/8/8/8/B3K3 w - - 0 1")) is None
+    assert tables.probe(parse_fen("4k3/7p/8/8/8/8/8/Q3K3 w - - 0 1")) is None
+
+
+def test_best_move_mates_as_fast_as_the_table_says(tables):
+    piece_set = parse_fen("8/8/8/4k3/8/8/8/R3K3 w - - 0 1")
+    outcome, plies = tables.probe(piece_set)
+    assert outcome == WIN
+    played = 0
+    while game_result(piece_set) is None:
+        move, outcome, remaining = tables.best_move(piece_set)
+        piece_set.board.make_move(*move)
+        piece_set = piece_set.opponent
+        played += 1
+    assert game_result(piece_set)[1] == "checkmate"
+    assert played == plies
+
+
+def test_engine_answers_from_the_tables_without_searching(tables):
+    result = Engine(1, None, tables).search(parse_fen("k7/8/1K6/8/8/8/8/7R w - - 0 1"), 4)
+    assert move_name(result.move) == "h1h8"
+    assert result.depth == 0 and result.nodes == 0
@@ -0,0 +1,79 @@
+""" Tests for the search engine: budgets, results and the worker entry point """
+import time
+
+import pytest
+
+from engine import Engine, search_fen, start_worker
+from fen import START_FEN, parse_fen
+from rules import legal_moves, move_name
+
+MIDDLEGAME = "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return Engine(1)
+
+
+def legal_names(fen):
+    return {move_name(move) for move in legal_moves(parse_fen(fen))}
+
+
+@pytest.mark.parametrize("node_limit", [100, 2000])
+def test_node_limit_is_honoured(engine, node_limit):
+    result = engine.search(parse_fen(MIDDLEGAME), node_limit=node_limit)
+    assert result.nodes <= node_limit
+    assert move_name(result.move) in legal_names(MIDDLEGAME)
+
+
+def test_time_limit_is_honoured(engine):
+    start = time.perf_counter()
+    result = engine.search(parse_fen(MIDDLEGAME), time_limit=0.1)
+    assert time.perf_counter() - start < 0.5
+    assert move_name(result.move) in legal_names(MIDDLEGAME)
+
+
+def test_stop_before_depth_one_still_gives_a_legal_move(engine):
+    result = engine.search(parse_fen(MIDDLEGAME), node_limit=1)
+    assert result.depth == 0
+    assert move_name(result.move) in legal_names(MIDDLEGAME)
+    assert result.pv == [move_name(result.move)]
+
+
+def test_depth_limit_completes_every_depth(engine):
+    depths = []
+    result = engine.search(parse_fen(START_FEN), 3, info=lambda found: depths.append(found.depth))
+    assert depths == [1, 2, 3]
+    assert result.depth == 3
+    assert all(isinstance(name, str) for name in result.pv)
+
+
+def test_finds_mate_in_one(engine):
+    result = engine.search(parse_fen("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1"), 3)
+    assert move_name(result.move) == "a1a8"
+
+
+def test_no_legal_moves(engine):
+    mated = engine.search(parse_fen("R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1"), 3)
+    stalemated = engine.search(parse_fen("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1"), 3)
+    assert mated.move is None and mated.score < 0
+    assert stalemated.move is None and stalemated.score == 0
+
+
+def test_only_moves_restricts_the_root(engine):
+    result = engine.search(parse_fen(START_FEN), 2, only_moves=["a2a3", "h2h3"])
+    assert move_name(result.move) in ("a2a3", "h2h3")
+
+
+def test_second_search_hits_the_table(engine):
+    engine.search(parse_fen(MIDDLEGAME), 3)
+    hits = engine.table.hits
+    engine.search(parse_fen(MIDDLEGAME), 3)
+    assert engine.table.hits > hits
+
+
+def test_search_fen_names_its_move():
+    start_worker(1)
+    found = search_fen(MIDDLEGAME, 2)
+    assert found["move"] in legal_names(MIDDLEGAME)
+    assert found["depth"] == 2 and found["nodes"] > 0
@@ -0,0 +1,102 @@
+""" Tests for FEN and EPD reading and writing, and binary position records """
+import io
+
+import pytest
+
+from fen import (
+    RECORD_SIZE,
+    START_FEN,
+    FenError,
+    board_to_epd,
+    board_to_fen,
+    decode_position,
+    decode_positions,
+    encode_position,
+    encode_positions,
+    parse_epd,
+    parse_fen,
+    read_positions,
+    write_positions,
+)
+
+POSITIONS = [
+    START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 12 40",
+    "r3k2r/8/8/8/8/8/8/R3K2R b Kq - 3 17",
+]
+
+
+@pytest.mark.parametrize("fen", [
+    # Wrong row for the side that just moved
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e4 0 1",
+    # Off the board
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e9 0 1",
+    # No pawn that can have just passed
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR b KQkq e3 0 1",
+    # The square the pawn came from is occupied
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPPNPPP/RNBQKB1R b KQkq e3 0 1",
+    # The side to move could take the king
+    "4k3/4R3/8/8/8/8/8/4K3 w - - 0 1",
+    "8/8/8/3kK3/8/8/8/8 b - - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KX - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1",
+    "rnbq1bnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQ - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKKNR w KQkq - 0 1",
+    "not a fen",
+])
+def test_bad_fen_raises_fen_error(fen):
+    with pytest.raises(FenError):
+        parse_fen(fen)
+
+
+def test_the_side_to_move_may_be_in_check():
+    piece_set = parse_fen("4k3/4R3/8/8/8/8/8/4K3 b - - 0 1")
+    assert piece_set.color == "black"
+
+
+@pytest.mark.parametrize("fen", POSITIONS)
+def test_fen_reads_back(fen):
+    assert board_to_fen(parse_fen(fen)) == fen
+
+
+def test_epd_keeps_its_operations():
+    line = 'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - bm O-O; id "castle test";'
+    piece_set, operations = parse_epd(line)
+    assert operations == {"bm": "O-O", "id": "castle test"}
+    assert board_to_epd(piece_set, operations) == line
+
+
+@pytest.mark.parametrize("fen", POSITIONS)
+def test_record_reads_back(fen):
+    record = encode_position(parse_fen(fen))
+    assert len(record) == RECORD_SIZE
+    assert board_to_fen(decode_position(record)) == fen
+
+
+def test_records_stream_through_a_file():
+    stream = io.BytesIO()
+    assert write_positions(stream, (parse_fen(fen) for fen in POSITIONS)) == len(POSITIONS)
+    assert stream.getvalue() == encode_positions(parse_fen(fen) for fen in POSITIONS)
+    stream.seek(0)
+    assert [board_to_fen(side) for side in read_positions(stream)] == POSITIONS
+    assert [board_to_fen(side) for side in decode_positions(stream.getvalue())] == POSITIONS
+
+
+def test_bad_records_raise_fen_error():
+    record = bytearray(encode_position(parse_fen(START_FEN)))
+    with pytest.raises(FenError):
+        decode_position(bytes(record[:-1]))
+    # Piece code 15 is unused
+    record[8] |= 0x0F
+    with pytest.raises(FenError):
+        decode_position(bytes(record))
+    # The same board with the other side to move lets a king be taken
+    record = bytearray(encode_position(parse_fen("4k3/4R3/8/8/8/8/8/4K3 b - - 0 1")))
+    record[24] &= ~1
+    with pytest.raises(FenError):
+        decode_position(bytes(record))
@@ -0,0 +1,21 @@
+""" Tests for root-split search and streamed batch analysis """
+from fen import START_FEN, parse_fen
+from parallel import analyse_batch, parallel_search
+from rules import legal_moves, move_name
+
+MATE_IN_ONE = "6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1"
+
+
+def test_bad_fen_in_a_batch_gives_an_error_record_and_the_rest_still_run():
+    fens = [START_FEN, "not a fen", "8/8/8/8/8/8/8/8 w - - 0 1", MATE_IN_ONE]
+    results = {index: result for index, fen, result in analyse_batch(fens, 2, 2)}
+    assert sorted(results) == [0, 1, 2, 3]
+    assert "error" in results[1] and "error" in results[2]
+    assert results[0]["move"] in {move_name(move) for move in legal_moves(parse_fen(START_FEN))}
+    assert results[3]["move"] == "a1a8"
+
+
+def test_root_split_search_agrees_on_a_mate():
+    move, score, depth, nodes, elapsed = parallel_search(MATE_IN_ONE, 2, 2)
+    assert move == "a1a8"
+    assert depth >= 1 and nodes > 0
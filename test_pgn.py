@@ -0,0 +1,98 @@
+""" Tests for the PGN reader, SAN and game replay """
+import pytest
+
+from fen import parse_fen
+from pgn import IllegalMoveError, format_game, parse_san, read_games, replay, san_name
+from rules import legal_moves
+
+SCHOLARS_MATE = """[Event "Casual"]
+[White "A"]
+[Black "B"]
+[Result "1-0"]
+
+1. e4 e5 {a comment
+spanning lines} 2. Bc4 (2. Nf3 Nc6) Nc6 3.Qh5 $2 Nf6?? ; rest of line
+4. Qxf7# 1-0
+"""
+
+
+def lines(text):
+    return text.splitlines(keepends=True)
+
+
+def test_reads_tags_and_main_line_only():
+    games = list(read_games(lines(SCHOLARS_MATE + "\n" + SCHOLARS_MATE)))
+    assert len(games) == 2
+    game = games[0]
+    assert game.headers["White"] == "A" and game.result == "1-0"
+    assert game.moves == ["e4", "e5", "Bc4", "Nc6", "Qh5", "Nf6??", "Qxf7#"]
+
+
+def test_replays_a_legal_game_with_its_material_timeline():
+    outcome = replay(next(read_games(lines(SCHOLARS_MATE))), with_timeline=True)
+    assert outcome.illegal is None
+    assert outcome.plies == 7
+    assert outcome.timeline[-1] == (1, 0)
+
+
+def test_reports_the_first_illegal_move():
+    game = next(read_games(lines("1. e4 e5 2. Ke3 Nc6 *\n")))
+    outcome = replay(game)
+    assert outcome.plies == 2
+    assert outcome.illegal[:2] == (3, "Ke3")
+
+
+@pytest.mark.parametrize("movetext", ["1. e4 *", "*"])
+def test_reports_a_bad_fen_tag(movetext):
+    text = f'[SetUp "1"]\n[FEN "8/8/8/8/8/8/8/8 w - - 0 1"]\n\n{movetext}\n'
+    outcome = replay(next(read_games(lines(text))))
+    assert outcome.plies == 0
+    ply, san, reason = outcome.illegal
+    assert ply == 1
+    assert san == ("e4" if "e4" in movetext else None)
+    assert "king" in reason
+
+
+@pytest.mark.parametrize("fen, san", [
+    # Knights on b1 and f3 can both reach d2
+    ("4k3/8/8/8/8/5N2/8/1N2K3 w - - 0 1", "Nbd2"),
+    # Rooks on a1 and a5 share a file
+    ("4k3/8/8/R7/8/8/8/R3K3 w - - 0 1", "R1a3"),
+    ("r3k3/8/8/8/8/8/8/4K2R w Kq - 0 1", "O-O"),
+    ("r3k3/8/8/8/8/8/8/4K2R b Kq - 0 1", "O-O-O"),
+    ("4k3/1P6/8/8/8/8/8/4K3 w - - 0 1", "b8=N"),
+    ("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1", "Ra8#"),
+])
+def test_san_names_and_reads_back(fen, san):
+    piece_set = parse_fen(fen)
+    move = parse_san(piece_set, san)
+    assert san_name(piece_set, move) == san
+
+
+def test_every_legal_move_reads_back_from_its_san():
+    piece_set = parse_fen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+    for move in legal_moves(piece_set):
+        assert parse_san(piece_set, san_name(piece_set, move)) == move
+
+
+def test_ambiguous_and_impossible_san_are_rejected():
+    piece_set = parse_fen("4k3/8/8/8/8/5N2/8/1N2K3 w - - 0 1")
+    with pytest.raises(IllegalMoveError):
+        parse_san(piece_set, "Nd2")
+    with pytest.raises(IllegalMoveError):
+        parse_san(piece_set, "Qd4")
+
+
+def test_formatted_game_reads_back():
+    game = next(read_games(lines(SCHOLARS_MATE)))
+    text = format_game(game.headers, game.moves, game.result)
+    again = next(read_games(lines(text)))
+    assert again.headers == game.headers
+    assert again.moves == game.moves and again.result == game.result
+
+
+def test_fen_tag_with_a_king_en_prise_is_reported_not_replayed():
+    text = '[SetUp "1"]\n[FEN "4k3/4R3/8/8/8/8/8/4K3 w - - 0 1"]\n\n1. Rxe8 *\n'
+    outcome = replay(next(read_games(lines(text))))
+    assert outcome.plies == 0
+    assert outcome.illegal[:2] == (1, "Rxe8")
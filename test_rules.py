@@ -0,0 +1,152 @@
+""" Tests for the rules core: the move table cache, castling, en passant
+and promotion made and taken back, and the end of the game """
+import pytest
+
+from game import GameState
+from rules import legal_move_table, legal_moves, piece_letters, square_name
+
+# The same position with white's knights on c3 and f3, reached with the b1
+# and g1 knights swapped
+KNIGHTS_DIRECT = ["b1c3", "b8c6", "g1f3", "c6b8"]
+KNIGHTS_SWAPPED = [
+    "g1h3", "b8c6", "h3f4", "c6b8",
+    "f4d5", "b8c6", "d5c3", "c6b8",
+    "b1a3", "b8c6", "a3c4", "c6b8",
+    "c4e5", "b8c6", "e5f3", "c6b8",
+]
+
+
+def play(game, names):
+    for name in names:
+        game.play(name)
+
+
+def undo_all(game):
+    while game.history:
+        game.undo()
+
+
+def uncached_names(piece_set):
+    names = set()
+    for move in legal_moves(piece_set):
+        name = square_name(move[0].location) + square_name(move[1])
+        if len(move) == 3:
+            name += piece_letters[move[2]]
+        names.add(name)
+    return names
+
+
+def test_transposed_position_reuses_the_move_table():
+    game = GameState()
+    play(game, KNIGHTS_DIRECT)
+    fen = game.fen().rsplit(" ", 2)[0]
+    undo_all(game)
+    play(game, KNIGHTS_SWAPPED)
+    assert game.fen().rsplit(" ", 2)[0] == fen
+    table = legal_move_table(game.side)
+    squares = game.board.squares
+    for origin in table.moves:
+        assert squares[origin] is not None and squares[origin].set is game.side
+    assert set(game.legal_move_names()) == uncached_names(game.side)
+
+
+def test_transposed_position_is_a_cache_hit_keyed_by_square():
+    game = GameState()
+    play(game, KNIGHTS_DIRECT)
+    first = legal_move_table(game.side)
+    undo_all(game)
+    play(game, KNIGHTS_SWAPPED)
+    table = legal_move_table(game.side)
+    assert table is first
+    squares = game.board.squares
+    assert sorted(table.moves) == sorted(piece.location for piece in game.side.pieces.values())
+    knights = {square_name(square): table.moves[square] for square in table.moves
+               if squares[square].piece_type == "knight"}
+    assert sorted(square_name(target) for target in knights["f3"]) == [
+        "d4", "e5", "g1", "g5", "h4"]
+    assert sorted(square_name(target) for target in knights["c3"]) == [
+        "a4", "b1", "b5", "d5", "e4"]
+
+
+def test_transposed_position_moves_the_piece_on_the_origin_square():
+    game = GameState()
+    play(game, KNIGHTS_DIRECT)
+    undo_all(game)
+    play(game, KNIGHTS_SWAPPED)
+    game.play("f3d4")
+    assert game.board.squares[35].piece_type == "knight"
+    assert game.board.squares[45] is None
+    assert game.board.hash == game.board.compute_hash()
+    # f3b5 is a knight move from c3, not from f3
+    game.undo()
+    with pytest.raises(ValueError):
+        game.play("f3b5")
+
+
+@pytest.mark.parametrize("move, king, rook, rook_origin", [
+    ("e1g1", "g1", "f1", "h1"),
+    ("e1c1", "c1", "d1", "a1"),
+])
+def test_castling_make_and_unmake(move, king, rook, rook_origin):
+    fen = "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"
+    game = GameState(fen)
+    start_hash = game.board.hash
+    game.play(move)
+    squares = game.board.squares
+    names = {square_name(square): piece for square, piece in enumerate(squares)}
+    assert names[king].piece_type == "king"
+    assert names[rook].piece_type == "rook"
+    assert names["e1"] is None and names[rook_origin] is None
+    assert game.fen().split()[2] == "kq"
+    assert game.board.hash == game.board.compute_hash()
+    game.undo()
+    assert game.fen() == fen
+    assert game.board.hash == start_hash
+
+
+def test_en_passant_make_and_unmake():
+    fen = "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3"
+    game = GameState(fen)
+    start_hash = game.board.hash
+    assert "e5f6" in game.legal_move_names()
+    captured = game.play("e5f6")
+    assert captured.piece_type == "pawn"
+    names = {square_name(square): piece for square, piece in enumerate(game.board.squares)}
+    assert names["f5"] is None and names["e5"] is None
+    assert names["f6"].piece_type == "pawn"
+    assert game.board.hash == game.board.compute_hash()
+    game.undo()
+    assert game.fen() == fen
+    assert game.board.hash == start_hash
+
+
+def test_promotion_offers_every_piece_and_unmakes_cleanly():
+    fen = "1r2k3/P7/8/8/8/8/8/4K3 w - - 0 1"
+    game = GameState(fen)
+    names = game.legal_move_names()
+    assert {name for name in names if name.startswith("a7")} == {
+        "a7a8q", "a7a8r", "a7a8b", "a7a8n", "a7b8q", "a7b8r", "a7b8b", "a7b8n"}
+    start_hash = game.board.hash
+    captured = game.play("a7b8n")
+    assert captured.piece_type == "rook"
+    assert game.board.squares[1].piece_type == "knight"
+    assert game.board.hash == game.board.compute_hash()
+    game.undo()
+    assert game.fen() == fen and game.board.hash == start_hash
+    assert game.board.squares[8].piece_type == "pawn"
+
+
+@pytest.mark.parametrize("fen, moves, expected", [
+    ("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1", ["a1a8"], ("1-0", "checkmate")),
+    ("7k/8/6K1/8/8/8/8/5Q2 w - - 0 1", ["f1f7"], ("1/2-1/2", "stalemate")),
+    ("4k3/8/8/8/8/8/8/R3K3 w - - 99 80", ["a1a2"], ("1/2-1/2", "fifty-move rule")),
+    ("4k3/8/8/8/8/8/3r4/4K3 w - - 0 1", ["e1d2"], ("1/2-1/2", "insufficient material")),
+    ("4k3/8/8/8/8/8/8/R3K3 w - - 0 1", ["a1a2", "e8d8", "a2a1", "d8e8"] * 2,
+     ("1/2-1/2", "threefold repetition")),
+])
+def test_game_end(fen, moves, expected):
+    game = GameState(fen)
+    play(game, moves[:-1])
+    assert game.result is None
+    game.play(moves[-1])
+    assert (game.result, game.reason) == expected
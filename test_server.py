@@ -0,0 +1,136 @@
+""" Tests for the game server's protocol, game state and load client """
+import asyncio
+import json
+
+import pytest
+
+from fen import START_FEN
+from game import GameState
+from pgn import IllegalMoveError
+from server import GameServer, load_test
+
+# White's king takes the last black piece, leaving bare kings
+BARE_KINGS_NEXT = "4k3/8/8/8/8/8/3r4/4K3 w - - 0 1"
+
+
+@pytest.fixture
+def server():
+    game_server = GameServer(10)
+    yield game_server
+    game_server.close()
+
+
+def ask(server, request):
+    line = request if isinstance(request, (str, bytes)) else json.dumps(request)
+    return asyncio.run(server.handle(line))
+
+
+def new_game(server, fen=None):
+    request = {"op": "new"} if fen is None else {"op": "new", "fen": fen}
+    return ask(server, request)["game"]
+
+
+def test_a_game_from_start_to_close(server):
+    game = new_game(server)
+    moves = ask(server, {"id": 1, "op": "moves", "game": game})
+    assert moves["ok"] and moves["id"] == 1
+    assert len(moves["moves"]) == 20 and moves["result"] is None
+    played = ask(server, {"op": "move", "game": game, "move": "e2e4"})
+    assert played["ok"] and played["to_move"] == "black"
+    assert ask(server, {"op": "undo", "game": game})["fen"] == START_FEN
+    assert ask(server, {"op": "state", "game": game})["fen"] == START_FEN
+    assert ask(server, {"op": "close", "game": game})["ok"]
+    assert not ask(server, {"op": "state", "game": game})["ok"]
+
+
+@pytest.mark.parametrize("request_line", [
+    "not json",
+    "[1, 2]",
+    '{"op": "fly"}',
+    '{"op": "state"}',
+    '{"op": "state", "game": true}',
+    '{"op": "state", "game": [1]}',
+    '{"op": "new", "fen": 5}',
+    '{"op": "new", "fen": "8/8/8/8/8/8/8/8 w - - 0 1"}',
+    '{"op": "new", "fen": "4k3/4R3/8/8/8/8/8/4K3 w - - 0 1"}',
+])
+def test_bad_requests_get_an_error_reply(server, request_line):
+    response = ask(server, request_line)
+    assert response["ok"] is False and response["error"]
+
+
+def test_bad_moves_get_an_error_reply(server):
+    game = new_game(server)
+    for move in (None, 5, "e2e5", "e7e5"):
+        response = ask(server, {"op": "move", "game": game, "move": move})
+        assert response["ok"] is False
+    assert ask(server, {"op": "state", "game": game})["fen"] == START_FEN
+
+
+def test_server_refuses_games_past_its_limit():
+    game_server = GameServer(2)
+    new_game(game_server)
+    new_game(game_server)
+    assert not ask(game_server, {"op": "new"})["ok"]
+
+
+def test_finished_game_offers_no_moves(server):
+    game = new_game(server, BARE_KINGS_NEXT)
+    played = ask(server, {"op": "move", "game": game, "move": "e1d2"})
+    assert played["result"] == "1/2-1/2"
+    moves = ask(server, {"op": "moves", "game": game})
+    assert moves["moves"] == []
+    assert (moves["result"], moves["reason"]) == ("1/2-1/2", "insufficient material")
+    response = ask(server, {"op": "move", "game": game, "move": "e8e7"})
+    assert response["ok"] is False and "over" in response["error"]
+    assert not ask(server, {"op": "hint", "game": game})["ok"]
+
+
+def test_hint_names_a_legal_move(server):
+    game = new_game(server)
+    hint = ask(server, {"op": "hint", "game": game})
+    assert hint["ok"]
+    assert hint["move"] in ask(server, {"op": "moves", "game": game})["moves"]
+
+
+def test_a_handler_bug_is_reported_not_raised(server, monkeypatch):
+    def broken(request):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server, "op_stats", broken)
+    response = ask(server, {"id": 7, "op": "stats"})
+    assert response == {"ok": False, "error": "internal error: RuntimeError: boom", "id": 7}
+
+
+def test_failed_move_leaves_the_game_as_it_was(monkeypatch):
+    game = GameState()
+    hash_before = game.board.hash
+
+    def broken():
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(GameState, "update_result", lambda self: broken())
+    with pytest.raises(RuntimeError):
+        game.play("e2e4")
+    monkeypatch.undo()
+    assert game.fen() == START_FEN and game.board.hash == hash_before
+    assert game.history == [] and game.side_to_move == "white"
+    game.play("e2e4")
+    with pytest.raises(IllegalMoveError):
+        game.play("e2e4")
+
+
+def test_load_client_retires_finished_games():
+    async def run():
+        game_server = GameServer(100)
+        listener = await asyncio.start_server(game_server.serve_connection, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            async with listener:
+                return await load_test(6, 400, 2, port=port), game_server
+        finally:
+            game_server.close()
+
+    stats, game_server = asyncio.run(run())
+    assert stats["moves"] > 0
+    assert game_server.games == {}
@@ -0,0 +1,86 @@
+""" Tests for Zobrist hashing and the transposition table """
+import os
+import subprocess
+import sys
+
+from fen import START_FEN, parse_fen
+from game import GameState
+from transposition import EXACT, LOWER_BOUND, TranspositionTable
+
+
+def hash_after(names, fen=START_FEN):
+    game = GameState(fen)
+    for name in names:
+        game.play(name)
+        assert game.board.hash == game.board.compute_hash()
+    return game.board.hash
+
+
+def test_move_orders_reaching_one_position_hash_alike():
+    assert hash_after(["g1f3", "g8f6", "b1c3", "b8c6"]) == hash_after(
+        ["b1c3", "b8c6", "g1f3", "g8f6"])
+
+
+def test_hash_tells_apart_side_castling_and_en_passant():
+    hashes = {
+        parse_fen(fen).board.hash for fen in (
+            "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1",
+            "r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1",
+            "r3k2r/8/8/8/8/8/8/R3K2R w Kkq - 0 1",
+            "rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1",
+            "rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1",
+        )
+    }
+    assert len(hashes) == 5
+
+
+def test_hash_survives_castling_captures_and_take_backs():
+    game = GameState("r3k2r/p1pp1pb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+    start = game.board.hash
+    for name in ["e1g1", "b4c3", "d2c3", "e8c8", "e5f7", "h3g2"]:
+        game.play(name)
+        assert game.board.hash == game.board.compute_hash()
+    while game.history:
+        game.undo()
+    assert game.board.hash == start
+
+
+def test_keys_are_the_same_in_every_process():
+    code = "from fen import START_FEN, parse_fen; print(parse_fen(START_FEN).board.hash)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert int(output.stdout) == parse_fen(START_FEN).board.hash
+
+
+def test_table_returns_what_was_stored():
+    table = TranspositionTable(1)
+    table.store(12345, 4, -30, LOWER_BOUND, 777)
+    assert table.probe(12345) == (4, -30, LOWER_BOUND, 777)
+    assert table.probe(54321) is None
+    assert table.stats()["hits"] == 1 and table.stats()["misses"] == 1
+
+
+def test_deeper_entry_keeps_its_slot_within_a_search():
+    table = TranspositionTable(1)
+    buckets = table.size >> 1
+    deep, shallow, other = 7, 7 + buckets, 7 + 2 * buckets
+    table.store(deep, 6, 10, EXACT)
+    table.store(shallow, 2, 20, EXACT)
+    table.store(other, 1, 30, EXACT)
+    assert table.probe(deep) == (6, 10, EXACT, 0)
+    assert table.probe(shallow) is None
+    assert table.probe(other) == (1, 30, EXACT, 0)
+    # Left over from an earlier search, the deep entry gives way
+    table.new_search()
+    table.store(shallow, 2, 20, EXACT)
+    assert table.probe(deep) is None
+    assert table.probe(shallow) == (2, 20, EXACT, 0)
+
+
+def test_clear_empties_the_table():
+    table = TranspositionTable(1)
+    table.store(99, 3, 5, EXACT)
+    table.clear()
+    assert table.probe(99) is None
+    assert table.usage() == 0.0
@@ -0,0 +1,94 @@
+""" Fixed-size transposition table keyed by Board.hash """
+from array import array
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Bytes per entry across the parallel arrays below:
+# key 8, score 4, move 4, depth 2, flag 1, age 1
+ENTRY_BYTES = 20
+
+
+class TranspositionTable:
+
+    """ Hash table of search results with a fixed memory cost.
+
+    Entries live in parallel typed arrays, so the table takes size_mb
+    megabytes up front and never grows. Slots are paired into buckets of
+    two: the first keeps the deepest result seen for its bucket (unless it
+    is left over from an older search), the second is always overwritten. """
+
+    def __init__(self, size_mb=16):
+        buckets = max(1, size_mb * 1024 * 1024 // (ENTRY_BYTES * 2))
+        self.size = buckets * 2
+        self.keys = array("Q", bytes(8 * self.size))
+        self.scores = array("i", bytes(4 * self.size))
+        self.moves = array("I", bytes(4 * self.size))
+        self.depths = array("h", bytes(2 * self.size))
+        self.flags = array("B", bytes(self.size))
+        self.ages = array("B", bytes(self.size))
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        """ Age the table so entries from earlier searches get replaced first """
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        for table in (self.keys, self.scores, self.moves, self.depths, self.flags, self.ages):
+            for index in range(self.size):
+                table[index] = 0
+        self.age = 0
+        self.probes = self.hits = self.stores = self.overwrites = 0
+
+    def probe(self, key):
+        """ (depth, score, flag, move) stored for key, or None """
+        self.probes += 1
+        index = (key % (self.size >> 1)) << 1
+        for slot in (index, index + 1):
+            if self.keys[slot] == key:
+                self.hits += 1
+                return self.depths[slot], self.scores[slot], self.flags[slot], self.moves[slot]
+        return None
+
+    def store(self, key, depth, score, flag, move=0):
+        self.stores += 1
+        index = (key % (self.size >> 1)) << 1
+        if self.keys[index] == key or (
+            depth >= self.depths[index] or self.ages[index] != self.age
+        ):
+            slot = index
+        else:
+            slot = index + 1
+        if self.keys[slot] != key and self.keys[slot] != 0:
+            self.overwrites += 1
+        self.keys[slot] = key
+        self.scores[slot] = score
+        self.moves[slot] = move
+        self.depths[slot] = depth
+        self.flags[slot] = flag
+        self.ages[slot] = self.age
+
+    def usage(self):
+        """ Fraction of slots holding an entry """
+        used = 0
+        for key in self.keys:
+            if key:
+                used += 1
+        return used / self.size
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "megabytes": self.size * ENTRY_BYTES / (1024 * 1024),
+            "probes": self.probes,
+            "hits": self.hits,
+            "misses": self.probes - self.hits,
+            "hit_rate": self.hits / self.probes if self.probes else 0.0,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+        }